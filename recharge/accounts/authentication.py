@@ -0,0 +1,179 @@
+"""
+Token authentication backed by an in-process cache.
+
+``CachedTokenAuthentication`` resolves ``token -> user -> seller`` from a
+bounded LRU with a TTL (``TOKEN_AUTH_CACHE`` in settings), so a warm request
+authenticates and passes IsSeller/IsAdminUser without touching the database.
+Entries are dropped by signals when a token is deleted or its user or seller
+changes (see accounts/signals.py); the TTL bounds staleness for changes that
+bypass signals, such as ``QuerySet.update()`` or writes from other processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import User, Seller
+
+
+DEFAULTS = {
+    'SIZE': 10000,
+    'TTL': 60,
+}
+
+# Seller columns kept in the cache; credit_shards is only a routing hint for
+# debit_seller, which re-reads it when it turns out to be stale
+SELLER_FIELDS = ('id', 'user_id', 'credit_shards')
+
+
+class TokenCache:
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, token):
+        user = token.user
+        try:
+            seller = user.seller_profile
+        except Seller.DoesNotExist:
+            seller = None
+
+        entry = (
+            time.monotonic() + self.ttl,
+            user.pk,
+            token.created,
+            tuple(getattr(user, field.attname) for field in User._meta.concrete_fields),
+            tuple(getattr(seller, field) for field in SELLER_FIELDS) if seller else None,
+        )
+        with self._lock:
+            self._pop(token.key)
+            self._data[token.key] = entry
+            self._keys_by_user.setdefault(user.pk, set()).add(token.key)
+            while len(self._data) > self.size:
+                self._pop(next(iter(self._data)))
+        return entry
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_user.get(entry[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_user[entry[1]]
+
+    def invalidate_token(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._keys_by_user.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+                _cache = TokenCache(config['SIZE'], config['TTL'])
+    return _cache
+
+
+def _build(key, entry):
+    """Fresh User/Token (and primed seller_profile) instances for one request."""
+    created, user_values, seller_values = entry[2:]
+    user = User.from_db('default', [field.attname for field in User._meta.concrete_fields], user_values)
+    seller = Seller.from_db('default', SELLER_FIELDS, seller_values) if seller_values else None
+    User.seller_profile.related.set_cached_value(user, seller)
+    if seller is not None:
+        Seller.user.field.set_cached_value(seller, user)
+
+    token = Token(key=key, user=user, created=created)
+    token._state.adding = False
+    return user, token
+
+
+def _load(key):
+    token = Token.objects.select_related('user__seller_profile').get(key=key)
+    if not token.user.is_active:
+        return None
+    return get_token_cache().set(token)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        entry = get_token_cache().get(key)
+        if entry is None:
+            try:
+                entry = _load(key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if entry is None:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return _build(key, entry)
+
+
+async def aauthenticate_token(request):
+    """
+    Async counterpart of DRF's TokenAuthentication for plain Django async views.
+
+    Returns the active user for the ``Authorization: Token <key>`` header, or None.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0].lower() != 'token':
+        return None
+
+    key = header[1]
+    entry = get_token_cache().get(key)
+    if entry is None:
+        try:
+            token = await Token.objects.select_related('user__seller_profile').aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        if not token.user.is_active:
+            return None
+        entry = get_token_cache().set(token)
+
+    user, _token = _build(key, entry)
+    return user
+
+
+def error_response(detail, status):
+    return JsonResponse({"detail": detail}, status=status)
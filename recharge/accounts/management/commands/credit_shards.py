@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import Seller
+from accounts.shards import (
+    enable_credit_shards, disable_credit_shards, fold_credit_shards, check_credit_shards
+)
+
+
+class Command(BaseCommand):
+    help = 'Enables, disables, folds or checks sharded seller credit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['enable', 'disable', 'fold', 'check'])
+        parser.add_argument('--seller-id', type=int, help='Seller to act on (fold/check default to every sharded seller)')
+        parser.add_argument('--shards', type=int, default=8, help='Number of shards when enabling')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        seller_id = options['seller_id']
+
+        if action in ['enable', 'disable'] and seller_id is None:
+            raise CommandError(f'--seller-id is required to {action} credit shards')
+
+        try:
+            if action == 'enable':
+                enable_credit_shards(seller_id, options['shards'])
+                self.stdout.write(self.style.SUCCESS(f'Seller {seller_id} credit split into {options["shards"]} shards'))
+                return
+
+            if action == 'disable':
+                credit = disable_credit_shards(seller_id)
+                self.stdout.write(self.style.SUCCESS(f'Seller {seller_id} credit folded back to {credit}'))
+                return
+        except (Seller.DoesNotExist, ValueError) as e:
+            raise CommandError(str(e) or f'Seller {seller_id} not found')
+
+        if seller_id is not None:
+            seller_ids = [seller_id]
+        else:
+            seller_ids = Seller.objects.filter(credit_shards__gt=0).values_list('id', flat=True)
+
+        inconsistent = 0
+        for seller_id in seller_ids:
+            if action == 'fold':
+                credit = fold_credit_shards(seller_id)
+                self.stdout.write(f'Seller {seller_id}: credit = {credit}')
+                continue
+
+            result = check_credit_shards(seller_id)
+            if result['consistent']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Seller {seller_id}: shards {result["shard_total"]} == ledger {result["ledger_total"]}'
+                ))
+            else:
+                inconsistent += 1
+                self.stdout.write(self.style.ERROR(
+                    f'Seller {seller_id}: shards {result["shard_total"]} != ledger {result["ledger_total"]}'
+                ))
+
+        if inconsistent:
+            raise CommandError(f'{inconsistent} seller(s) have shard totals that do not match the ledger')
@@ -0,0 +1,136 @@
+import csv
+import json
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import get_token_cache
+from accounts.models import User, Seller
+from recharge.workers import map_in_processes, default_workers
+
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+
+def read_sellers(path, file_format):
+    with open(path, newline='') as source:
+        if file_format == 'jsonl':
+            rows = (json.loads(line) for line in source if line.strip())
+        else:
+            rows = csv.DictReader(source)
+        for line, row in enumerate(rows, start=1):
+            if not row.get('username'):
+                raise CommandError(f'{path}: record {line} has no username')
+            yield row
+
+
+def hash_password(password):
+    # an empty password leaves a token-only account
+    return make_password(password or None)
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    help = 'Creates sellers (user, seller profile and API token) in bulk from a CSV or JSONL file; safe to rerun'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV with a header row, or JSONL; fields: username, password, '
+                                         'email, first_name, last_name')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--workers', type=int, default=default_workers(), help='Password hashing processes')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT and per transaction')
+        parser.add_argument('--tokens-out', help='Write username,token for every seller provisioned from the file '
+                                                 'to this CSV')
+
+    def handle(self, *args, **options):
+        path = options['file']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = options['batch_size']
+
+        records = {}
+        for row in read_sellers(path, file_format):
+            records.setdefault(row['username'], row)
+        usernames = list(records)
+
+        existing = {}
+        for batch in chunks(usernames, batch_size):
+            existing.update(User.objects.filter(username__in=batch).values_list('username', 'is_seller'))
+        new = [username for username in usernames if username not in existing]
+        # accounts that are not sellers (admins, staff) are never promoted or exported
+        skipped = sorted(username for username, is_seller in existing.items() if not is_seller)
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Skipping {len(skipped)} existing users that are not sellers: {", ".join(skipped[:10])}'
+            ))
+
+        # PBKDF2 dominates the run time, so only passwords of new users are hashed
+        self.stdout.write(f'Hashing {len(new)} passwords with {options["workers"]} workers')
+        hashes = list(map_in_processes(
+            hash_password, [records[username].get('password') for username in new], options['workers']
+        ))
+
+        created_sellers = 0
+        for batch in chunks(list(zip(new, hashes)), batch_size):
+            with transaction.atomic():
+                User.objects.bulk_create([
+                    User(
+                        password=password,
+                        is_seller=True,
+                        **{field: records[username].get(field) or '' for field in USER_FIELDS}
+                    )
+                    for username, password in batch
+                ], batch_size=batch_size, ignore_conflicts=True)
+                created_sellers += self.provision([username for username, _ in batch], batch_size)
+            self.stdout.write(f'{created_sellers} sellers created')
+
+        # earlier runs may have stopped between the user and its seller or token
+        sellers = sorted(username for username, is_seller in existing.items() if is_seller)
+        for batch in chunks(sellers, batch_size):
+            with transaction.atomic():
+                created_sellers += self.provision(batch, batch_size)
+
+        if options['tokens_out']:
+            with open(options['tokens_out'], 'w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(['username', 'token'])
+                for batch in chunks(usernames, batch_size):
+                    writer.writerows(
+                        Token.objects.filter(user__username__in=batch, user__is_seller=True)
+                        .values_list('user__username', 'key')
+                    )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(new)} users and {created_sellers} sellers created, {len(existing)} users already existed, '
+            f'{len(skipped)} skipped'
+        ))
+
+    def provision(self, usernames, batch_size):
+        users = dict(User.objects.filter(username__in=usernames, is_seller=True).values_list('username', 'id'))
+        missing_users = [username for username in usernames if username not in users]
+        if missing_users:
+            raise CommandError(f'Users could not be created: {", ".join(missing_users[:10])}')
+
+        with_seller = set(Seller.objects.filter(user_id__in=users.values()).values_list('user_id', flat=True))
+        now = timezone.now()
+        sellers = [
+            Seller(user_id=user_id, created_at=now, updated_at=now)
+            for user_id in users.values() if user_id not in with_seller
+        ]
+        Seller.objects.bulk_create(sellers, batch_size=batch_size)
+        # bulk_create skips post_save, so drop cached principals that still lack the seller
+        for seller in sellers:
+            get_token_cache().invalidate_user(seller.user_id)
+
+        with_token = set(Token.objects.filter(user_id__in=users.values()).values_list('user_id', flat=True))
+        Token.objects.bulk_create([
+            Token(key=Token.generate_key(), user_id=user_id, created=now)
+            for user_id in users.values() if user_id not in with_token
+        ], batch_size=batch_size)
+
+        return len(sellers)
@@ -40,6 +40,11 @@ class Seller(models.Model):
         decimal_places=0,
         default=0
     )
+    # when > 0 the balance lives in SellerCreditShard rows and ``credit`` is
+    # only the periodically folded total
+    credit_shards = models.PositiveSmallIntegerField(
+        default=0
+    )
 
     created_at = models.DateTimeField(
         default=timezone.now
@@ -52,4 +57,31 @@ class Seller(models.Model):
         db_table = "sellers"
 
     def __str__(self):
-        return f"{self.user.get_full_name() or self.user.username} - {self.credit}"
\ No newline at end of file
+        return f"{self.user.get_full_name() or self.user.username} - {self.credit}"
+
+
+class SellerCreditShard(models.Model):
+
+    seller = models.ForeignKey(
+        Seller,
+        on_delete=models.CASCADE,
+        related_name="credit_shard_rows"
+    )
+    index = models.PositiveSmallIntegerField()
+    credit = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        db_table = "seller_credit_shards"
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'index'], name='unique_seller_credit_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id}#{self.index} - {self.credit}"
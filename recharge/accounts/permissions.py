@@ -1,12 +1,15 @@
 from rest_framework import permissions
 
+from .principal import get_principal
+
+
 class IsSeller(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        return request.user.is_authenticated and hasattr(request.user, 'seller_profile')
+        return get_principal(request).is_seller
 
 
 class IsAdminUser(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.is_admin_user
\ No newline at end of file
+        return get_principal(request).is_admin_user
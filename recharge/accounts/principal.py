@@ -0,0 +1,66 @@
+"""
+Request-scoped principal.
+
+Everything the permission classes and viewsets need to know about the caller,
+resolved once per request and then shared by permissions, ``get_queryset``,
+``perform_create`` and serializers. With CachedTokenAuthentication the seller
+profile is already primed on the user and resolving costs no query; otherwise
+it costs one.
+"""
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+
+from .models import User, Seller
+
+
+class Principal(namedtuple('Principal', ['user_id', 'seller_id', 'is_admin_user', 'credit_shards'])):
+    # credit_shards is a routing hint for debit_seller, which re-reads it when it is stale
+    __slots__ = ()
+
+    @property
+    def is_authenticated(self):
+        return self.user_id is not None
+
+    @property
+    def is_seller(self):
+        return self.seller_id is not None
+
+
+ANONYMOUS = Principal(user_id=None, seller_id=None, is_admin_user=False, credit_shards=0)
+
+
+def _resolve(user):
+    if user is None or not user.is_authenticated:
+        return ANONYMOUS
+
+    profile = User.seller_profile.related
+    if profile.is_cached(user):
+        seller = profile.get_cached_value(user)
+        seller = (seller.id, seller.credit_shards) if seller is not None else None
+    else:
+        seller = Seller.objects.filter(user_id=user.pk).values_list('id', 'credit_shards').first()
+
+    return Principal(
+        user_id=user.pk,
+        seller_id=seller[0] if seller else None,
+        is_admin_user=user.is_admin_user,
+        credit_shards=seller[1] if seller else 0,
+    )
+
+
+def get_principal(request):
+    """The request's Principal, resolved on first use and cached on the request."""
+    user = request.user
+    cached = getattr(request, '_principal', None)
+    if cached is None or cached[0] is not user:
+        cached = (user, _resolve(user))
+        request._principal = cached
+    return cached[1]
+
+
+async def aget_principal(user):
+    """Principal for async views; free for users from aauthenticate_token, whose profile is primed."""
+    if user is not None and user.is_authenticated and not User.seller_profile.related.is_cached(user):
+        return await sync_to_async(_resolve)(user)
+    return _resolve(user)
@@ -1,11 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Seller
+from recharge.metrics import TimedSerializerMixin
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = User
@@ -13,7 +14,7 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['is_seller', 'is_admin_user']
 
 
-class SellerSerializer(serializers.ModelSerializer):
+class SellerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     user = UserSerializer(read_only=True)
 
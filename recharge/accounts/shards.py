@@ -0,0 +1,181 @@
+"""
+Sharded seller credit.
+
+A busy seller's balance can be spread over ``Seller.credit_shards`` rows of
+SellerCreditShard so concurrent sales lock different rows instead of all
+queueing on the seller. While sharded, ``Seller.credit`` is only a folded
+total refreshed by ``fold_credit_shards``; the shard rows are the balance.
+"""
+import random
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from recharge.db import update_returning
+from .models import Seller, SellerCreditShard
+
+
+def _split(total, count):
+    base, remainder = divmod(Decimal(total), count)
+    return [base + (1 if index < remainder else 0) for index in range(count)]
+
+
+def enable_credit_shards(seller_id, count):
+    if count < 1:
+        raise ValueError("Shard count must be at least 1")
+
+    with transaction.atomic():
+        seller = Seller.objects.select_for_update().get(id=seller_id)
+        if seller.credit_shards:
+            raise ValueError(f"Seller {seller_id} is already sharded")
+
+        SellerCreditShard.objects.bulk_create([
+            SellerCreditShard(seller=seller, index=index, credit=balance)
+            for index, balance in enumerate(_split(seller.credit, count))
+        ])
+        seller.credit_shards = count
+        seller.save(update_fields=['credit_shards'])
+
+
+def disable_credit_shards(seller_id):
+    with transaction.atomic():
+        seller = Seller.objects.select_for_update().get(id=seller_id)
+        shards = SellerCreditShard.objects.select_for_update().filter(seller_id=seller_id)
+        seller.credit = shards.aggregate(total=Sum('credit'))['total'] or Decimal('0')
+        seller.credit_shards = 0
+        seller.save(update_fields=['credit', 'credit_shards'])
+        shards.delete()
+        return seller.credit
+
+
+def fold_credit_shards(seller_id):
+    """Refresh ``Seller.credit`` of a sharded seller from its shard rows."""
+    with transaction.atomic():
+        total = SellerCreditShard.objects.filter(
+            seller_id=seller_id
+        ).aggregate(total=Sum('credit'))['total']
+        if total is None:
+            return None
+        Seller.objects.filter(id=seller_id, credit_shards__gt=0).update(credit=total)
+        return total
+
+
+def _adapt(amount):
+    return connection.ops.adapt_decimalfield_value(amount)
+
+
+def _to_credit(value):
+    return SellerCreditShard._meta.get_field('credit').to_python(value)
+
+
+def debit_credit_shards(seller_id, amount, count):
+    """
+    Take ``amount`` from one shard of the seller.
+
+    Shards are tried in random order with a conditional UPDATE each; when no
+    single shard can cover the amount the seller's shards are locked and
+    rebalanced. Returns ``(previous, new, index, transfers)`` for the debited
+    shard, where ``transfers`` are the unsaved ``credit_transfer`` ledger rows
+    of a rebalance (written by the caller ahead of the debit's own row), or
+    None when the seller's total credit is insufficient or it is not sharded.
+    """
+    indexes = list(range(count))
+    random.shuffle(indexes)
+    for index in indexes:
+        row = update_returning(
+            SellerCreditShard._meta.db_table,
+            'credit = credit - %s',
+            [_adapt(amount)],
+            {'seller_id': seller_id, 'index': index},
+            ['credit'],
+            condition='credit >= %s',
+            condition_params=[_adapt(amount)],
+        )
+        if row is not None:
+            new = _to_credit(row[0])
+            return new + amount, new, index, []
+
+    return _rebalance_and_debit(seller_id, amount)
+
+
+def _rebalance_and_debit(seller_id, amount):
+    from credits.models import Transaction
+
+    shards = list(
+        SellerCreditShard.objects.select_for_update().filter(seller_id=seller_id).order_by('index')
+    )
+    total = sum((shard.credit for shard in shards), Decimal('0'))
+    if not shards or total < amount:
+        return None
+
+    # spread what is left evenly, with the debited shard holding the amount until the debit
+    balances = _split(total - amount, len(shards))
+    target = random.randrange(len(shards))
+    now = timezone.now()
+    transfers = []
+    for shard, balance in zip(shards, balances):
+        moved_to = balance + amount if shard.index == target else balance
+        if moved_to != shard.credit:
+            transfers.append(Transaction(
+                seller_id=seller_id,
+                amount=moved_to - shard.credit,
+                transaction_type='credit_transfer',
+                previous_credit=shard.credit,
+                new_credit=moved_to,
+                credit_shard=shard.index,
+                description="Credit rebalanced between shards",
+                status='successful',
+                created_at=now,
+                completed_at=now
+            ))
+        shard.credit = balance
+    SellerCreditShard.objects.bulk_update(shards, ['credit'])
+
+    return balances[target] + amount, balances[target], target, transfers
+
+
+def credit_credit_shard(seller_id, amount, count):
+    """Add ``amount`` to a random shard. Returns ``(previous, new, index)``."""
+    index = random.randrange(count)
+    row = update_returning(
+        SellerCreditShard._meta.db_table,
+        'credit = credit + %s',
+        [_adapt(amount)],
+        {'seller_id': seller_id, 'index': index},
+        ['credit'],
+    )
+    if row is None:
+        raise SellerCreditShard.DoesNotExist()
+    new = _to_credit(row[0])
+    return new - amount, new, index
+
+
+def check_credit_shards(seller_id):
+    """
+    Compare the sum of a seller's shards with the sum of its ledger.
+
+    Shard rows are locked first so every debit that touched them has committed
+    its Transaction row before the ledger is summed.
+    """
+    from credits.models import Transaction
+
+    with transaction.atomic():
+        shard_total = sum(
+            SellerCreditShard.objects.select_for_update().filter(
+                seller_id=seller_id
+            ).values_list('credit', flat=True),
+            Decimal('0')
+        )
+        ledger_total = Transaction.objects.filter(
+            seller_id=seller_id,
+            status='successful'
+        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+
+    return {
+        'seller_id': seller_id,
+        'shard_total': shard_total,
+        'ledger_total': ledger_total,
+        'consistent': shard_total == ledger_total,
+    }
@@ -0,0 +1,29 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import get_token_cache
+from .models import User, Seller
+
+
+@receiver(post_delete, sender=Token)
+def drop_deleted_token(sender, instance, **kwargs):
+    get_token_cache().invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_user_tokens(sender, instance, **kwargs):
+    get_token_cache().invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Seller)
+def drop_seller_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # credit updates run on every sale and do not touch what the cache holds
+    if created or update_fields is None or 'credit_shards' in update_fields:
+        get_token_cache().invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=Seller)
+def drop_deleted_seller_tokens(sender, instance, **kwargs):
+    get_token_cache().invalidate_user(instance.user_id)
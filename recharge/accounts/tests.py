@@ -1,3 +1,210 @@
+import csv
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from charge.models import PhoneNumber
+from charge.services import charge_phone, InsufficientCredit
+from credits.models import CreditRequest, Transaction
+from credits.reconcile import reconcile_ledger
+from .authentication import CachedTokenAuthentication, get_token_cache
+from .models import Seller, SellerCreditShard
+from .permissions import IsSeller, IsAdminUser
+from .shards import enable_credit_shards, fold_credit_shards, check_credit_shards, disable_credit_shards
+
+User = get_user_model()
+
+
+class CreditShardTestCase(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_user(username='shard_admin', password='pw', is_admin_user=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(user=admin)
+
+        user = User.objects.create_user(username='shard_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('0'))
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+
+    def approve(self, amount, reference_id):
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=amount, reference_id=reference_id)
+        response = self.admin_client.post(
+            f'/api/credits/credit-requests/{credit_request.id}/process/',
+            {'action': 'approve'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_sharded_debits_match_ledger(self):
+        self.approve(Decimal('100'), 'CR-1')
+        enable_credit_shards(self.seller.id, 4)
+        self.assertEqual(
+            sorted(SellerCreditShard.objects.filter(seller=self.seller).values_list('credit', flat=True)),
+            [Decimal('25')] * 4
+        )
+
+        self.approve(Decimal('20'), 'CR-2')
+        charge_phone(self.seller.id, self.phone.id, Decimal('10'), 'u-1', credit_shards=4)
+        # no single shard can cover this, forcing a rebalance
+        charge_phone(self.seller.id, self.phone.id, Decimal('70'), 'u-2', credit_shards=4)
+        with self.assertRaises(InsufficientCredit):
+            charge_phone(self.seller.id, self.phone.id, Decimal('41'), 'u-3', credit_shards=4)
+
+        result = check_credit_shards(self.seller.id)
+        self.assertTrue(result['consistent'])
+        self.assertEqual(result['shard_total'], Decimal('40'))
+
+        self.assertEqual(fold_credit_shards(self.seller.id), Decimal('40'))
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('40'))
+
+    def test_rebalance_is_recorded_in_the_ledger(self):
+        self.approve(Decimal('100'), 'CR-1')
+        enable_credit_shards(self.seller.id, 4)
+
+        charge = charge_phone(self.seller.id, self.phone.id, Decimal('60'), 'u-1', credit_shards=4)
+
+        transfers = Transaction.objects.filter(seller=self.seller, transaction_type='credit_transfer')
+        self.assertEqual(sum(transfers.values_list('amount', flat=True)), Decimal('0'))
+        debit = Transaction.objects.get(object_id=charge.id, transaction_type='charge_sale')
+        shard = SellerCreditShard.objects.get(seller=self.seller, index=debit.credit_shard)
+        self.assertEqual((debit.previous_credit, debit.new_credit), (shard.credit + 60, shard.credit))
+
+        report = reconcile_ledger(full=True)
+        self.assertTrue(report['clean'], report['discrepancies'])
+
+    def test_unsharded_debit_follows_switch_to_shards(self):
+        self.approve(Decimal('50'), 'CR-1')
+        enable_credit_shards(self.seller.id, 2)
+
+        # a caller holding a stale, unsharded view of the seller
+        charge_phone(self.seller.id, self.phone.id, Decimal('30'), 'u-1', credit_shards=0)
+
+        self.assertEqual(check_credit_shards(self.seller.id)['shard_total'], Decimal('20'))
+        self.assertEqual(disable_credit_shards(self.seller.id), Decimal('20'))
+        self.assertFalse(SellerCreditShard.objects.exists())
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User.objects.create_user(username='token_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.factory = APIRequestFactory()
+
+    def authenticate(self, token=None):
+        request = Request(self.factory.get('/', HTTP_AUTHORIZATION=f'Token {(token or self.token).key}'))
+        request.authenticators = [CachedTokenAuthentication()]
+        request.user
+        return request
+
+    def test_warm_cache_needs_no_queries(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+        with self.assertNumQueries(0):
+            request = self.authenticate()
+            self.assertEqual(request.user.pk, self.user.pk)
+            self.assertEqual(request.user.seller_profile.id, self.seller.id)
+            self.assertTrue(IsSeller().has_permission(request, None))
+            self.assertFalse(IsAdminUser().has_permission(request, None))
+
+    def test_token_delete_and_user_change_invalidate(self):
+        self.authenticate()
+
+        self.user.is_admin_user = True
+        self.user.save()
+        self.assertTrue(IsAdminUser().has_permission(self.authenticate(), None))
+
+        self.seller.delete()
+        self.assertFalse(IsSeller().has_permission(self.authenticate(), None))
+
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_credit_updates_keep_the_entry(self):
+        self.authenticate()
+        self.seller.credit = Decimal('10')
+        self.seller.save(update_fields=['credit'])
+
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+
+class ProvisionSellersTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        User.objects.create_user(username='already_user', password='old')
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def provision(self, *args, **options):
+        call_command('provision_sellers', *args, workers=1, batch_size=2, stdout=StringIO(), **options)
+
+    def test_csv_rerun_is_idempotent(self):
+        with open(self.path('sellers.csv'), 'w') as sellers:
+            sellers.write('username,password,email\n')
+            sellers.writelines(f'bulk{i},secret{i},bulk{i}@example.com\n' for i in range(3))
+            sellers.write('already_user,ignored,\n')
+
+        self.provision(self.path('sellers.csv'), tokens_out=self.path('tokens.csv'))
+        with open(self.path('tokens.csv')) as tokens:
+            first = list(csv.DictReader(tokens))
+        self.provision(self.path('sellers.csv'), tokens_out=self.path('tokens.csv'))
+        with open(self.path('tokens.csv')) as tokens:
+            second = list(csv.DictReader(tokens))
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(first, second)
+        self.assertEqual(Seller.objects.count(), 3)
+        self.assertEqual(Token.objects.count(), 3)
+        self.assertTrue(User.objects.get(username='bulk1').check_password('secret1'))
+        self.assertEqual(User.objects.get(username='bulk2').email, 'bulk2@example.com')
+
+    def test_existing_non_sellers_are_skipped(self):
+        admin = User.objects.create_user(username='admin', is_admin_user=True)
+        admin_token = Token.objects.create(user=admin)
+        interrupted = User.objects.create_user(username='interrupted', is_seller=True)
+        key = Token.objects.create(user=interrupted).key
+        get_token_cache().set(Token.objects.select_related('user').get(key=key))
+        with open(self.path('sellers.csv'), 'w') as sellers:
+            sellers.write('username\nadmin\nalready_user\ninterrupted\n')
+
+        self.provision(self.path('sellers.csv'), tokens_out=self.path('tokens.csv'))
+
+        with open(self.path('tokens.csv')) as tokens:
+            self.assertEqual(list(csv.DictReader(tokens)), [{'username': 'interrupted', 'token': key}])
+        for username in ('admin', 'already_user'):
+            user = User.objects.get(username=username)
+            self.assertFalse(user.is_seller)
+            self.assertFalse(Seller.objects.filter(user=user).exists())
+        self.assertEqual(list(Token.objects.filter(user=admin)), [admin_token])
+        self.assertTrue(Seller.objects.filter(user=interrupted).exists())
+        self.assertIsNone(get_token_cache().get(key))
+
+    def test_jsonl_without_password_is_token_only(self):
+        with open(self.path('sellers.jsonl'), 'w') as sellers:
+            sellers.write(json.dumps({'username': 'token_only', 'first_name': 'Token'}) + '\n')
+
+        self.provision(self.path('sellers.jsonl'))
 
-# Create your tests here.
+        user = User.objects.get(username='token_only')
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(user.seller_profile.credit, Decimal('0'))
+        self.assertTrue(Token.objects.filter(user=user).exists())
@@ -0,0 +1,155 @@
+"""
+Compare the sync DRF endpoints served over WSGI with their async variants
+served over ASGI.
+
+Seeds a benchmark seller, token and phone numbers into the configured
+database, then for each mode starts a local server (``runserver`` for WSGI,
+uvicorn for ASGI), drives it with ``--concurrency`` open connections and
+reports requests per second and latency percentiles.
+
+    python -m benchmarks.asgi_vs_wsgi --endpoint charge --concurrency 1000 --requests 20000
+
+uvicorn must be installed for the ASGI run (``pip install uvicorn``).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from benchmarks.loadgen import run_load
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = {
+    'charge': ('POST', '/api/charge/charges/', '/api/charge/async/charges/'),
+    'credit-request': ('POST', '/api/credits/credit-requests/', '/api/credits/async/credit-requests/'),
+    'transactions': ('GET', '/api/credits/transactions/', '/api/credits/async/transactions/'),
+}
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recharge.settings')
+    import django
+    django.setup()
+
+
+def seed(phones, credit):
+    from decimal import Decimal
+    from django.contrib.auth import get_user_model
+    from rest_framework.authtoken.models import Token
+    from accounts.models import Seller
+    from charge.models import PhoneNumber
+
+    User = get_user_model()
+    user, _ = User.objects.get_or_create(username='bench_seller', defaults={'is_seller': True})
+    seller, _ = Seller.objects.get_or_create(user=user)
+    seller.credit = Decimal(credit)
+    seller.save(update_fields=['credit'])
+    token, _ = Token.objects.get_or_create(user=user)
+
+    PhoneNumber.objects.bulk_create(
+        [PhoneNumber(number=f"0999{i:07d}") for i in range(phones)],
+        ignore_conflicts=True
+    )
+    phone_ids = list(
+        PhoneNumber.objects.filter(number__startswith='0999').values_list('id', flat=True)[:phones]
+    )
+    return token.key, phone_ids
+
+
+def server_command(mode, port):
+    if mode == 'wsgi':
+        return [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+    return [
+        sys.executable, '-m', 'uvicorn', 'recharge.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning',
+        '--backlog', '4096',
+    ]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start within {timeout}s")
+
+
+def make_request_factory(endpoint, path, token, phone_ids):
+    method = ENDPOINTS[endpoint][0]
+    headers = {'Authorization': f'Token {token}'}
+
+    def make_request(i):
+        if endpoint == 'charge':
+            body = {
+                'transaction_uuid': str(uuid.uuid4()),
+                'phone_number_id': phone_ids[i % len(phone_ids)],
+                'amount': 1,
+            }
+        elif endpoint == 'credit-request':
+            body = {'reference_id': f"BENCH-{uuid.uuid4()}", 'amount': 1}
+        else:
+            body = None
+        return method, path, headers, body
+
+    return make_request
+
+
+def run_mode(mode, args, token, phone_ids):
+    _, sync_path, async_path = ENDPOINTS[args.endpoint]
+    path = sync_path if mode == 'wsgi' else async_path
+    port = args.port + (0 if mode == 'wsgi' else 1)
+
+    server = subprocess.Popen(
+        server_command(mode, port), cwd=BASE_DIR,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        stats = asyncio.run(run_load(
+            f'http://127.0.0.1:{port}',
+            make_request_factory(args.endpoint, path, token, phone_ids),
+            total=args.requests,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+        ))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {'mode': mode, 'path': path, **stats.summary()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='charge')
+    parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--phones', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    token, phone_ids = seed(args.phones, credit=10 ** 11)
+
+    results = [run_mode(mode, args, token, phone_ids) for mode in args.modes]
+    report = json.dumps({'endpoint': args.endpoint, 'concurrency': args.concurrency, 'results': results}, indent=2)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report)
+
+
+if __name__ == '__main__':
+    main()
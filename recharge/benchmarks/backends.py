@@ -0,0 +1,89 @@
+"""
+Run the flow load test (benchmarks/flows.py) against each database profile
+and compare the results.
+
+    docker compose up -d postgres
+    python -m benchmarks.backends --backends sqlite postgres --output backends.json -- \\
+        --scenarios charge credit-approval --concurrency 16 --requests 5000
+
+    # what the SQLite tuning buys concurrent writers
+    python -m benchmarks.backends --backends sqlite-stock sqlite -- \\
+        --scenarios charge --model process --concurrency 8
+
+Arguments after ``--`` go to benchmarks.flows unchanged. Every backend runs
+in its own processes with RECHARGE_DATABASE selecting the profile of
+recharge/settings.py: SQLite in a fresh temporary file, PostgreSQL in the
+database the POSTGRES_* variables point at (``compose.yaml`` provides one),
+which is flushed first. Both use benchmarks/settings.py.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# sqlite-stock is SQLite without the SQLITE pragmas and IMMEDIATE transactions of recharge/settings.py
+BACKENDS = ('sqlite', 'sqlite-stock', 'postgres')
+COLUMNS = ('rps', 'p50_ms', 'p99_ms', 'lock_wait_p99_ms', 'error_rate', 'retry_rate')
+
+
+def manage(env, *args):
+    subprocess.run([sys.executable, 'manage.py', *args], cwd=BASE_DIR, env=env, check=True)
+
+
+def run_backend(backend, flow_args, workdir):
+    env = {
+        **os.environ,
+        'RECHARGE_DATABASE': 'postgres' if backend == 'postgres' else 'sqlite',
+        'DJANGO_SETTINGS_MODULE': 'benchmarks.settings',
+    }
+    if backend != 'postgres':
+        env['SQLITE_PATH'] = str(workdir / f'{backend}.sqlite3')
+        env['BENCHMARK_SQLITE_STOCK'] = '1' if backend == 'sqlite-stock' else '0'
+
+    manage(env, 'migrate', '--run-syncdb', '-v0')
+    if backend == 'postgres':
+        manage(env, 'flush', '--no-input', '-v0')
+
+    output = workdir / f'{backend}.json'
+    subprocess.run(
+        [sys.executable, '-m', 'benchmarks.flows', *flow_args, '--output', str(output)],
+        cwd=BASE_DIR, env=env, check=True, stdout=subprocess.DEVNULL
+    )
+    return {'backend': backend, **json.loads(output.read_text())}
+
+
+def print_table(reports):
+    header = ['scenario', 'backend', *COLUMNS]
+    rows = [
+        [result['scenario'], report['backend'], *(str(result[column]) for column in COLUMNS)]
+        for report in reports for result in report['results']
+    ]
+    rows.sort(key=lambda row: row[0])
+    widths = [max(len(row[index]) for row in [header, *rows]) for index in range(len(header))]
+    for row in [header, *rows]:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['sqlite', 'postgres'])
+    parser.add_argument('--output', help='Write every backend report as JSON to this file')
+    parser.add_argument('flow_args', nargs=argparse.REMAINDER, help='Arguments for benchmarks.flows, after --')
+    args = parser.parse_args(argv)
+    flow_args = args.flow_args[1:] if args.flow_args[:1] == ['--'] else args.flow_args
+
+    with tempfile.TemporaryDirectory() as workdir:
+        reports = [run_backend(backend, flow_args, Path(workdir)) for backend in args.backends]
+
+    print_table(reports)
+    if args.output:
+        Path(args.output).write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""
+Load test for the charge, credit approval and history flows.
+
+Seeds ``--sellers`` sellers with tokens and credit, ``--phones`` phone numbers
+the charges fan out over and an admin that approves credit requests, then runs
+each scenario through the real URL routing, middleware, authentication and
+views and reports throughput, latency percentiles, lock-wait time and error
+and retry rates.
+
+    python -m benchmarks.flows --settings recharge.settings --model thread --concurrency 16 \\
+        --sellers 50 --phones 1000 --requests 5000 --output flows.json
+
+Scenarios:
+
+    charge           POST /api/charge/charges/ as seller ``i % sellers``
+    credit-approval  POST /api/credits/credit-requests/<id>/process/ (approve) as the admin,
+                     over pending requests seeded for the run
+    history          GET /api/credits/transactions/?pagination=cursor as seller ``i % sellers``
+
+``--server inprocess`` calls the WSGI handler directly through Django's test
+client (no sockets); ``wsgi`` and ``asgi`` start ``runserver`` or uvicorn on
+``--port``; ``external`` drives an already running server at ``--base-url``.
+``--model`` picks threads, processes (each with its own database connections)
+or asyncio connections (HTTP servers only). The database backend is whatever
+the ``--settings`` module (by default the RECHARGE_DATABASE profile) configures;
+spawned servers inherit it. ``python -m benchmarks.backends`` runs this against
+SQLite and PostgreSQL and compares them.
+
+Responses with a status in loadgen.RETRY_STATUSES (conflicts, the 503s the
+views answer once their lock-contention retries run out, and 500s) are
+retried with the same body up to ``--retries`` times; charge retries reuse the
+transaction_uuid, so they are idempotent. Lock wait is the ``lock`` metric of
+the ``Server-Timing`` header when the server sends one; in-process runs
+otherwise time the row-locking statements (UPDATE, SELECT ... FOR UPDATE) of
+each request, which bounds the time spent waiting on locks from above.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from benchmarks.asgi_vs_wsgi import BASE_DIR, server_command, wait_for_port
+from benchmarks.loadgen import RETRY_STATUSES, Stats, run_load, server_timing
+
+SCENARIOS = ('charge', 'credit-approval', 'history')
+
+
+def setup_django(settings_module=None):
+    if settings_module:
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recharge.settings')
+    import django
+    django.setup()
+
+
+def seed(sellers, phones, credit):
+    """Creates (or tops up) the flow_* sellers, their tokens, the admin and the phone numbers."""
+    from decimal import Decimal
+    from django.utils import timezone
+    from rest_framework.authtoken.models import Token
+    from accounts.models import User, Seller
+    from charge.models import PhoneNumber
+
+    usernames = [f'flow_seller_{i}' for i in range(sellers)]
+    User.objects.bulk_create(
+        [User(username=username, is_seller=True) for username in usernames], ignore_conflicts=True
+    )
+    user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+    now = timezone.now()
+    Seller.objects.bulk_create(
+        [Seller(user_id=user_id, created_at=now, updated_at=now) for user_id in user_ids.values()],
+        ignore_conflicts=True
+    )
+    Seller.objects.filter(user_id__in=user_ids.values(), credit_shards=0).update(credit=Decimal(credit))
+    Token.objects.bulk_create(
+        [Token(key=Token.generate_key(), user_id=user_id, created=now) for user_id in user_ids.values()],
+        ignore_conflicts=True
+    )
+    tokens = dict(Token.objects.filter(user_id__in=user_ids.values()).values_list('user_id', 'key'))
+    seller_ids = dict(Seller.objects.filter(user_id__in=user_ids.values()).values_list('user_id', 'id'))
+
+    admin, _ = User.objects.get_or_create(username='flow_admin', defaults={'is_admin_user': True})
+    admin_token, _ = Token.objects.get_or_create(user=admin)
+
+    PhoneNumber.objects.bulk_create(
+        [PhoneNumber(number=f"0998{i:07d}", created_at=now, updated_at=now) for i in range(phones)],
+        ignore_conflicts=True
+    )
+    phone_ids = list(
+        PhoneNumber.objects.filter(number__startswith='0998').order_by('id').values_list('id', flat=True)[:phones]
+    )
+
+    return {
+        'sellers': [(seller_ids[user_ids[name]], tokens[user_ids[name]]) for name in usernames],
+        'admin': admin_token.key,
+        'phones': phone_ids,
+    }
+
+
+def seed_credit_requests(fixture, count):
+    """Ids of ``count`` new pending credit requests spread over the sellers."""
+    from credits.models import CreditRequest
+
+    run = uuid.uuid4().hex[:12]
+    sellers = fixture['sellers']
+    CreditRequest.objects.bulk_create([
+        CreditRequest(reference_id=f'FLOW-{run}-{i}', seller_id=sellers[i % len(sellers)][0], amount=1)
+        for i in range(count)
+    ], batch_size=1000)
+    return list(
+        CreditRequest.objects.filter(reference_id__startswith=f'FLOW-{run}-').order_by('id').values_list('id', flat=True)
+    )
+
+
+def plan(scenario, fixture, total):
+    """The ``(method, path, headers, body)`` of every request of a run, built up front."""
+    sellers, phones = fixture['sellers'], fixture['phones']
+
+    def seller_headers(i):
+        return {'Authorization': f"Token {sellers[i % len(sellers)][1]}"}
+
+    if scenario == 'charge':
+        return [
+            ('POST', '/api/charge/charges/', seller_headers(i), {
+                'transaction_uuid': str(uuid.uuid4()),
+                'phone_number_id': phones[i % len(phones)],
+                'amount': 1,
+            })
+            for i in range(total)
+        ]
+    if scenario == 'credit-approval':
+        admin = {'Authorization': f"Token {fixture['admin']}"}
+        return [
+            ('POST', f'/api/credits/credit-requests/{pk}/process/', admin, {'action': 'approve'})
+            for pk in seed_credit_requests(fixture, total)
+        ]
+    return [
+        ('GET', '/api/credits/transactions/?pagination=cursor', seller_headers(i), None)
+        for i in range(total)
+    ]
+
+
+class LockTimer:
+    """execute_wrapper summing the time spent in statements that take row locks."""
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        statement = sql.lstrip()[:6].upper()
+        if statement != 'UPDATE' and 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+
+class InProcessClient:
+
+    def __init__(self, base_url, timeout):
+        from django.test import Client
+        self.client = Client(raise_request_exception=False, HTTP_HOST='localhost')
+
+    def request(self, method, path, headers, body):
+        from django.db import connection
+
+        timer = LockTimer()
+        with connection.execute_wrapper(timer):
+            response = self.client.generic(
+                method, path, json.dumps(body) if body is not None else '',
+                content_type='application/json', headers=headers
+            )
+        lock_wait = server_timing(response.headers.get('Server-Timing'), 'lock')
+        return response.status_code, timer.elapsed if lock_wait is None else lock_wait
+
+    def reset(self):
+        pass
+
+    def close(self):
+        from django.db import connections
+        connections.close_all()
+
+
+class HTTPClient:
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+
+    def request(self, method, path, headers, body):
+        headers = dict(headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, body=payload, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status, server_timing(response.getheader('Server-Timing'), 'lock')
+
+    def reset(self):
+        self.connection.close()
+
+    def close(self):
+        self.connection.close()
+
+
+CLIENTS = {'inprocess': InProcessClient, 'http': HTTPClient}
+
+
+def run_slice(task):
+    """Sends one worker's share of the requests in order; module level so processes can run it."""
+    transport, base_url, requests, retries, timeout = task
+    client = CLIENTS[transport](base_url, timeout)
+    stats = Stats()
+    try:
+        for request in requests:
+            started = time.perf_counter()
+            lock_wait = 0.0
+            for attempt in range(retries + 1):
+                try:
+                    status, waited = client.request(*request)
+                except (OSError, http.client.HTTPException) as e:
+                    stats.errors[type(e).__name__] += 1
+                    client.reset()
+                    status = None
+                    break
+                lock_wait = None if waited is None else (lock_wait or 0.0) + waited
+                if status not in RETRY_STATUSES or attempt == retries:
+                    break
+                stats.retries += 1
+                time.sleep(0.005 * 2 ** attempt)
+            if status is not None:
+                stats.record(status, time.perf_counter() - started, lock_wait)
+    finally:
+        client.close()
+    return stats
+
+
+def run_scenario(scenario, args, fixture, base_url):
+    from recharge.workers import map_in_processes
+
+    requests = plan(scenario, fixture, args.requests)
+    transport = 'inprocess' if args.server == 'inprocess' else 'http'
+
+    stats = Stats()
+    stats.started = time.perf_counter()
+    if args.model == 'async':
+        stats = asyncio.run(run_load(
+            base_url, requests.__getitem__, total=len(requests), concurrency=args.concurrency,
+            timeout=args.timeout, retries=args.retries
+        ))
+    else:
+        tasks = [
+            (transport, base_url, requests[worker::args.concurrency], args.retries, args.timeout)
+            for worker in range(args.concurrency)
+        ]
+        if args.model == 'thread':
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(run_slice, tasks))
+        else:
+            results = list(map_in_processes(run_slice, tasks, args.concurrency))
+        for result in results:
+            stats.merge(result)
+        stats.finished = time.perf_counter()
+
+    return {'scenario': scenario, **stats.summary()}
+
+
+def start_server(args):
+    server = subprocess.Popen(
+        server_command(args.server, args.port), cwd=BASE_DIR,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(args.port)
+    except RuntimeError:
+        server.terminate()
+        raise
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--settings', help='Django settings module; selects the database backend')
+    parser.add_argument('--server', choices=['inprocess', 'wsgi', 'asgi', 'external'], default='inprocess')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server for --server external')
+    parser.add_argument('--port', type=int, default=8710, help='Port for a spawned wsgi/asgi server')
+    parser.add_argument('--model', choices=['thread', 'process', 'async'], default='thread')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario')
+    parser.add_argument('--sellers', type=int, default=10)
+    parser.add_argument('--phones', type=int, default=100, help='Phone numbers the charges fan out over')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    if args.model == 'async' and args.server == 'inprocess':
+        parser.error('--model async needs an HTTP server (--server wsgi, asgi or external)')
+
+    setup_django(args.settings)
+    from django.conf import settings
+    from django.db import connection
+
+    fixture = seed(args.sellers, args.phones, credit=10 ** 11)
+
+    server = None
+    base_url = args.base_url
+    if args.server in ('wsgi', 'asgi'):
+        base_url = f'http://127.0.0.1:{args.port}'
+        server = start_server(args)
+    try:
+        results = [run_scenario(scenario, args, fixture, base_url) for scenario in args.scenarios]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = json.dumps({
+        'settings': settings.SETTINGS_MODULE,
+        'database': connection.vendor,
+        'server': args.server,
+        'model': args.model,
+        'concurrency': args.concurrency,
+        'sellers': args.sellers,
+        'phones': args.phones,
+        'retries': args.retries,
+        'results': results,
+    }, indent=2)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Minimal asyncio HTTP/1.1 load generator (stdlib only).
+
+Each of ``concurrency`` workers keeps one keep-alive connection open and
+issues requests produced by ``make_request(i)`` until ``total`` requests have
+been sent, recording per-request latency and status, and the ``lock`` duration
+of the ``Server-Timing`` header when the server sends one.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# retried with the same body; the write endpoints are idempotent on their client keys
+RETRY_STATUSES = (409, 500, 502, 503)
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies = []
+        self.lock_waits = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.retries = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, status, latency, lock_wait=None):
+        self.statuses[status] += 1
+        self.latencies.append(latency)
+        if lock_wait is not None:
+            self.lock_waits.append(lock_wait)
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.lock_waits.extend(other.lock_waits)
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+        self.retries += other.retries
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        completed = len(self.latencies)
+        attempted = completed + sum(self.errors.values())
+        failed = sum(self.errors.values()) + sum(n for status, n in self.statuses.items() if status >= 400)
+        return {
+            'requests': completed,
+            'elapsed_s': round(elapsed, 3),
+            'rps': round(completed / elapsed, 1) if elapsed else None,
+            'p50_ms': _ms(percentile(self.latencies, 50)),
+            'p95_ms': _ms(percentile(self.latencies, 95)),
+            'p99_ms': _ms(percentile(self.latencies, 99)),
+            'max_ms': _ms(max(self.latencies) if self.latencies else None),
+            'lock_wait_p50_ms': _ms(percentile(self.lock_waits, 50)),
+            'lock_wait_p99_ms': _ms(percentile(self.lock_waits, 99)),
+            'lock_wait_total_s': round(sum(self.lock_waits), 3) if self.lock_waits else None,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'error_rate': round(failed / attempted, 4) if attempted else None,
+            'retries': self.retries,
+            'retry_rate': round(self.retries / attempted, 4) if attempted else None,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def server_timing(header, metric):
+    """Seconds reported for ``metric`` in a ``Server-Timing`` header value, or None."""
+    for entry in (header or '').split(','):
+        name, *params = [part.strip() for part in entry.split(';')]
+        if name == metric:
+            for param in params:
+                key, _, value = param.partition('=')
+                if key == 'dur':
+                    return float(value) / 1000
+    return None
+
+
+class Connection:
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=None):
+        if self.writer is None:
+            await self.open()
+
+        payload = b''
+        if body is not None:
+            payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines.append(f"Content-Length: {len(payload)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("server closed the connection")
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in response_headers:
+            content = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = await self._read_chunked()
+        else:
+            content = await self.reader.read()
+            self.close()
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, content
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).strip() or b'0', 16)
+            if size == 0:
+                await self.reader.readline()
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+
+async def run_load(base_url, make_request, total, concurrency, timeout=30.0, retries=0):
+    """
+    ``make_request(i)`` returns ``(method, path, headers, body)`` for request i.
+    Requests answered with one of RETRY_STATUSES are resent up to ``retries``
+    times. Returns a Stats object.
+    """
+    url = urlsplit(base_url)
+    stats = Stats()
+    counter = iter(range(total))
+
+    async def worker():
+        connection = Connection(url.hostname, url.port or 80)
+        try:
+            for i in counter:
+                method, path, headers, body = make_request(i)
+                started = time.perf_counter()
+                for attempt in range(retries + 1):
+                    try:
+                        status, response_headers, _ = await asyncio.wait_for(
+                            connection.request(method, path, headers, body), timeout
+                        )
+                    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                        stats.errors[type(e).__name__] += 1
+                        connection.close()
+                        status = None
+                        break
+                    if status not in RETRY_STATUSES or attempt == retries:
+                        break
+                    stats.retries += 1
+                if status is not None:
+                    stats.record(
+                        status, time.perf_counter() - started,
+                        server_timing(response_headers.get('server-timing'), 'lock')
+                    )
+        finally:
+            connection.close()
+
+    stats.started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats.finished = time.perf_counter()
+    return stats
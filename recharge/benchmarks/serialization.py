@@ -0,0 +1,99 @@
+"""
+Serialization cost per 1,000 rows: ModelSerializer vs the flat representation.
+
+Rows are built in memory (no database), so only rendering is measured: the
+ModelSerializer path gets model instances with their seller/user attached,
+as a select_related queryset would return them; the flat path gets the
+dicts ``.values()`` would return.
+
+    python -m benchmarks.serialization --rows 1000 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from decimal import Decimal
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recharge.settings')
+    import django
+    django.setup()
+
+
+def build_rows(count):
+    from django.utils import timezone
+    from accounts.models import User, Seller
+    from credits.models import Transaction
+    from credits.serializers import TransactionSerializer
+    from recharge.flat import flat_plan
+
+    now = timezone.now()
+    user = User(id=1, username='bench', is_seller=True)
+    seller = Seller(id=1, user=user, credit=Decimal('1000'), created_at=now, updated_at=now)
+    instances = [
+        Transaction(
+            id=i, seller=seller, amount=Decimal('-10'), transaction_type='charge_sale',
+            previous_credit=Decimal(1000 - i), new_credit=Decimal(990 - i),
+            description=f"Charge sale for phone 0912{i:07d}", status='successful',
+            created_at=now, completed_at=now
+        )
+        for i in range(count)
+    ]
+
+    def values(expand):
+        columns, _ = flat_plan(TransactionSerializer, expand)
+        rows = []
+        for instance in instances:
+            row = {}
+            for column in columns:
+                target = instance
+                for part in column.split('__'):
+                    target = getattr(target, part)
+                row[column] = target
+            rows.append(row)
+        return rows
+
+    return instances, values(frozenset()), values(frozenset({'seller'}))
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from credits.serializers import TransactionSerializer
+    from recharge.flat import flat_plan, render_rows
+
+    instances, flat_rows, expanded_rows = build_rows(args.rows)
+    _, plan = flat_plan(TransactionSerializer, frozenset())
+    _, expanded_plan = flat_plan(TransactionSerializer, frozenset({'seller'}))
+
+    per = 1000 / args.rows
+    report = {
+        'rows': args.rows,
+        'ms_per_1000_rows': {
+            'model_serializer': round(timed(lambda: TransactionSerializer(instances, many=True).data, args.repeat) * per, 3),
+            'flat': round(timed(lambda: render_rows(plan, flat_rows), args.repeat) * per, 3),
+            'flat_expand_seller': round(
+                timed(lambda: render_rows(expanded_plan, expanded_rows), args.repeat) * per, 3
+            ),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""
+Settings for the benchmarks: the RECHARGE_DATABASE profile of
+recharge/settings.py, with DEBUG off and the schema created straight from the
+models (``migrate --run-syncdb``) since the apps ship no migrations.
+
+BENCHMARK_SQLITE_STOCK=1 drops the SQLite tuning (pragmas and IMMEDIATE
+transactions) to measure what it buys.
+"""
+import os
+
+from recharge.db import SQLITE_PRAGMAS
+from recharge.settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+TRANSACTIONS = {**TRANSACTIONS, 'CHECK_LOCK_ORDER': False}  # noqa: F405
+
+MIGRATION_MODULES = {
+    app: None for app in ('accounts', 'charge', 'credits', 'authtoken', 'admin', 'auth', 'contenttypes', 'sessions')
+}
+
+if os.environ.get('BENCHMARK_SQLITE_STOCK') == '1':
+    SQLITE = {name: None for _, name in SQLITE_PRAGMAS}
+    DATABASES['default']['OPTIONS'] = {}  # noqa: F405
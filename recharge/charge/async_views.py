@@ -0,0 +1,91 @@
+"""
+Async (ASGI) variant of the charge-create endpoint.
+
+Only the atomic charge block runs in a worker thread; authentication, lookups
+and serialization use Django's async ORM so a slow database does not pin a
+worker per in-flight request.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from accounts.authentication import aauthenticate_token, error_response
+from accounts.models import Seller
+from accounts.principal import aget_principal
+from recharge import idempotency
+from recharge.transactions import run_transaction, TransactionContention, CONTENTION_DETAIL, RETRY_AFTER
+from .models import PhoneNumber, ChargeSale
+from .serializers import ChargeSaleSerializer, BulkChargeItemSerializer
+from .services import charge_phone, charge_number, InsufficientCredit, DuplicateTransaction
+
+
+def _run_transaction(*args, **kwargs):
+    # executor threads never see request_started/finished, so recycle their connection the same way
+    close_old_connections()
+    try:
+        return run_transaction(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+@csrf_exempt
+@require_POST
+async def charge_create(request):
+    user = await aauthenticate_token(request)
+    if user is None:
+        return error_response("Authentication credentials were not provided.", 401)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return error_response("Malformed JSON.", 400)
+    if not isinstance(data, dict):
+        return error_response("Expected a JSON object.", 400)
+
+    replayed = idempotency.replay('charge', user.id, data.get('transaction_uuid'), data)
+    if replayed is not None:
+        return JsonResponse(replayed.data, status=replayed.status_code)
+
+    principal = await aget_principal(user)
+    if not principal.is_seller:
+        return error_response("You do not have permission to perform this action.", 403)
+
+    serializer = BulkChargeItemSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    item = serializer.validated_data
+
+    try:
+        if 'number' in item:
+            charge_sale = await sync_to_async(_run_transaction, thread_sensitive=False)(
+                charge_number, principal.seller_id, item['number'], item['amount'], item['transaction_uuid'],
+                principal.credit_shards, name='charge', atomic=False
+            )
+        else:
+            charge_sale = await sync_to_async(_run_transaction, thread_sensitive=False)(
+                charge_phone, principal.seller_id, item['phone_number_id'], item['amount'], item['transaction_uuid'],
+                principal.credit_shards, name='charge', atomic=False
+            )
+    except DuplicateTransaction:
+        return error_response("Transaction with this UUID already exists.", 400)
+    except InsufficientCredit:
+        return error_response("Insufficient credit for this transaction.", 400)
+    except PhoneNumber.DoesNotExist:
+        return error_response("Phone number not found.", 404)
+    except Seller.DoesNotExist:
+        return error_response("Seller profile not found.", 404)
+    except TransactionContention:
+        response = error_response(CONTENTION_DETAIL, 503)
+        response['Retry-After'] = RETRY_AFTER
+        return response
+
+    charge_sale = await ChargeSale.objects.select_related('seller__user', 'phone_number').aget(pk=charge_sale.pk)
+    body = ChargeSaleSerializer(charge_sale).data
+    idempotency.get_store().set(
+        'charge', user.id, item['transaction_uuid'], idempotency.fingerprint(data), 201, dict(body)
+    )
+    return JsonResponse(body, status=201)
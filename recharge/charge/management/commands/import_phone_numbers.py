@@ -0,0 +1,107 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from charge.models import PhoneNumber
+
+
+def read_numbers(path):
+    with open(path) as source:
+        for line in source:
+            # plain lists and CSV exports (number in the first column) both work
+            number = line.split(',', 1)[0].strip()
+            if number and number.lower() != 'number':
+                yield number
+
+
+def generate_numbers(prefix, start, count, width):
+    for value in range(start, start + count):
+        yield f"{prefix}{value:0{width}d}"
+
+
+class Command(BaseCommand):
+    help = 'Imports phone numbers from a file or a generated range with batched inserts; resumable'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--file', help='File with one number per line (or CSV with the number first)')
+        source.add_argument('--count', type=int, help='Generate this many numbers from --prefix/--start')
+        parser.add_argument('--prefix', default='0912', help='Prefix of generated numbers')
+        parser.add_argument('--start', type=int, default=1, help='First generated suffix')
+        parser.add_argument('--width', type=int, default=7, help='Zero-padded width of generated suffixes')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+        parser.add_argument('--batches-per-transaction', type=int, default=10, help='INSERTs per commit')
+        parser.add_argument('--state', help='File recording the last committed position, for --resume')
+        parser.add_argument('--resume', action='store_true', help='Skip what the --state file says is committed')
+
+    def source(self, options):
+        if options['file']:
+            stat = os.stat(options['file'])
+            key = {'file': os.path.abspath(options['file']), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+            return key, read_numbers(options['file'])
+        key = {k: options[k] for k in ('prefix', 'start', 'count', 'width')}
+        return key, generate_numbers(options['prefix'], options['start'], options['count'], options['width'])
+
+    def load_offset(self, options, key):
+        if not options['resume']:
+            return 0
+        if not options['state']:
+            raise CommandError('--resume needs --state')
+        try:
+            with open(options['state']) as state:
+                saved = json.load(state)
+        except FileNotFoundError:
+            return 0
+        if saved['source'] != key:
+            raise CommandError(f'{options["state"]} belongs to a different import: {saved["source"]}')
+        return saved['offset']
+
+    def save_offset(self, options, key, offset):
+        if not options['state']:
+            return
+        partial = f'{options["state"]}.tmp'
+        with open(partial, 'w') as state:
+            json.dump({'source': key, 'offset': offset}, state)
+        os.replace(partial, options['state'])
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        chunk_size = batch_size * options['batches_per_transaction']
+        max_length = PhoneNumber._meta.get_field('number').max_length
+
+        key, numbers = self.source(options)
+        offset = self.load_offset(options, key)
+        numbers = islice(numbers, offset, None)
+        if offset:
+            self.stdout.write(f'Resuming after {offset} numbers')
+
+        processed = invalid = 0
+        started = time.monotonic()
+        while chunk := list(islice(numbers, chunk_size)):
+            now = timezone.now()
+            rows = []
+            for number in chunk:
+                if number.isdigit() and len(number) <= max_length:
+                    rows.append(PhoneNumber(number=number, current_balance=0, created_at=now, updated_at=now))
+                else:
+                    invalid += 1
+
+            with transaction.atomic():
+                PhoneNumber.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+            processed += len(chunk)
+            self.save_offset(options, key, offset + processed)
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{offset + processed} numbers committed ({processed / elapsed if elapsed else 0:,.0f} rows/s)'
+            )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {processed - invalid} numbers in {elapsed:.1f}s, existing ones left untouched'
+            + (f', {invalid} invalid skipped' if invalid else '')
+        ))
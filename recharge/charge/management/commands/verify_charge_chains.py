@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from charge.verify import verify_charge_chains
+from recharge.workers import default_workers
+
+
+class Command(BaseCommand):
+    help = 'Verifies that every phone balance follows its chain of charge sales and writes a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=default_workers(), help='Worker processes')
+        parser.add_argument('--shards', type=int, help='Phone id ranges to split the work into (default 4 per worker)')
+        parser.add_argument('--min-phone-id', type=int, help='First phone id to verify')
+        parser.add_argument('--max-phone-id', type=int, help='Last phone id to verify')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows fetched per cursor round trip')
+        parser.add_argument('--max-discrepancies', type=int, default=1000, help='Discrepancies listed per range')
+        parser.add_argument('--output', default='-', help='Report path, - for stdout')
+
+    def handle(self, *args, **options):
+        report = verify_charge_chains(
+            workers=options['workers'],
+            shards=options['shards'],
+            min_id=options['min_phone_id'],
+            max_id=options['max_phone_id'],
+            batch_size=options['batch_size'],
+            max_discrepancies=options['max_discrepancies'],
+        )
+
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, indent=2))
+            summary = self.stderr
+        else:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, cls=DjangoJSONEncoder, indent=2)
+            summary = self.stdout
+
+        if not report['clean']:
+            raise CommandError(f'{report["discrepancy_count"]} discrepancies across {report["phones"]} phones')
+        summary.write(self.style.SUCCESS(f'{report["phones"]} phones verified, {report["sales"]} charge sales scanned'))
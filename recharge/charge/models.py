@@ -92,6 +92,8 @@ class ChargeSale(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['transaction_uuid']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['seller', 'created_at', 'id']),
+            models.Index(fields=['phone_number', 'created_at', 'id']),
         ]
 
     def __str__(self):
@@ -0,0 +1,126 @@
+"""
+In-process phone number -> PhoneNumber.id index.
+
+Lets the charge endpoints take the MSISDN a terminal knows instead of our
+primary key. Lookups hit a bounded LRU (``PHONE_NUMBERS['INDEX_SIZE']``) and
+fall back to the database on a miss. Signals keep it coherent with saves and
+deletes in this process (see charge/signals.py); writes that bypass signals
+are caught by charge_phone, which checks the number the phone row actually
+has and makes ``charge_number`` retry from the database, and by
+charge_phones_bulk, which re-reads the numbers whose phone no longer matches.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import PhoneNumber
+
+
+DEFAULTS = {
+    'INDEX_SIZE': 100000,
+    'AUTO_PROVISION': False,
+}
+
+
+def phone_numbers_setting(name):
+    return {**DEFAULTS, **getattr(settings, 'PHONE_NUMBERS', {})}[name]
+
+
+class PhoneNumberIndex:
+
+    def __init__(self, size):
+        self.size = size
+        self._ids = OrderedDict()
+        self._numbers = {}
+        self._lock = threading.Lock()
+
+    def get(self, number):
+        with self._lock:
+            phone_id = self._ids.get(number)
+            if phone_id is not None:
+                self._ids.move_to_end(number)
+            return phone_id
+
+    def set(self, number, phone_id):
+        with self._lock:
+            previous = self._numbers.get(phone_id)
+            if previous is not None and previous != number:
+                self._ids.pop(previous, None)
+            self._ids.pop(number, None)
+            self._ids[number] = phone_id
+            self._numbers[phone_id] = number
+            while len(self._ids) > self.size:
+                _, evicted = self._ids.popitem(last=False)
+                self._numbers.pop(evicted, None)
+
+    def forget(self, number=None, phone_id=None):
+        with self._lock:
+            if number is not None:
+                forgotten = self._ids.pop(number, None)
+                if forgotten is not None and self._numbers.get(forgotten) == number:
+                    del self._numbers[forgotten]
+            if phone_id is not None:
+                previous = self._numbers.pop(phone_id, None)
+                if previous is not None:
+                    self._ids.pop(previous, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._numbers.clear()
+
+    def lookup(self, number):
+        """The id for ``number`` from the index, then the database; None if unknown."""
+        phone_id = self.get(number)
+        if phone_id is None:
+            phone_id = PhoneNumber.objects.filter(number=number).values_list('id', flat=True).first()
+            if phone_id is not None:
+                self.set(number, phone_id)
+        return phone_id
+
+    def lookup_many(self, numbers):
+        """``{number: id}`` for the known ``numbers``: hits from the index, the misses in one query."""
+        found = {}
+        missing = set()
+        for number in set(numbers):
+            phone_id = self.get(number)
+            if phone_id is None:
+                missing.add(number)
+            else:
+                found[number] = phone_id
+
+        if missing:
+            fetched = dict(PhoneNumber.objects.filter(number__in=missing).values_list('number', 'id'))
+            for number, phone_id in fetched.items():
+                self.set(number, phone_id)
+            found.update(fetched)
+        return found
+
+    def __len__(self):
+        return len(self._ids)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_phone_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PhoneNumberIndex(phone_numbers_setting('INDEX_SIZE'))
+    return _index
+
+
+def provision_phone_number(number):
+    """Id of the phone with ``number``, creating it first if needed (call inside a transaction)."""
+    phone, _ = PhoneNumber.objects.get_or_create(number=number)
+    return phone.id
+
+
+def index_on_commit(phone):
+    number, phone_id = phone.number, phone.id
+    transaction.on_commit(lambda: get_phone_index().set(number, phone_id))
@@ -1,9 +1,11 @@
 from rest_framework import serializers
+from accounts.principal import get_principal
 from .models import PhoneNumber, ChargeSale
 from accounts.serializers import SellerSerializer
+from recharge.metrics import TimedSerializerMixin
 
 
-class PhoneNumberSerializer(serializers.ModelSerializer):
+class PhoneNumberSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
 
     class Meta:
@@ -19,19 +21,36 @@ class PhoneNumberSerializer(serializers.ModelSerializer):
         read_only_fields = ['current_balance', 'last_charge_date', 'created_at', 'updated_at']
 
     def validate_number(self, value):
-        if not value.isdigit():
-            raise serializers.ValidationError("Phone number must contain only digits")
-        return value
+        return validate_phone_number(value)
+
+
+def validate_phone_number(value):
+    if not value.isdigit():
+        raise serializers.ValidationError("Phone number must contain only digits")
+    return value
+
+
+def validate_charge_target(attrs, phone_field):
+    if (attrs.get(phone_field) is None) == (attrs.get('number') is None):
+        raise serializers.ValidationError("Provide exactly one of phone_number_id or number.")
+    return attrs
 
 
-class ChargeSaleSerializer(serializers.ModelSerializer):
+class ChargeSaleSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     seller = SellerSerializer(read_only=True)
     phone_number = PhoneNumberSerializer(read_only=True)
     phone_number_id = serializers.PrimaryKeyRelatedField(
         queryset=PhoneNumber.objects.all(),
         write_only=True,
+        required=False,
         source='phone_number'
     )
+    number = serializers.CharField(
+        max_length=20,
+        write_only=True,
+        required=False,
+        validators=[validate_phone_number]
+    )
 
     class Meta:
         model = ChargeSale
@@ -41,6 +60,7 @@ class ChargeSaleSerializer(serializers.ModelSerializer):
             'seller',
             'phone_number',
             'phone_number_id',
+            'number',
             'amount',
             'phone_initial_balance',
             'phone_final_balance',
@@ -53,20 +73,42 @@ class ChargeSaleSerializer(serializers.ModelSerializer):
             'seller', 'phone_initial_balance', 'phone_final_balance',
             'status', 'status_message', 'created_at', 'updated_at'
         ]
+        # uniqueness is enforced by the database constraint when the sale is written
+        extra_kwargs = {'transaction_uuid': {'validators': []}}
 
     def validate_amount(self, value):
         if value <= 0:
             raise serializers.ValidationError("Charge amount must be greater than zero")
         return value
 
+    def validate(self, attrs):
+        return validate_charge_target(attrs, 'phone_number')
+
     def create(self, validated_data):
         request = self.context.get('request')
         if not request or not hasattr(request, 'user'):
             raise serializers.ValidationError("Must be authenticated to create a charge sale")
 
-        if not hasattr(request.user, 'seller_profile'):
+        principal = get_principal(request)
+        if not principal.is_seller:
             raise serializers.ValidationError("Only sellers can create phone charges")
 
-        validated_data['seller'] = request.user.seller_profile
+        validated_data['seller_id'] = principal.seller_id
+        validated_data.pop('number', None)
+
+        return super().create(validated_data)
+
+
+class BulkChargeItemSerializer(TimedSerializerMixin, serializers.Serializer):
+    transaction_uuid = serializers.CharField(max_length=255)
+    phone_number_id = serializers.IntegerField(min_value=1, required=False)
+    number = serializers.CharField(max_length=20, required=False, validators=[validate_phone_number])
+    amount = serializers.DecimalField(max_digits=12, decimal_places=0)
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Charge amount must be greater than zero")
+        return value
 
-        return super().create(validated_data)
\ No newline at end of file
+    def validate(self, attrs):
+        return validate_charge_target(attrs, 'phone_number_id')
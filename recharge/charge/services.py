@@ -0,0 +1,373 @@
+import random
+from decimal import Decimal
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Sum
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from recharge.db import update_returning
+from .models import PhoneNumber, ChargeSale
+from .numbers import get_phone_index, provision_phone_number, phone_numbers_setting
+from credits.ledger import write_ledger, SALE_WITNESS_FIELDS
+from credits.models import Transaction
+from credits.stats import record_daily_stats
+from accounts.models import Seller, SellerCreditShard
+from accounts.shards import debit_credit_shards
+
+
+class ChargeError(Exception):
+    pass
+
+
+class InsufficientCredit(ChargeError):
+    pass
+
+
+class DuplicateTransaction(ChargeError):
+    pass
+
+
+class StalePhoneNumber(ChargeError):
+    """The indexed id no longer belongs to the requested number."""
+
+
+def _adapt(amount):
+    return connection.ops.adapt_decimalfield_value(amount)
+
+
+def debit_seller(seller_id, amount, credit_shards=0):
+    """
+    Atomically take ``amount`` from the seller's credit.
+
+    The credit check and the write are one conditional UPDATE, so no SELECT ...
+    FOR UPDATE is needed; the seller row (or, for sharded sellers, one shard
+    row) stays locked until the caller's transaction ends, so callers debit
+    last. Returns ``(previous_credit, new_credit, credit_shard, transfers)``;
+    ``transfers`` are the ledger rows of a shard rebalance, see
+    debit_credit_shards, to be written before the debit's own row.
+    """
+    if credit_shards:
+        debited = debit_credit_shards(seller_id, amount, credit_shards)
+        if debited is not None:
+            return debited
+    else:
+        row = update_returning(
+            Seller._meta.db_table,
+            'credit = credit - %s',
+            [_adapt(amount)],
+            {'id': seller_id},
+            ['credit'],
+            condition='credit >= %s AND credit_shards = 0',
+            condition_params=[_adapt(amount)],
+        )
+        if row is not None:
+            new_credit = Seller._meta.get_field('credit').to_python(row[0])
+            return new_credit + amount, new_credit, None, []
+
+    current_shards = Seller.objects.filter(id=seller_id).values_list('credit_shards', flat=True).first()
+    if current_shards is None:
+        raise Seller.DoesNotExist()
+    if bool(current_shards) != bool(credit_shards):
+        # sharding was switched on or off since the caller read the seller
+        return debit_seller(seller_id, amount, current_shards)
+    raise InsufficientCredit()
+
+
+def credit_phone(phone_number_id, amount, charged_at):
+    row = update_returning(
+        PhoneNumber._meta.db_table,
+        'current_balance = current_balance + %s, last_charge_date = %s',
+        [_adapt(amount), connection.ops.adapt_datetimefield_value(charged_at)],
+        {'id': phone_number_id},
+        ['current_balance', 'number'],
+    )
+    if row is None:
+        raise PhoneNumber.DoesNotExist()
+    return PhoneNumber._meta.get_field('current_balance').to_python(row[0]), row[1]
+
+
+def charge_phone(seller_id, phone_number_id, amount, transaction_uuid, credit_shards=0, number=None):
+    """
+    Sell a charge of ``amount`` to a phone number on behalf of a seller.
+
+    With ``number`` the phone is also checked to still carry that number
+    (StalePhoneNumber otherwise), and when ``phone_number_id`` is None it is
+    created in the same transaction as the sale.
+
+    Raises InsufficientCredit, DuplicateTransaction, Seller.DoesNotExist or
+    PhoneNumber.DoesNotExist; nothing is written in any of those cases.
+    """
+    amount = Decimal(amount)
+    now = timezone.now()
+
+    try:
+        with transaction.atomic():
+            if phone_number_id is None:
+                phone_number_id = provision_phone_number(number)
+            phone_final_balance, charged_number = credit_phone(phone_number_id, amount, now)
+            if number is not None and charged_number != number:
+                raise StalePhoneNumber()
+            number = charged_number
+            # stamped while the phone row is locked, so (phone, created_at) follows the balance chain
+            charged_at = timezone.now()
+
+            charge_sale = ChargeSale.objects.create(
+                transaction_uuid=transaction_uuid,
+                seller_id=seller_id,
+                phone_number_id=phone_number_id,
+                amount=amount,
+                phone_initial_balance=phone_final_balance - amount,
+                phone_final_balance=phone_final_balance,
+                status='successful',
+                created_at=charged_at
+            )
+
+            content_type = ContentType.objects.get_for_model(ChargeSale)
+            # the seller is the hot row: lock it last, for the ledger write and the commit only
+            previous_credit, new_credit, credit_shard, transfers = debit_seller(seller_id, amount, credit_shards)
+            write_ledger([*transfers, Transaction(
+                seller_id=seller_id,
+                amount=-amount,
+                transaction_type='charge_sale',
+                previous_credit=previous_credit,
+                new_credit=new_credit,
+                credit_shard=credit_shard,
+                description=f"Charge sale for phone {number}",
+                status='successful',
+                completed_at=now,
+                content_type=content_type,
+                object_id=charge_sale.id
+            )], charge_sale, SALE_WITNESS_FIELDS)
+
+            record_daily_stats(
+                seller_id, timezone.localdate(now), credit_shard, charge_count=1, charge_amount=amount
+            )
+    except InsufficientCredit:
+        record_daily_stats(
+            seller_id, timezone.localdate(now), _any_shard(credit_shards), failed_charge_count=1
+        )
+        raise
+    except IntegrityError:
+        if ChargeSale.objects.filter(transaction_uuid=transaction_uuid).exists():
+            raise DuplicateTransaction()
+        raise
+
+    return charge_sale
+
+
+def _any_shard(credit_shards):
+    # for counters not tied to a debit, spread over the stats rows like the debits are
+    return random.randrange(credit_shards) if credit_shards else 0
+
+
+def charge_number(seller_id, number, amount, transaction_uuid, credit_shards=0, provision=None):
+    """
+    charge_phone for a phone number string, resolved through the number index.
+
+    Unknown numbers raise PhoneNumber.DoesNotExist unless ``provision`` (by
+    default ``PHONE_NUMBERS['AUTO_PROVISION']``) is set, in which case the
+    phone is created together with the sale.
+    """
+    if provision is None:
+        provision = phone_numbers_setting('AUTO_PROVISION')
+
+    index = get_phone_index()
+    for _ in range(2):
+        phone_number_id = index.lookup(number)
+        if phone_number_id is None and not provision:
+            raise PhoneNumber.DoesNotExist()
+        try:
+            return charge_phone(seller_id, phone_number_id, amount, transaction_uuid, credit_shards, number=number)
+        except (StalePhoneNumber, PhoneNumber.DoesNotExist):
+            # the indexed id was renumbered or deleted behind our back; ask the database again
+            index.forget(number=number, phone_id=phone_number_id)
+    raise PhoneNumber.DoesNotExist()
+
+
+def _bulk_result(item, status, detail=None, charge_sale=None):
+    result = {'transaction_uuid': item['transaction_uuid'], 'status': status}
+    if detail:
+        result['detail'] = detail
+    if charge_sale is not None:
+        result['id'] = charge_sale.id
+        result['phone_number_id'] = charge_sale.phone_number_id
+        result['amount'] = charge_sale.amount
+        result['phone_final_balance'] = charge_sale.phone_final_balance
+    return result
+
+
+def charge_phones_bulk(seller_id, items, credit_shards=0, max_attempts=3):
+    """
+    Charge many phone numbers for one seller in a single transaction.
+
+    ``items`` are validated dicts with ``transaction_uuid``, ``phone_number_id``
+    and ``amount``. Items are accepted in order while the seller's credit lasts;
+    the seller is debited once for the accepted total, each distinct phone is
+    incremented once, and the sales and ledger rows are written with
+    bulk_create. Returns one result dict per item, in input order.
+    """
+    for attempt in range(max_attempts):
+        results = [None] * len(items)
+
+        uuids = [item['transaction_uuid'] for item in items]
+        existing = set(
+            ChargeSale.objects.filter(transaction_uuid__in=uuids).values_list('transaction_uuid', flat=True)
+        )
+        phones = PhoneNumber.objects.in_bulk({item['phone_number_id'] for item in items})
+        _refresh_stale_numbers(items, phones)
+        credit = _available_credit(seller_id, credit_shards)
+
+        accepted = []
+        seen = set()
+        total = Decimal('0')
+        insufficient = 0
+        for index, item in enumerate(items):
+            if item['transaction_uuid'] in existing or item['transaction_uuid'] in seen:
+                results[index] = _bulk_result(item, 'failed', "Transaction with this UUID already exists.")
+            elif item['phone_number_id'] not in phones:
+                results[index] = _bulk_result(item, 'failed', "Phone number not found.")
+            elif total + item['amount'] > credit:
+                results[index] = _bulk_result(item, 'failed', "Insufficient credit for this transaction.")
+                insufficient += 1
+            else:
+                seen.add(item['transaction_uuid'])
+                total += item['amount']
+                accepted.append(index)
+
+        if not accepted:
+            record_daily_stats(seller_id, shard=_any_shard(credit_shards), failed_charge_count=insufficient)
+            return results
+
+        try:
+            with transaction.atomic():
+                _write_bulk_charges(seller_id, items, accepted, total, results, credit_shards, insufficient)
+        except InsufficientCredit:
+            # the seller spent credit concurrently between our read and the debit
+            continue
+        except IntegrityError:
+            # a concurrent request claimed one of our transaction_uuids
+            continue
+
+        return results
+
+    raise ChargeError("Could not apply bulk charge due to concurrent updates, please retry.")
+
+
+def _refresh_stale_numbers(items, phones):
+    """Re-resolve items charged by number whose indexed phone was renumbered or deleted."""
+    stale = set()
+    for item in items:
+        if 'number' in item and item['phone_number_id']:
+            phone = phones.get(item['phone_number_id'])
+            if phone is None or phone.number != item['number']:
+                stale.add(item['number'])
+    if not stale:
+        return
+
+    found = dict(PhoneNumber.objects.filter(number__in=stale).values_list('number', 'id'))
+    index = get_phone_index()
+    for number in stale:
+        index.forget(number=number)
+        if number in found:
+            index.set(number, found[number])
+    for item in items:
+        if item.get('number') in stale:
+            item['phone_number_id'] = found.get(item['number'], 0)
+    phones.update(PhoneNumber.objects.in_bulk(found.values()))
+
+
+def _available_credit(seller_id, credit_shards):
+    if credit_shards:
+        credit = SellerCreditShard.objects.filter(seller_id=seller_id).aggregate(total=Sum('credit'))['total']
+        if credit is not None:
+            return credit
+    credit = Seller.objects.filter(id=seller_id).values_list('credit', flat=True).first()
+    if credit is None:
+        raise Seller.DoesNotExist()
+    return credit
+
+
+def _write_bulk_charges(seller_id, items, accepted, total, results, credit_shards, insufficient):
+    now = timezone.now()
+
+    phone_totals = {}
+    for index in accepted:
+        phone_id = items[index]['phone_number_id']
+        phone_totals[phone_id] = phone_totals.get(phone_id, Decimal('0')) + items[index]['amount']
+
+    phone_balances = {}
+    phone_numbers = {}
+    for phone_id in sorted(phone_totals):
+        try:
+            final_balance, number = credit_phone(phone_id, phone_totals[phone_id], now)
+        except PhoneNumber.DoesNotExist:
+            # deleted since charge_phones_bulk looked it up
+            continue
+        phone_balances[phone_id] = final_balance - phone_totals[phone_id]
+        phone_numbers[phone_id] = number
+
+    for index in accepted:
+        if items[index]['phone_number_id'] not in phone_numbers:
+            results[index] = _bulk_result(items[index], 'failed', "Phone number not found.")
+            total -= items[index]['amount']
+    accepted = [index for index in accepted if items[index]['phone_number_id'] in phone_numbers]
+    if not accepted:
+        record_daily_stats(seller_id, shard=_any_shard(credit_shards), failed_charge_count=insufficient)
+        return
+    charged_at = timezone.now()
+
+    charge_sales = []
+    for index in accepted:
+        item = items[index]
+        phone_id = item['phone_number_id']
+        initial_balance = phone_balances[phone_id]
+        phone_balances[phone_id] = initial_balance + item['amount']
+        charge_sales.append(ChargeSale(
+            transaction_uuid=item['transaction_uuid'],
+            seller_id=seller_id,
+            phone_number_id=phone_id,
+            amount=item['amount'],
+            phone_initial_balance=initial_balance,
+            phone_final_balance=initial_balance + item['amount'],
+            status='successful',
+            created_at=charged_at
+        ))
+    ChargeSale.objects.bulk_create(charge_sales)
+
+    if any(charge_sale.pk is None for charge_sale in charge_sales):
+        ids = dict(
+            ChargeSale.objects.filter(
+                transaction_uuid__in=[charge_sale.transaction_uuid for charge_sale in charge_sales]
+            ).values_list('transaction_uuid', 'id')
+        )
+        for charge_sale in charge_sales:
+            charge_sale.pk = ids[charge_sale.transaction_uuid]
+
+    # the ledger starts with the transfers of a shard rebalance, if the debit needed one
+    credit, _, credit_shard, ledger = debit_seller(seller_id, total, credit_shards)
+    content_type = ContentType.objects.get_for_model(ChargeSale)
+    for charge_sale in charge_sales:
+        ledger.append(Transaction(
+            seller_id=seller_id,
+            amount=-charge_sale.amount,
+            transaction_type='charge_sale',
+            previous_credit=credit,
+            new_credit=credit - charge_sale.amount,
+            credit_shard=credit_shard,
+            description=f"Charge sale for phone {phone_numbers[charge_sale.phone_number_id]}",
+            status='successful',
+            created_at=now,
+            completed_at=now,
+            content_type=content_type,
+            object_id=charge_sale.id
+        ))
+        credit -= charge_sale.amount
+    write_ledger(ledger, charge_sales[0], SALE_WITNESS_FIELDS)
+    record_daily_stats(
+        seller_id, timezone.localdate(now), credit_shard,
+        charge_count=len(charge_sales), charge_amount=total, failed_charge_count=insufficient
+    )
+
+    for index, charge_sale in zip(accepted, charge_sales):
+        results[index] = _bulk_result(items[index], 'successful', charge_sale=charge_sale)
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import PhoneNumber
+from .numbers import get_phone_index, index_on_commit
+
+
+@receiver(post_save, sender=PhoneNumber)
+def index_saved_phone_number(sender, instance, **kwargs):
+    index_on_commit(instance)
+
+
+@receiver(post_delete, sender=PhoneNumber)
+def drop_deleted_phone_number(sender, instance, **kwargs):
+    get_phone_index().forget(phone_id=instance.id)
@@ -1,3 +1,358 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from recharge import idempotency
+from credits.models import Transaction
+from .models import PhoneNumber, ChargeSale
+from . import services
+from .numbers import get_phone_index
+from .services import charge_phone, charge_number, InsufficientCredit, DuplicateTransaction
+from .verify import verify_charge_chains
+
+User = get_user_model()
+
+
+class ChargeEngineTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='engine_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        self.phone = PhoneNumber.objects.create(number='09120000001', current_balance=Decimal('5'))
+
+    def test_charge_moves_credit_and_writes_ledger(self):
+        charge_sale = charge_phone(self.seller.id, self.phone.id, Decimal('40'), 'uuid-1')
+
+        self.seller.refresh_from_db()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('60'))
+        self.assertEqual(self.phone.current_balance, Decimal('45'))
+        self.assertEqual(charge_sale.phone_initial_balance, Decimal('5'))
+        self.assertEqual(charge_sale.phone_final_balance, Decimal('45'))
+
+        ledger = Transaction.objects.get(seller=self.seller)
+        self.assertEqual(ledger.previous_credit, Decimal('100'))
+        self.assertEqual(ledger.new_credit, Decimal('60'))
+        self.assertEqual(ledger.amount, Decimal('-40'))
+
+    def test_insufficient_credit_writes_nothing(self):
+        with self.assertRaises(InsufficientCredit):
+            charge_phone(self.seller.id, self.phone.id, Decimal('101'), 'uuid-2')
+
+        self.seller.refresh_from_db()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('100'))
+        self.assertEqual(self.phone.current_balance, Decimal('5'))
+        self.assertFalse(ChargeSale.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_duplicate_uuid_is_rolled_back(self):
+        charge_phone(self.seller.id, self.phone.id, Decimal('10'), 'uuid-3')
+
+        with self.assertRaises(DuplicateTransaction):
+            charge_phone(self.seller.id, self.phone.id, Decimal('10'), 'uuid-3')
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('90'))
+        self.assertEqual(ChargeSale.objects.count(), 1)
+
+    def test_unknown_phone_writes_nothing(self):
+        with self.assertRaises(PhoneNumber.DoesNotExist):
+            charge_phone(self.seller.id, self.phone.id + 100, Decimal('10'), 'uuid-4')
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('100'))
+
+
+class BulkChargeTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulk_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=self.user, credit=Decimal('100'))
+        self.phones = [
+            PhoneNumber.objects.create(number=f'0912000{i:04d}', current_balance=Decimal('0'))
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_charge_partial_success(self):
+        charge_phone(self.seller.id, self.phones[0].id, Decimal('10'), 'existing')
+        items = [
+            {'transaction_uuid': 'b-1', 'phone_number_id': self.phones[0].id, 'amount': 30},
+            {'transaction_uuid': 'b-2', 'phone_number_id': self.phones[0].id, 'amount': 20},
+            {'transaction_uuid': 'existing', 'phone_number_id': self.phones[1].id, 'amount': 5},
+            {'transaction_uuid': 'b-3', 'phone_number_id': 999999, 'amount': 5},
+            {'transaction_uuid': 'b-4', 'phone_number_id': self.phones[1].id, 'amount': 0},
+            {'transaction_uuid': 'b-5', 'phone_number_id': self.phones[2].id, 'amount': 50},
+            {'transaction_uuid': 'b-6', 'phone_number_id': self.phones[2].id, 'amount': 40},
+        ]
+
+        response = self.client.post('/api/charge/charges/bulk/', items, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['successful', 'successful', 'failed', 'failed', 'failed', 'failed', 'successful'])
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('0'))
+        self.phones[0].refresh_from_db()
+        self.assertEqual(self.phones[0].current_balance, Decimal('60'))
+
+        sales = list(ChargeSale.objects.filter(transaction_uuid__in=['b-1', 'b-2']).order_by('id'))
+        self.assertEqual([(s.phone_initial_balance, s.phone_final_balance) for s in sales],
+                         [(Decimal('10'), Decimal('40')), (Decimal('40'), Decimal('60'))])
+
+        ledger = list(Transaction.objects.filter(seller=self.seller).order_by('id'))
+        self.assertEqual(len(ledger), 4)
+        for previous, current in zip(ledger, ledger[1:]):
+            self.assertEqual(previous.new_credit, current.previous_credit)
+        self.assertEqual(ledger[-1].new_credit, self.seller.credit)
+        self.assertEqual(ledger[2].object_id, sales[-1].id)
+
+    def test_phone_deleted_before_the_write_fails_only_its_items(self):
+        available_credit = services._available_credit
+
+        def delete_phone_first(*args):
+            # lands between the phone lookup and the write
+            self.phones[1].delete()
+            return available_credit(*args)
+
+        items = [
+            {'transaction_uuid': 'd-1', 'phone_number_id': self.phones[0].id, 'amount': 30},
+            {'transaction_uuid': 'd-2', 'phone_number_id': self.phones[1].id, 'amount': 20},
+        ]
+        with mock.patch('charge.services._available_credit', side_effect=delete_phone_first):
+            response = self.client.post('/api/charge/charges/bulk/', items, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], ['successful', 'failed'])
+        self.assertEqual(response.data['results'][1]['detail'], "Phone number not found.")
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('70'))
+
+
+class IdempotentChargeTestCase(TestCase):
+
+    def setUp(self):
+        idempotency.get_store().clear()
+        self.user = User.objects.create_user(username='retry_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=self.user, credit=Decimal('100'))
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_retry_replays_without_queries(self):
+        data = {'transaction_uuid': 'retry-1', 'phone_number_id': self.phone.id, 'amount': 10}
+        first = self.client.post('/api/charge/charges/', data, format='json')
+        self.assertEqual(first.status_code, 201)
+
+        with self.assertNumQueries(0):
+            retry = self.client.post('/api/charge/charges/', data, format='json')
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('90'))
+
+    def test_key_reused_with_a_different_body_conflicts(self):
+        data = {'transaction_uuid': 'retry-3', 'phone_number_id': self.phone.id, 'amount': 10}
+        self.client.post('/api/charge/charges/', data, format='json')
+
+        retry = self.client.post('/api/charge/charges/', {**data, 'amount': 50}, format='json')
+
+        self.assertEqual(retry.status_code, 409)
+        self.assertEqual(ChargeSale.objects.count(), 1)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('90'))
+
+    def test_clear_leaves_the_shared_cache_alone(self):
+        store = idempotency.IdempotencyStore(10, cache_alias='default')
+        caches['default'].set('unrelated', 'kept')
+        store.set('charge', self.user.id, 'retry-4', idempotency.fingerprint({}), 201, {})
+
+        store.clear()
+
+        self.assertEqual(caches['default'].get('unrelated'), 'kept')
+        self.assertIsNotNone(store.get('charge', self.user.id, 'retry-4'))
+
+    def test_duplicate_after_cache_loss_hits_constraint(self):
+        data = {'transaction_uuid': 'retry-2', 'phone_number_id': self.phone.id, 'amount': 10}
+        self.client.post('/api/charge/charges/', data, format='json')
+        idempotency.get_store().clear()
+
+        retry = self.client.post('/api/charge/charges/', data, format='json')
+
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(ChargeSale.objects.count(), 1)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('90'))
+
+
+class ChargeChainVerifierTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='chain_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('1000'))
+        self.phones = [
+            PhoneNumber.objects.create(number=f'0913000{i:04d}', current_balance=Decimal('5'))
+            for i in range(5)
+        ]
+        for i in range(20):
+            charge_phone(self.seller.id, self.phones[i % 5].id, Decimal(i + 1), f'chain-{i}')
+
+    def test_clean_chains_across_ranges(self):
+        report = verify_charge_chains(shards=3)
+
+        self.assertTrue(report['clean'], report['discrepancies'])
+        self.assertEqual(report['phones'], 5)
+        self.assertEqual(report['sales'], 20)
+        self.assertEqual(len(report['ranges']), 3)
+
+    def test_broken_chain_and_balance_are_reported(self):
+        phone = self.phones[2]
+        sale = ChargeSale.objects.filter(phone_number=phone).order_by('created_at', 'id')[1]
+        ChargeSale.objects.filter(id=sale.id).update(phone_initial_balance=sale.phone_initial_balance + 1)
+        PhoneNumber.objects.filter(id=self.phones[4].id).update(current_balance=Decimal('0'))
+
+        report = verify_charge_chains(shards=2)
+
+        self.assertFalse(report['clean'])
+        kinds = {(issue['kind'], issue['phone_number_id']) for issue in report['discrepancies']}
+        self.assertEqual(kinds, {
+            ('chain_break', phone.id), ('bad_arithmetic', phone.id), ('balance_mismatch', self.phones[4].id),
+        })
+
+
+class ChargeByNumberTestCase(TestCase):
+
+    def setUp(self):
+        get_phone_index().clear()
+        self.user = User.objects.create_user(username='number_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=self.user, credit=Decimal('100'))
+        self.phone = PhoneNumber.objects.create(number='09140000001')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def charge(self, number, amount, transaction_uuid):
+        return self.client.post(
+            '/api/charge/charges/',
+            {'transaction_uuid': transaction_uuid, 'number': number, 'amount': amount},
+            format='json'
+        )
+
+    def test_charge_by_number_warms_the_index(self):
+        response = self.charge('09140000001', 10, 'n-1')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['phone_number']['id'], self.phone.id)
+        self.assertEqual(get_phone_index().get('09140000001'), self.phone.id)
+        self.assertEqual(self.charge('09149999999', 10, 'n-2').status_code, 404)
+        self.assertEqual(self.client.post(
+            '/api/charge/charges/',
+            {'transaction_uuid': 'n-3', 'number': '09140000001', 'phone_number_id': self.phone.id, 'amount': 1},
+            format='json'
+        ).status_code, 400)
+
+    def test_stale_index_entry_is_corrected(self):
+        other = PhoneNumber.objects.create(number='09140000002')
+        get_phone_index().set('09140000001', other.id)
+
+        charge_number(self.seller.id, '09140000001', Decimal('10'), 'n-4')
+
+        self.phone.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.phone.current_balance, Decimal('10'))
+        self.assertEqual(other.current_balance, Decimal('0'))
+        self.assertEqual(get_phone_index().get('09140000001'), self.phone.id)
+
+    @override_settings(PHONE_NUMBERS={'AUTO_PROVISION': True})
+    def test_auto_provision_is_part_of_the_sale(self):
+        response = self.charge('09140000003', 500, 'n-5')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PhoneNumber.objects.filter(number='09140000003').exists())
+
+        response = self.charge('09140000003', 30, 'n-6')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(PhoneNumber.objects.get(number='09140000003').current_balance, Decimal('30'))
+
+    def test_bulk_accepts_numbers(self):
+        response = self.client.post('/api/charge/charges/bulk/', [
+            {'transaction_uuid': 'nb-1', 'number': '09140000001', 'amount': 10},
+            {'transaction_uuid': 'nb-2', 'number': '09149999999', 'amount': 10},
+        ], format='json')
+
+        self.assertEqual([result['status'] for result in response.data['results']], ['successful', 'failed'])
+        self.assertEqual(response.data['results'][0]['phone_number_id'], self.phone.id)
+
+    def test_bulk_lookup_only_queries_index_misses(self):
+        other = PhoneNumber.objects.create(number='09140000002')
+        get_phone_index().set('09140000001', self.phone.id)
+
+        with self.assertNumQueries(1):
+            found = get_phone_index().lookup_many(['09140000001', '09140000002', '09149999999'])
+        self.assertEqual(found, {'09140000001': self.phone.id, '09140000002': other.id})
+        with self.assertNumQueries(0):
+            get_phone_index().lookup_many(['09140000001', '09140000002'])
+
+    def test_bulk_corrects_a_stale_index_entry(self):
+        other = PhoneNumber.objects.create(number='09140000002')
+        get_phone_index().set('09140000001', other.id)
+
+        response = self.client.post('/api/charge/charges/bulk/', [
+            {'transaction_uuid': 'nb-3', 'number': '09140000001', 'amount': 10},
+        ], format='json')
+
+        self.assertEqual(response.data['results'][0]['phone_number_id'], self.phone.id)
+        other.refresh_from_db()
+        self.assertEqual(other.current_balance, Decimal('0'))
+        self.assertEqual(get_phone_index().get('09140000001'), self.phone.id)
+
+
+class ImportPhoneNumbersTestCase(TestCase):
+
+    def test_generated_range_is_idempotent(self):
+        PhoneNumber.objects.create(number='09150000003', current_balance=Decimal('7'))
+
+        call_command('import_phone_numbers', count=25, prefix='0915', width=7, batch_size=4, stdout=StringIO())
+        call_command('import_phone_numbers', count=25, prefix='0915', width=7, batch_size=4, stdout=StringIO())
+
+        self.assertEqual(PhoneNumber.objects.filter(number__startswith='0915').count(), 25)
+        self.assertEqual(PhoneNumber.objects.get(number='09150000003').current_balance, Decimal('7'))
+
+    def test_file_import_resumes_from_state(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'numbers.csv')
+            state = os.path.join(directory, 'state.json')
+            with open(path, 'w') as numbers:
+                numbers.write('number,operator\n')
+                numbers.writelines(f'0916{i:07d},mci\n' for i in range(10))
+                numbers.write('not-a-number\n')
+
+            with open(state, 'w') as saved:
+                json.dump({'source': None, 'offset': 0}, saved)
+            with self.assertRaises(CommandError):
+                call_command('import_phone_numbers', file=path, state=state, resume=True, stdout=StringIO())
+
+            os.remove(state)
+            call_command('import_phone_numbers', file=path, state=state, batch_size=2,
+                         batches_per_transaction=2, stdout=StringIO())
+            with open(state) as saved:
+                self.assertEqual(json.load(saved)['offset'], 11)
+
+            PhoneNumber.objects.filter(number__startswith='0916').delete()
+            out = StringIO()
+            call_command('import_phone_numbers', file=path, state=state, resume=True, stdout=out)
+            self.assertIn('Resuming after 11 numbers', out.getvalue())
+            self.assertFalse(PhoneNumber.objects.filter(number__startswith='0916').exists())
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import PhoneNumberViewSet, ChargeSaleViewSet
+from . import async_views
 
 
 router = DefaultRouter()
@@ -8,5 +9,6 @@ router.register(r'phone-numbers', PhoneNumberViewSet)
 router.register(r'charges', ChargeSaleViewSet, basename='charge')
 
 urlpatterns = [
+    path('async/charges/', async_views.charge_create, name='async-charge-create'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
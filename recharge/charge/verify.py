@@ -0,0 +1,110 @@
+"""
+Phone balance charge-chain verification.
+
+Each phone's successful charge sales, in ``(created_at, id)`` order, must
+chain: every sale starts at the previous sale's final balance, ends at its
+initial balance plus its amount, and the last final balance must equal
+``PhoneNumber.current_balance``. Sales are streamed per phone-id range with
+one ordered query, so memory stays constant however large the table is.
+"""
+from functools import partial
+
+from django.db.models import Max, Min
+
+from recharge.workers import map_in_processes
+from .models import ChargeSale, PhoneNumber
+
+CHAIN_BREAK = 'chain_break'
+BAD_ARITHMETIC = 'bad_arithmetic'
+BALANCE_MISMATCH = 'balance_mismatch'
+
+SALE_COLUMNS = (
+    'phone_number_id', 'id', 'amount', 'phone_initial_balance', 'phone_final_balance',
+    'phone_number__current_balance',
+)
+
+
+def phone_id_ranges(shards, min_id=None, max_id=None):
+    """Split ``[min_id, max_id]`` into up to ``shards`` half-open ``(start, end)`` ranges."""
+    bounds = PhoneNumber.objects.aggregate(low=Min('id'), high=Max('id'))
+    low = bounds['low'] if min_id is None else max(min_id, bounds['low'] or min_id)
+    high = bounds['high'] if max_id is None else min(max_id, bounds['high'] or max_id)
+    if low is None or high is None or low > high:
+        return []
+
+    step = -(-(high - low + 1) // max(shards, 1))
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+def _issue(phone_id, kind, expected, actual, charge_sale_id=None):
+    return {
+        'phone_number_id': phone_id,
+        'kind': kind,
+        'charge_sale_id': charge_sale_id,
+        'expected': expected,
+        'actual': actual,
+    }
+
+
+def verify_range(id_range, batch_size=5000, max_discrepancies=1000):
+    """
+    Verify the phones with ``start <= id < end``.
+
+    The sales and the phones' current balances come from one joined query,
+    so on PostgreSQL they are read from the same snapshot through a
+    server-side cursor.
+    """
+    start, end = id_range
+    sales = ChargeSale.objects.filter(
+        phone_number_id__gte=start, phone_number_id__lt=end, status='successful'
+    ).order_by('phone_number_id', 'created_at', 'id').values_list(*SALE_COLUMNS)
+
+    report = {'range': [start, end], 'phones': 0, 'sales': 0, 'discrepancy_count': 0, 'discrepancies': []}
+
+    def flag(*args):
+        report['discrepancy_count'] += 1
+        if len(report['discrepancies']) < max_discrepancies:
+            report['discrepancies'].append(_issue(*args))
+
+    def close(phone_id, final, current):
+        if phone_id is not None and final != current:
+            flag(phone_id, BALANCE_MISMATCH, final, current)
+
+    phone_id = final = current = None
+    for sale_phone_id, pk, amount, initial, sale_final, sale_current in sales.iterator(chunk_size=batch_size):
+        if sale_phone_id != phone_id:
+            close(phone_id, final, current)
+            phone_id, current = sale_phone_id, sale_current
+            report['phones'] += 1
+        elif initial != final:
+            flag(phone_id, CHAIN_BREAK, final, initial, pk)
+
+        if initial + amount != sale_final:
+            flag(phone_id, BAD_ARITHMETIC, initial + amount, sale_final, pk)
+        final = sale_final
+        report['sales'] += 1
+    close(phone_id, final, current)
+
+    return report
+
+
+def verify_charge_chains(workers=1, shards=None, min_id=None, max_id=None, batch_size=5000, max_discrepancies=1000):
+    """
+    Verify every phone's charge chain, split into phone-id ranges that are
+    spread over ``workers`` processes. Returns a report for ``DjangoJSONEncoder``.
+    """
+    ranges = phone_id_ranges(shards or workers * 4, min_id, max_id)
+    run = partial(verify_range, batch_size=batch_size, max_discrepancies=max_discrepancies)
+    reports = list(map_in_processes(run, ranges, workers))
+
+    discrepancies = [issue for report in reports for issue in report['discrepancies']]
+    discrepancy_count = sum(report['discrepancy_count'] for report in reports)
+    return {
+        'workers': workers,
+        'ranges': [report['range'] for report in reports],
+        'phones': sum(report['phones'] for report in reports),
+        'sales': sum(report['sales'] for report in reports),
+        'clean': not discrepancy_count,
+        'discrepancy_count': discrepancy_count,
+        'discrepancies': discrepancies,
+    }
@@ -1,16 +1,24 @@
 from rest_framework import viewsets, status, permissions
+from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.utils import timezone
-from django.db import transaction
-from django.contrib.contenttypes.models import ContentType
 
 from .models import PhoneNumber, ChargeSale
-from .serializers import PhoneNumberSerializer, ChargeSaleSerializer
-from credits.models import Transaction
+from .serializers import PhoneNumberSerializer, ChargeSaleSerializer, BulkChargeItemSerializer
+from .numbers import get_phone_index
+from .services import (
+    charge_phone, charge_number, charge_phones_bulk, ChargeError, InsufficientCredit, DuplicateTransaction
+)
 from accounts.permissions import IsSeller, IsAdminUser
 from accounts.models import Seller
-import uuid
-class PhoneNumberViewSet(viewsets.ModelViewSet):
+from accounts.principal import get_principal
+from recharge import idempotency
+from recharge.flat import FlatListMixin
+from recharge.pagination import HistoryPagination
+from recharge.querysets import ShapedQuerysetMixin, shape_queryset
+from recharge.transactions import run_transaction, TransactionContention, contention_response
+
+
+class PhoneNumberViewSet(ShapedQuerysetMixin, viewsets.ModelViewSet):
 
     queryset = PhoneNumber.objects.all()
     serializer_class = PhoneNumberSerializer
@@ -24,107 +32,63 @@ class PhoneNumberViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
 
 
-class ChargeSaleViewSet(viewsets.ModelViewSet):
+class ChargeSaleViewSet(FlatListMixin, ShapedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = ChargeSaleSerializer
     permission_classes = [IsSeller | IsAdminUser]
+    pagination_class = HistoryPagination
+    bulk_max_items = 1000
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_admin_user:
+        principal = get_principal(self.request)
+        if principal.is_admin_user:
             return ChargeSale.objects.all().order_by('-created_at')
-        elif hasattr(user, 'seller_profile'):
-            return ChargeSale.objects.filter(seller=user.seller_profile).order_by('-created_at')
+        elif principal.is_seller:
+            return ChargeSale.objects.filter(seller_id=principal.seller_id).order_by('-created_at')
         return ChargeSale.objects.none()
 
     def create(self, request, *args, **kwargs):
+        transaction_uuid = request.data.get('transaction_uuid') if isinstance(request.data, dict) else None
+        replayed = idempotency.replay('charge', request.user.id, transaction_uuid, request.data)
+        if replayed is not None:
+            return replayed
+
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        phone_number_id = serializer.validated_data.get('phone_number').id
+        phone_number = serializer.validated_data.get('phone_number')
+        number = serializer.validated_data.get('number')
         amount = serializer.validated_data.get('amount')
         transaction_uuid = serializer.validated_data.get('transaction_uuid')
 
-        seller = request.user.seller_profile
-
-
-        if ChargeSale.objects.filter(transaction_uuid=transaction_uuid).exists():
+        principal = get_principal(request)
+        if not principal.is_seller:
             return Response(
-                {"detail": "Transaction with this UUID already exists."},
-                status=status.HTTP_400_BAD_REQUEST
+                {"detail": "Seller profile not found."},
+                status=status.HTTP_404_NOT_FOUND
             )
 
         try:
-            with transaction.atomic():
-                # comment for sqlite
-                # connection.cursor().execute("SET LOCAL statement_timeout = '5s'")
-
-
-                phone_number = PhoneNumber.objects.select_for_update().get(id=phone_number_id)
-                seller = Seller.objects.select_for_update().get(id=seller.id)
-
-
-                if ChargeSale.objects.filter(transaction_uuid=transaction_uuid).exists():
-                    return Response(
-                        {"detail": "Transaction with this UUID already exists (concurrent)."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-
-                if seller.credit < amount:
-                    return Response(
-                        {"detail": "Insufficient credit for this transaction."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-
-                previous_seller_credit = seller.credit
-                phone_initial_balance = phone_number.current_balance
-
-
-                new_seller_credit = previous_seller_credit - amount
-                phone_final_balance = phone_initial_balance + amount
-
-
-                charge_sale = ChargeSale.objects.create(
-                    transaction_uuid=transaction_uuid,
-                    seller=seller,
-                    phone_number=phone_number,
-                    amount=amount,
-                    phone_initial_balance=phone_initial_balance,
-                    phone_final_balance=phone_final_balance,
-                    status='successful',
-                    created_at=timezone.now()
+            if phone_number is not None:
+                charge_sale = run_transaction(
+                    charge_phone, principal.seller_id, phone_number.id, amount, transaction_uuid,
+                    principal.credit_shards, name='charge', atomic=False
                 )
-
-
-
-
-                transaction_obj = Transaction.objects.create(
-                    seller=seller,
-                    amount=-amount,
-                    transaction_type='charge_sale',
-                    previous_credit=previous_seller_credit,
-                    new_credit=new_seller_credit,
-                    description=f"Charge sale for phone {phone_number.number}",
-                    status='successful',
-                    completed_at=timezone.now(),
-                    content_type=ContentType.objects.get_for_model(ChargeSale),
-                    object_id=charge_sale.id
-                )
-
-
-                seller.credit = new_seller_credit
-                seller.save(update_fields=['credit'])
-
-                phone_number.current_balance = phone_final_balance
-                phone_number.last_charge_date = timezone.now()
-                phone_number.save(update_fields=['current_balance', 'last_charge_date'])
-
-                return Response(
-                    self.get_serializer(charge_sale).data,
-                    status=status.HTTP_201_CREATED
+            else:
+                charge_sale = run_transaction(
+                    charge_number, principal.seller_id, number, amount, transaction_uuid,
+                    principal.credit_shards, name='charge', atomic=False
                 )
 
+        except DuplicateTransaction:
+            return Response(
+                {"detail": "Transaction with this UUID already exists."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except InsufficientCredit:
+            return Response(
+                {"detail": "Insufficient credit for this transaction."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except PhoneNumber.DoesNotExist:
             return Response(
                 {"detail": "Phone number not found."},
@@ -135,8 +99,80 @@ class ChargeSaleViewSet(viewsets.ModelViewSet):
                 {"detail": "Seller profile not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as e:
+        except TransactionContention:
+            return contention_response()
+
+        charge_sale = shape_queryset(ChargeSale.objects.all(), self.get_serializer_class()).get(pk=charge_sale.pk)
+        return idempotency.remember('charge', request.user.id, transaction_uuid, request.data, Response(
+            self.get_serializer(charge_sale).data,
+            status=status.HTTP_201_CREATED
+        ))
+
+    @action(detail=False, methods=['post'], permission_classes=[IsSeller])
+    def bulk(self, request):
+        items = request.data.get('items') if isinstance(request.data, dict) else request.data
+
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"detail": "Expected a non-empty list of charges."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(items) > self.bulk_max_items:
             return Response(
-                {"detail": f"Error processing charge: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+                {"detail": f"A bulk request may contain at most {self.bulk_max_items} charges."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(items)
+        valid_items = []
+        valid_indexes = []
+        for index, item in enumerate(items):
+            item_serializer = BulkChargeItemSerializer(data=item)
+            if item_serializer.is_valid():
+                valid_items.append(item_serializer.validated_data)
+                valid_indexes.append(index)
+            else:
+                results[index] = {
+                    'transaction_uuid': item.get('transaction_uuid') if isinstance(item, dict) else None,
+                    'status': 'failed',
+                    'errors': item_serializer.errors
+                }
+
+        numbers = [item['number'] for item in valid_items if 'number' in item]
+        if numbers:
+            phone_ids = get_phone_index().lookup_many(numbers)
+            for item in valid_items:
+                if 'number' in item:
+                    # unknown numbers fall through to "Phone number not found."
+                    item['phone_number_id'] = phone_ids.get(item['number'], 0)
+
+        if valid_items:
+            try:
+                principal = get_principal(request)
+                charged = run_transaction(
+                    charge_phones_bulk, principal.seller_id, valid_items, principal.credit_shards,
+                    name='charge_bulk', atomic=False
+                )
+            except Seller.DoesNotExist:
+                return Response(
+                    {"detail": "Seller profile not found."},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            except ChargeError as e:
+                return Response(
+                    {"detail": str(e)},
+                    status=status.HTTP_409_CONFLICT
+                )
+            except TransactionContention:
+                return contention_response()
+
+            for index, result in zip(valid_indexes, charged):
+                results[index] = result
+
+        successful = sum(1 for result in results if result['status'] == 'successful')
+        return Response({
+            "successful": successful,
+            "failed": len(results) - successful,
+            "results": results
+        })
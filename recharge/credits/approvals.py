@@ -0,0 +1,139 @@
+"""
+Processing many credit requests in one transaction.
+
+Requests and then sellers are locked in ascending id order (the same order,
+request before seller, that the single ``process`` action takes), so
+concurrent batches and single approvals queue behind each other instead of
+deadlocking. Approved amounts are summed per seller into one UPDATE, and the
+ledger rows for a seller are chained from the credit that UPDATE returns.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Seller
+from accounts.shards import credit_credit_shard
+from recharge.db import update_returning
+from .ledger import write_ledger, APPROVAL_WITNESS_FIELDS
+from .models import CreditRequest, Transaction
+from .stats import record_daily_stats
+
+LOCK_CHUNK_SIZE = 500
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _result(request_id, status, detail=None, **extra):
+    result = {'id': request_id, 'status': status, **extra}
+    if detail is not None:
+        result['detail'] = detail
+    return result
+
+
+def _credit_seller(seller_id, amount, credit_shards):
+    if credit_shards:
+        return credit_credit_shard(seller_id, amount, credit_shards)
+    row = update_returning(
+        Seller._meta.db_table,
+        'credit = credit + %s',
+        [connection.ops.adapt_decimalfield_value(amount)],
+        {'id': seller_id},
+        ['credit'],
+    )
+    new_credit = Seller._meta.get_field('credit').to_python(row[0])
+    return new_credit - amount, new_credit, None
+
+
+def process_credit_requests(ids, action):
+    """
+    Approve or reject the credit requests ``ids``; ``action`` is 'approve' or
+    'reject'. Returns one result per distinct id, in the order given: requests
+    that no longer exist or are no longer pending are reported as failed and
+    do not affect the others.
+    """
+    ids = list(dict.fromkeys(ids))
+    now = timezone.now()
+    processed_status = 'approved' if action == 'approve' else 'rejected'
+
+    with transaction.atomic():
+        locked = {}
+        for chunk in _chunks(sorted(ids), LOCK_CHUNK_SIZE):
+            locked.update(
+                (credit_request.id, credit_request)
+                for credit_request in CreditRequest.objects.select_for_update().filter(id__in=chunk).order_by('id')
+            )
+
+        pending = [locked[request_id] for request_id in sorted(locked) if locked[request_id].status == 'pending']
+        results = {}
+
+        # before any seller: LOCK_ORDER has credit requests ahead of sellers and shards
+        pending_ids = [credit_request.id for credit_request in pending]
+        for chunk in _chunks(pending_ids, LOCK_CHUNK_SIZE):
+            CreditRequest.objects.filter(id__in=chunk).update(status=processed_status, processed_at=now)
+        for credit_request in pending:
+            credit_request.status = processed_status
+            credit_request.processed_at = now
+
+        if action == 'approve' and pending:
+            by_seller = {}
+            for credit_request in pending:
+                by_seller.setdefault(credit_request.seller_id, []).append(credit_request)
+
+            credit_shards = {}
+            for chunk in _chunks(sorted(by_seller), LOCK_CHUNK_SIZE):
+                credit_shards.update(
+                    Seller.objects.select_for_update().filter(id__in=chunk).order_by('id')
+                    .values_list('id', 'credit_shards')
+                )
+
+            content_type = ContentType.objects.get_for_model(CreditRequest)
+            ledger = []
+            for seller_id in sorted(by_seller):
+                group = by_seller[seller_id]
+                total = sum(credit_request.amount for credit_request in group)
+                previous_credit, _, credit_shard = _credit_seller(seller_id, total, credit_shards[seller_id])
+
+                for credit_request in group:
+                    new_credit = previous_credit + credit_request.amount
+                    ledger.append(Transaction(
+                        seller_id=seller_id,
+                        amount=credit_request.amount,
+                        transaction_type='credit_increase',
+                        previous_credit=previous_credit,
+                        new_credit=new_credit,
+                        credit_shard=credit_shard,
+                        description=f"Credit increase from request {credit_request.reference_id}",
+                        status='successful',
+                        completed_at=now,
+                        content_type=content_type,
+                        object_id=credit_request.id
+                    ))
+                    results[credit_request.id] = _result(
+                        credit_request.id, 'approved', previous_credit=str(previous_credit), new_credit=str(new_credit)
+                    )
+                    previous_credit = new_credit
+
+                record_daily_stats(
+                    seller_id, shard=credit_shard, credit_increase_count=len(group), credit_increase_amount=total
+                )
+        else:
+            for credit_request in pending:
+                results[credit_request.id] = _result(credit_request.id, 'rejected')
+
+        if action == 'approve' and pending:
+            write_ledger(ledger, pending[0], APPROVAL_WITNESS_FIELDS)
+
+    for request_id in ids:
+        if request_id in results:
+            continue
+        credit_request = locked.get(request_id)
+        if credit_request is None:
+            results[request_id] = _result(request_id, 'failed', "Credit request not found.")
+        else:
+            results[request_id] = _result(
+                request_id, 'failed', f"This request has already been {credit_request.status}."
+            )
+    return [results[request_id] for request_id in ids]
@@ -0,0 +1,100 @@
+"""
+Async (ASGI) variants of credit-request create and transaction list.
+"""
+import json
+
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django.conf import settings
+
+from accounts.authentication import aauthenticate_token, error_response
+from accounts.principal import aget_principal
+from recharge import idempotency
+from .models import CreditRequest, Transaction
+from .serializers import CreditRequestSerializer, TransactionSerializer
+
+
+@csrf_exempt
+@require_POST
+async def credit_request_create(request):
+    user = await aauthenticate_token(request)
+    if user is None:
+        return error_response("Authentication credentials were not provided.", 401)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return error_response("Malformed JSON.", 400)
+    if not isinstance(data, dict):
+        return error_response("Expected a JSON object.", 400)
+
+    replayed = idempotency.replay('credit_request', user.id, data.get('reference_id'), data)
+    if replayed is not None:
+        return JsonResponse(replayed.data, status=replayed.status_code)
+
+    principal = await aget_principal(user)
+    if not principal.is_seller:
+        return error_response("Only sellers can request credit increases", 403)
+
+    serializer = CreditRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    try:
+        credit_request = await CreditRequest.objects.acreate(seller_id=principal.seller_id, **serializer.validated_data)
+    except IntegrityError:
+        return error_response("Credit request with this reference ID already exists.", 400)
+
+    credit_request = await CreditRequest.objects.select_related('seller__user').aget(pk=credit_request.pk)
+    body = CreditRequestSerializer(credit_request).data
+    idempotency.get_store().set(
+        'credit_request', user.id, credit_request.reference_id, idempotency.fingerprint(data), 201, dict(body)
+    )
+    return JsonResponse(body, status=201)
+
+
+@require_GET
+async def transaction_list(request):
+    user = await aauthenticate_token(request)
+    if user is None:
+        return error_response("Authentication credentials were not provided.", 401)
+
+    if user.is_admin_user:
+        queryset = Transaction.objects.all()
+    else:
+        principal = await aget_principal(user)
+        if not principal.is_seller:
+            return error_response("You do not have permission to perform this action.", 403)
+        queryset = Transaction.objects.filter(seller_id=principal.seller_id)
+
+    for field in ['transaction_type', 'status']:
+        if request.GET.get(field):
+            queryset = queryset.filter(**{field: request.GET[field]})
+
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return error_response("Invalid page.", 404)
+
+    count = await queryset.acount()
+    offset = (page - 1) * page_size
+    if offset and offset >= count:
+        return error_response("Invalid page.", 404)
+
+    rows = queryset.select_related('seller__user').order_by('-created_at')[offset:offset + page_size]
+    results = [TransactionSerializer(row).data async for row in rows]
+
+    def page_url(number):
+        query = request.GET.copy()
+        query['page'] = number
+        return request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+    return JsonResponse({
+        'count': count,
+        'next': page_url(page + 1) if offset + page_size < count else None,
+        'previous': page_url(page - 1) if page > 1 else None,
+        'results': results,
+    })
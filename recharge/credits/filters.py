@@ -0,0 +1,34 @@
+import django_filters
+from .models import CreditRequest, Transaction, SellerDailyStats
+
+
+class TransactionFilter(django_filters.FilterSet):
+
+    created_after = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = Transaction
+        fields = ['transaction_type', 'status']
+
+
+class SellerDailyStatsFilter(django_filters.FilterSet):
+
+    date_after = django_filters.DateFilter(field_name='date', lookup_expr='gte')
+    date_before = django_filters.DateFilter(field_name='date', lookup_expr='lte')
+
+    class Meta:
+        model = SellerDailyStats
+        fields = ['seller']
+
+
+class CreditRequestFilter(django_filters.FilterSet):
+
+    created_after = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lt')
+    min_amount = django_filters.NumberFilter(field_name='amount', lookup_expr='gte')
+    max_amount = django_filters.NumberFilter(field_name='amount', lookup_expr='lte')
+
+    class Meta:
+        model = CreditRequest
+        fields = ['seller']
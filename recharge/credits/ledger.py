@@ -0,0 +1,458 @@
+"""
+Ledger writes, optionally write-behind.
+
+``write_ledger`` stores the ``transactions`` rows of a sale or credit approval
+in the caller's transaction. With ``LEDGER['WRITE_BEHIND']`` it appends them
+to a local journal instead, and ``flush_journal`` (run by a background thread
+with ``AUTO_FLUSH``, or by the ``flush_ledger_journal`` command) bulk-inserts
+them later.
+
+The journal is a directory of daily segment files of JSON lines, opened with
+O_APPEND by every process, so each line lands whole. An entry carries the
+rows and a *witness*: the saved object the rows are about, with field values
+that only the committing transaction wrote (a sale's transaction_uuid and
+created_at, an approval's status and processed_at). Entries are written
+(and fsynced with ``FSYNC``) inside the transaction, after the seller row or
+shard is locked and before commit. Two things follow from that:
+
+- A committed sale always has its entry on disk.
+- Entries for one seller (or shard) appear in the file in the same order as
+  their balance chain, so flushing in file order keeps ``transactions`` ids
+  in chain order.
+
+A ``commit`` line is appended once the transaction commits. Entries are
+flushed strictly in file order. The flushed byte offset of each segment is
+stored in LedgerJournalOffset, in the same transaction as the inserted
+rows, so a flush that dies half way is replayed exactly. An entry without a
+commit line is resolved against the database: if its witness exists, the
+entry committed. If the witness is missing once the writing transaction has
+ended, the entry rolled back. The writer held its seller or shard row
+locked from before the entry until its end, so the flusher knows it has
+ended when it can lock that row (SKIP LOCKED), or, on SQLite, once it holds
+the database write lock itself. A writer process that is gone, or
+``ABANDON_AFTER`` seconds, also settle it. Otherwise the entry, and
+everything after it, waits. The ledger therefore only ever grows by a
+gap-free prefix of the journal, and crash recovery is a normal flush.
+
+While rows sit in the journal, history reads, daily stats rebuilds and
+reconciliation lag behind balances; reconcile_ledger flushes first.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from accounts.models import Seller, SellerCreditShard
+from .models import LedgerJournalOffset, Transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WRITE_BEHIND': False,
+    'JOURNAL_DIR': 'ledger-journal',
+    'FSYNC': True,
+    'AUTO_FLUSH': True,
+    'FLUSH_INTERVAL': 1.0,
+    'FLUSH_BATCH_SIZE': 1000,
+    'ABANDON_AFTER': 300,
+}
+
+ROW_FIELDS = (
+    'seller_id', 'amount', 'transaction_type', 'previous_credit', 'new_credit', 'credit_shard',
+    'description', 'status', 'created_at', 'completed_at', 'content_type_id', 'object_id',
+)
+
+SEGMENT_SUFFIX = '.journal'
+
+# witness fields only the committing transaction writes: a sale's, and an approved credit request's
+SALE_WITNESS_FIELDS = ('transaction_uuid', 'created_at')
+APPROVAL_WITNESS_FIELDS = ('status', 'processed_at')
+
+
+def ledger_setting(name):
+    return {**DEFAULTS, **getattr(settings, 'LEDGER', {})}[name]
+
+
+def _default(value):
+    # DjangoJSONEncoder drops microseconds, which the witness needs
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _to_python(model, name, value):
+    return None if value is None else model._meta.get_field(name).to_python(value)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Entry:
+    __slots__ = ('id', 'pid', 'at', 'witness', 'rows')
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.pid = record['pid']
+        self.at = record['at']
+        self.witness = record['witness']
+        self.rows = record['rows']
+
+    def transactions(self):
+        return [
+            Transaction(**{name: _to_python(Transaction, name, row.get(name)) for name in ROW_FIELDS})
+            for row in self.rows
+        ]
+
+
+class LedgerJournal:
+
+    def __init__(self, directory, fsync=True):
+        self.directory = Path(directory)
+        self.fsync = fsync
+        self._segment = None
+        self._fd = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def segment_name(day):
+        return f"{day:%Y%m%d}{SEGMENT_SUFFIX}"
+
+    def segments(self):
+        if not self.directory.is_dir():
+            return []
+        return sorted(path for path in self.directory.iterdir() if path.name.endswith(SEGMENT_SUFFIX))
+
+    def _file(self):
+        name = self.segment_name(datetime.now(dt_timezone.utc))
+        with self._lock:
+            if name != self._segment:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.directory / name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+                if self.fsync:
+                    # make the new segment's directory entry durable too
+                    directory = os.open(self.directory, os.O_RDONLY)
+                    try:
+                        os.fsync(directory)
+                    finally:
+                        os.close(directory)
+                if self._fd is not None:
+                    os.close(self._fd)
+                self._segment, self._fd = name, fd
+            return self._fd
+
+    def append(self, record, sync=False):
+        # the leading newline fences off a line torn by a crash mid-write
+        line = ('\n' + json.dumps(record, default=_default, separators=(',', ':')) + '\n').encode()
+        fd = self._file()
+        if os.write(fd, line) != len(line):
+            raise OSError(f"short write to ledger journal {self.directory}")
+        if sync and self.fsync:
+            os.fsync(fd)
+
+    def append_entry(self, rows, witness, fields):
+        entry_id = uuid4().hex
+        self.append({
+            'type': 'entry',
+            'id': entry_id,
+            'pid': os.getpid(),
+            'at': time.time(),
+            'witness': [
+                witness._meta.label_lower, witness.pk, {name: getattr(witness, name) for name in fields}
+            ],
+            'rows': [{name: getattr(row, name) for name in ROW_FIELDS} for row in rows],
+        }, sync=True)
+        return entry_id
+
+    def mark(self, entry_id, outcome):
+        try:
+            self.append({'type': outcome, 'id': entry_id})
+        except OSError:
+            # the flusher falls back to the witness
+            logger.exception("Could not mark ledger journal entry %s as %s", entry_id, outcome)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._segment = self._fd = None
+
+    def read(self, path, offset):
+        """``(lines, end)`` from ``offset``: ``(end offset, record or None)`` per complete line."""
+        with open(path, 'rb') as segment:
+            segment.seek(offset)
+            data = segment.read()
+        lines = []
+        position = offset
+        for raw in data.split(b'\n')[:-1]:
+            position += len(raw) + 1
+            record = None
+            if raw.strip():
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    logger.warning("Skipping torn ledger journal line in %s before offset %d", path, position)
+            lines.append((position, record))
+        return lines, position
+
+
+def _witnessed(entries):
+    """Ids of the entries whose witness is in the database, one query per model."""
+    by_model = {}
+    for entry in entries:
+        by_model.setdefault(entry.witness[0], []).append(entry)
+
+    found = set()
+    for label, model_entries in by_model.items():
+        model = apps.get_model(label)
+        fields = list(model_entries[0].witness[2])
+        stored = {
+            row[0]: row[1:]
+            for row in model.objects.filter(pk__in={entry.witness[1] for entry in model_entries})
+            .values_list('pk', *fields)
+        }
+        for entry in model_entries:
+            values = tuple(_to_python(model, name, entry.witness[2][name]) for name in fields)
+            if stored.get(model._meta.pk.to_python(entry.witness[1])) == values:
+                found.add(entry.id)
+    return found
+
+
+def _writer_finished(entry):
+    """Whether the transaction that wrote ``entry`` has ended; call inside a transaction."""
+    if connection.vendor == 'sqlite':
+        # _lock_out_writers already holds the write lock every writer transaction takes
+        return True
+    row = entry.rows[0]
+    if row['credit_shard'] is None:
+        locked = Seller.objects.filter(id=row['seller_id'])
+    else:
+        locked = SellerCreditShard.objects.filter(seller_id=row['seller_id'], index=row['credit_shard'])
+    if locked.select_for_update(skip_locked=True).values_list('pk', flat=True):
+        return True
+    # locked by a transaction, or deleted since
+    return not locked.exists()
+
+
+def _lock_out_writers():
+    if connection.vendor == 'sqlite':
+        # any write takes SQLite's database-wide write lock, even one that matches no row
+        table = connection.ops.quote_name(LedgerJournalOffset._meta.db_table)
+        pk = connection.ops.quote_name(LedgerJournalOffset._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {table} SET {pk} = {pk} WHERE 1 = 0")
+
+
+def _resolve(lines, abandon_after):
+    """``{entry id: 'commit' | 'abort'}`` for every entry in ``lines`` whose outcome is known."""
+    outcomes = {}
+    entries = []
+    for _, record in lines:
+        if record is None:
+            continue
+        if record['type'] == 'entry':
+            entries.append(Entry(record))
+        else:
+            outcomes[record['id']] = record['type']
+
+    pending = [entry for entry in entries if entry.id not in outcomes]
+    now = time.time()
+    # liveness first: a writer that is gone can no longer commit after the witness query
+    gone = {entry.id for entry in pending if now - entry.at > abandon_after or not _pid_alive(entry.pid)}
+    witnessed = _witnessed(pending)
+    undecided = []
+    for entry in pending:
+        if entry.id in witnessed:
+            outcomes[entry.id] = 'commit'
+        elif entry.id in gone:
+            outcomes[entry.id] = 'abort'
+        else:
+            undecided.append(entry)
+
+    if undecided:
+        with transaction.atomic():
+            _lock_out_writers()
+            # the writers are checked first, so the witness query sees what they committed
+            finished = [entry for entry in undecided if _writer_finished(entry)]
+            witnessed = _witnessed(finished)
+        for entry in finished:
+            outcomes[entry.id] = 'commit' if entry.id in witnessed else 'abort'
+    return outcomes
+
+
+def _flush_segment(journal, path, batch_size, abandon_after):
+    """Flushes one segment as far as it is resolved; returns ``(rows inserted, fully flushed)``."""
+    LedgerJournalOffset.objects.bulk_create([LedgerJournalOffset(segment=path.name)], ignore_conflicts=True)
+    offset = LedgerJournalOffset.objects.filter(segment=path.name).values_list('offset', flat=True).get()
+    lines, end = journal.read(path, offset)
+    outcomes = _resolve(lines, abandon_after)
+
+    inserted = 0
+    position = 0
+    while position < len(lines):
+        rows = []
+        new_offset = offset
+        blocked = False
+        while position < len(lines) and len(rows) < batch_size:
+            line_end, record = lines[position]
+            if record is not None and record['type'] == 'entry':
+                outcome = outcomes.get(record['id'])
+                if outcome is None:
+                    blocked = True
+                    break
+                if outcome == 'commit':
+                    rows.extend(Entry(record).transactions())
+            new_offset = line_end
+            position += 1
+
+        if new_offset != offset:
+            with transaction.atomic():
+                # compare-and-set first: it takes the write lock before anything is read
+                claimed = LedgerJournalOffset.objects.filter(segment=path.name, offset=offset).update(
+                    offset=new_offset, updated_at=timezone.now()
+                )
+                if not claimed:
+                    # another flusher got here first; the next pass starts where it stopped
+                    return inserted, False
+                Transaction.objects.bulk_create(rows, batch_size=batch_size)
+            inserted += len(rows)
+            offset = new_offset
+        if blocked:
+            return inserted, False
+
+    return inserted, offset == end
+
+
+def flush_journal(journal=None, batch_size=None, abandon_after=None):
+    """
+    Moves resolved journal entries into ``transactions``, oldest segment first.
+
+    Returns the number of ledger rows inserted. Segments older than yesterday
+    that are completely flushed are deleted.
+    """
+    journal = journal or get_journal()
+    batch_size = batch_size or ledger_setting('FLUSH_BATCH_SIZE')
+    abandon_after = ledger_setting('ABANDON_AFTER') if abandon_after is None else abandon_after
+    # writers may still be finishing a line in yesterday's segment just after midnight
+    sealed_before = journal.segment_name(datetime.now(dt_timezone.utc) - timedelta(days=1))
+
+    inserted = 0
+    for path in journal.segments():
+        count, flushed = _flush_segment(journal, path, batch_size, abandon_after)
+        inserted += count
+        if not flushed:
+            # later segments can hold later links of the same chains
+            break
+        if path.name < sealed_before:
+            path.unlink()
+            LedgerJournalOffset.objects.filter(segment=path.name).delete()
+    return inserted
+
+
+def journal_backlog(journal=None):
+    """Bytes of journal not yet flushed, over all segments."""
+    journal = journal or get_journal()
+    offsets = dict(LedgerJournalOffset.objects.values_list('segment', 'offset'))
+    return sum(max(0, path.stat().st_size - offsets.get(path.name, 0)) for path in journal.segments())
+
+
+class LedgerFlusher(threading.Thread):
+
+    def __init__(self, journal, interval):
+        super().__init__(name='ledger-flusher', daemon=True)
+        self.journal = journal
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                flush_journal(self.journal)
+            except DatabaseError as e:
+                # lock contention with the request threads; the offset makes the retry safe
+                logger.warning("Ledger journal flush failed (%s); retrying in %ss", e, self.interval)
+            except Exception:
+                logger.exception("Ledger journal flush failed; retrying in %ss", self.interval)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_journal = None
+_flusher = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                directory = Path(ledger_setting('JOURNAL_DIR'))
+                if not directory.is_absolute():
+                    directory = Path(settings.BASE_DIR) / directory
+                _journal = LedgerJournal(directory, fsync=ledger_setting('FSYNC'))
+    return _journal
+
+
+def _ensure_flusher(journal):
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        with _journal_lock:
+            if _flusher is None or not _flusher.is_alive():
+                _flusher = LedgerFlusher(journal, ledger_setting('FLUSH_INTERVAL'))
+                _flusher.start()
+
+
+def _reset(setting, **kwargs):
+    global _journal, _flusher
+    if setting == 'LEDGER':
+        with _journal_lock:
+            if _flusher is not None:
+                _flusher.stop()
+            if _journal is not None:
+                _journal.close()
+            _journal = _flusher = None
+
+
+setting_changed.connect(_reset, dispatch_uid='credits.ledger')
+
+
+def write_ledger(rows, witness, fields):
+    """
+    Stores ledger ``rows`` (unsaved Transactions) inside the caller's transaction.
+
+    ``witness`` is the saved object the rows belong to and ``fields`` the
+    witness fields only this transaction wrote. In write-behind mode the rows
+    are journaled and get their ids when flushed.
+    """
+    if not ledger_setting('WRITE_BEHIND'):
+        Transaction.objects.bulk_create(rows)
+        return
+
+    journal = get_journal()
+    entry_id = journal.append_entry(rows, witness, fields)
+    transaction.on_commit(lambda: journal.mark(entry_id, 'commit'))
+    if ledger_setting('AUTO_FLUSH'):
+        _ensure_flusher(journal)
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from credits.ledger import flush_journal, journal_backlog, ledger_setting
+
+
+class Command(BaseCommand):
+    help = 'Moves journaled write-behind ledger rows into the transactions table; replays after a crash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep flushing every LEDGER FLUSH_INTERVAL seconds')
+        parser.add_argument('--abandon-after', type=float,
+                            help='Treat unresolved entries older than this many seconds as rolled back')
+
+    def handle(self, *args, **options):
+        while True:
+            inserted = flush_journal(abandon_after=options['abandon_after'])
+            if not options['loop']:
+                break
+            if inserted:
+                self.stdout.write(f'{inserted} ledger rows flushed, {journal_backlog()} journal bytes pending')
+            time.sleep(ledger_setting('FLUSH_INTERVAL'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{inserted} ledger rows flushed, {journal_backlog()} journal bytes still pending'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from credits.stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-seller daily sales aggregates from the transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seller-id', type=int, help='Only rebuild this seller')
+        parser.add_argument('--since', type=parse_date, help='Only rebuild days on or after this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        written = rebuild_daily_stats(seller_id=options['seller_id'], since=options['since'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} seller-day rows'))
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from credits.reconcile import reconcile_ledger
+from recharge.workers import default_workers
+
+
+class Command(BaseCommand):
+    help = 'Verifies seller balances against the transaction ledger and writes a JSON discrepancy report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seller-id', type=int, action='append', dest='seller_ids', help='Seller to reconcile (repeatable)')
+        parser.add_argument('--workers', type=int, default=default_workers(), help='Worker processes')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Sellers per worker task')
+        parser.add_argument('--full', action='store_true', help='Ignore checkpoints and rescan the whole ledger')
+        parser.add_argument('--output', default='-', help='Report path, - for stdout')
+
+    def handle(self, *args, **options):
+        report = reconcile_ledger(
+            seller_ids=options['seller_ids'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            full=options['full'],
+        )
+
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, indent=2))
+            summary = self.stderr
+        else:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, cls=DjangoJSONEncoder, indent=2)
+            summary = self.stdout
+
+        if not report['clean']:
+            raise CommandError(
+                f'{len(report["discrepancies"])} discrepancies across {report["sellers"]} sellers'
+            )
+        summary.write(self.style.SUCCESS(
+            f'{report["sellers"]} sellers reconciled, {report["transactions_scanned"]} ledger rows scanned'
+        ))
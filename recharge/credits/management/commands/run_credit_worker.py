@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from credits.worker import run_worker_process
+from recharge.workers import map_in_processes
+
+
+class Command(BaseCommand):
+    help = 'Applies queued credit request decisions; runs until stopped unless --once is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to run')
+        parser.add_argument('--batch-size', type=int, help='Tasks claimed at a time (CREDIT_WORKER BATCH_SIZE)')
+        parser.add_argument('--lease', type=float,
+                            help='Seconds a claimed batch is held before other workers retry it (CREDIT_WORKER LEASE)')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        kwargs = {'batch_size': options['batch_size'], 'lease': options['lease'], 'once': options['once']}
+        processes = max(1, options['processes'])
+        finished = sum(map_in_processes(run_worker_process, [kwargs] * processes, processes))
+
+        self.stdout.write(self.style.SUCCESS(f'{finished} credit request tasks processed'))
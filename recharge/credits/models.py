@@ -56,6 +56,7 @@ class Transaction(models.Model):
     TRANSACTION_TYPE_CHOICES = [
         ('credit_increase', 'Credit Increase'),
         ('charge_sale', 'Charge Sale'),
+        ('credit_transfer', 'Credit Transfer'),
     ]
 
     STATUS_CHOICES = [
@@ -96,6 +97,11 @@ class Transaction(models.Model):
         max_digits=12,
         decimal_places=0
     )
+    # set for sharded sellers: previous_credit/new_credit are that shard's balance
+    credit_shard = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True
+    )
     description = models.TextField(
         blank=True
     )
@@ -119,7 +125,183 @@ class Transaction(models.Model):
             models.Index(fields=['transaction_type']),
             models.Index(fields=['status']),
             models.Index(fields=['content_type', 'object_id']),
+            models.Index(fields=['seller', 'created_at', 'id']),
+            models.Index(fields=['created_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.seller} - {self.amount} - {self.get_transaction_type_display()}"
+
+
+class SellerDailyStats(models.Model):
+
+    seller = models.ForeignKey(
+        Seller,
+        on_delete=models.CASCADE,
+        related_name="daily_stats"
+    )
+    date = models.DateField()
+    # the credit shard the counted writes went to (0 for unsharded sellers), so
+    # concurrent sales on different shards do not queue on one stats row
+    shard = models.PositiveSmallIntegerField(
+        default=0
+    )
+    charge_count = models.PositiveIntegerField(
+        default=0
+    )
+    charge_amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=0,
+        default=0
+    )
+    credit_increase_count = models.PositiveIntegerField(
+        default=0
+    )
+    credit_increase_amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=0,
+        default=0
+    )
+    # charge attempts refused for insufficient credit; these never reach the ledger
+    failed_charge_count = models.PositiveIntegerField(
+        default=0
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        db_table = "seller_daily_stats"
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'date', 'shard'], name='unique_seller_daily_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id} - {self.date}"
+
+
+class LedgerCheckpoint(models.Model):
+
+    seller = models.OneToOneField(
+        Seller,
+        on_delete=models.CASCADE,
+        related_name="ledger_checkpoint"
+    )
+    # last ledger row covered by a clean reconciliation
+    last_transaction_id = models.BigIntegerField(
+        default=0
+    )
+    # running sum of successful ledger amounts up to last_transaction_id
+    ledger_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=0,
+        default=0
+    )
+    # tip of the unsharded previous_credit/new_credit chain
+    new_credit = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        blank=True,
+        null=True
+    )
+    # tips of the per-shard chains, {"<shard index>": "<new_credit>"}
+    shard_credits = models.JSONField(
+        default=dict,
+        blank=True
+    )
+    verified_at = models.DateTimeField(
+        default=timezone.now
+    )
+
+    class Meta:
+        db_table = "ledger_checkpoints"
+
+    def __str__(self):
+        return f"{self.seller_id} - {self.last_transaction_id}"
+
+
+class LedgerJournalOffset(models.Model):
+
+    # journal segment file name, see credits/ledger.py
+    segment = models.CharField(
+        max_length=255,
+        unique=True
+    )
+    # bytes of the segment already moved into ``transactions``
+    offset = models.BigIntegerField(
+        default=0
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        db_table = "ledger_journal_offsets"
+
+    def __str__(self):
+        return f"{self.segment} - {self.offset}"
+
+
+class CreditRequestTask(models.Model):
+
+    ACTION_CHOICES = [
+        ('approve', 'Approve'),
+        ('reject', 'Reject'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    # one task per credit request (and so per reference_id): enqueueing twice is a no-op
+    credit_request = models.OneToOneField(
+        CreditRequest,
+        on_delete=models.CASCADE,
+        related_name="task"
+    )
+    action = models.CharField(
+        max_length=10,
+        choices=ACTION_CHOICES
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='queued'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0
+    )
+    # "<worker>/<token>" of the current claim, see credits/worker.py
+    claim = models.CharField(
+        max_length=100,
+        blank=True
+    )
+    lease_expires_at = models.DateTimeField(
+        blank=True,
+        null=True
+    )
+    detail = models.TextField(
+        blank=True
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now
+    )
+    processed_at = models.DateTimeField(
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        db_table = "credit_request_tasks"
+        indexes = [
+            models.Index(fields=['status', 'id']),
         ]
 
     def __str__(self):
-        return f"{self.seller} - {self.amount} - {self.get_transaction_type_display()}"
\ No newline at end of file
+        return f"{self.credit_request_id} - {self.action} - {self.get_status_display()}"
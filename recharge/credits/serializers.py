@@ -1,8 +1,11 @@
 from rest_framework import serializers
-from .models import CreditRequest, Transaction
+from accounts.principal import get_principal
+from .filters import CreditRequestFilter
+from .models import CreditRequest, CreditRequestTask, Transaction, SellerDailyStats
 from accounts.serializers import SellerSerializer
+from recharge.metrics import TimedSerializerMixin
 
-class CreditRequestSerializer(serializers.ModelSerializer):
+class CreditRequestSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     seller = SellerSerializer(read_only=True)
 
@@ -18,6 +21,8 @@ class CreditRequestSerializer(serializers.ModelSerializer):
             'processed_at'
         ]
         read_only_fields = ['status', 'processed_at']
+        # uniqueness is enforced by the database constraint when the request is saved
+        extra_kwargs = {'reference_id': {'validators': []}}
 
     def validate_amount(self, value):
 
@@ -30,14 +35,15 @@ class CreditRequestSerializer(serializers.ModelSerializer):
         if not request or not hasattr(request, 'user'):
             raise serializers.ValidationError("Must be authenticated to create a credit request")
 
-        if not hasattr(request.user, 'seller_profile'):
+        principal = get_principal(request)
+        if not principal.is_seller:
             raise serializers.ValidationError("Only sellers can request credit increases")
 
-        validated_data['seller'] = request.user.seller_profile
+        validated_data['seller_id'] = principal.seller_id
         return super().create(validated_data)
 
 
-class AdminCreditRequestSerializer(serializers.ModelSerializer):
+class AdminCreditRequestSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     seller = SellerSerializer(read_only=True)
 
     class Meta:
@@ -65,7 +71,7 @@ class AdminCreditRequestSerializer(serializers.ModelSerializer):
         return value
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     seller = SellerSerializer(read_only=True)
 
     class Meta:
@@ -90,4 +96,61 @@ class TransactionSerializer(serializers.ModelSerializer):
     def validate_amount(self, value):
         if value == 0:
             raise serializers.ValidationError("Transaction amount cannot be zero")
-        return value
\ No newline at end of file
+        return value
+
+
+class SellerDailyStatsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # renders the folded rows of fold_daily_stats
+    seller = serializers.IntegerField(source='seller_id', read_only=True)
+
+    class Meta:
+        model = SellerDailyStats
+        fields = [
+            'seller',
+            'date',
+            'charge_count',
+            'charge_amount',
+            'credit_increase_count',
+            'credit_increase_amount',
+            'failed_charge_count'
+        ]
+        read_only_fields = fields
+
+
+class ProcessBatchSerializer(TimedSerializerMixin, serializers.Serializer):
+    action = serializers.ChoiceField(choices=['approve', 'reject'])
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    filter = serializers.DictField(required=False)
+
+    def validate_filter(self, value):
+        # django-filter ignores keys it does not know, which would widen the batch to every pending request
+        if not value:
+            raise serializers.ValidationError("A filter needs at least one condition.")
+        unknown = set(value) - set(CreditRequestFilter.base_filters)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown filter fields: {', '.join(sorted(unknown))}.")
+        return value
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Provide either a list of ids or a filter.")
+        return attrs
+
+
+class CreditRequestTaskSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    reference_id = serializers.CharField(source='credit_request.reference_id', read_only=True)
+
+    class Meta:
+        model = CreditRequestTask
+        fields = [
+            'id',
+            'credit_request',
+            'reference_id',
+            'action',
+            'status',
+            'attempts',
+            'detail',
+            'created_at',
+            'processed_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,107 @@
+"""
+Incrementally maintained per-seller daily aggregates (SellerDailyStats).
+
+Writers call ``record_daily_stats`` inside the same atomic block as the
+ledger write it summarizes, so the aggregates commit or roll back with it;
+refused charges never reach the ledger and are counted in a transaction of
+their own. Each seller-day has one row per credit shard the writes went to,
+and ``fold_daily_stats`` sums them. ``rebuild_daily_stats`` recomputes the
+ledger-derived columns from ``transactions``.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import SellerDailyStats, Transaction
+
+LEDGER_COUNTERS = ('charge_count', 'charge_amount', 'credit_increase_count', 'credit_increase_amount')
+COUNTERS = LEDGER_COUNTERS + ('failed_charge_count',)
+
+
+def record_daily_stats(seller_id, day=None, shard=None, **increments):
+    unknown = set(increments) - set(COUNTERS)
+    if unknown:
+        raise TypeError(f"Unknown daily stats counters: {', '.join(sorted(unknown))}")
+
+    increments = {field: value for field, value in increments.items() if value}
+    if not increments:
+        return
+    day = day or timezone.localdate()
+    shard = shard or 0
+
+    rows = SellerDailyStats.objects.filter(seller_id=seller_id, date=day, shard=shard)
+    updates = {field: F(field) + value for field, value in increments.items()}
+    if rows.update(updated_at=timezone.now(), **updates):
+        return
+
+    try:
+        with transaction.atomic():
+            SellerDailyStats.objects.create(seller_id=seller_id, date=day, shard=shard, **increments)
+    except IntegrityError:
+        # another transaction created today's row first
+        rows.update(updated_at=timezone.now(), **updates)
+
+
+def fold_daily_stats(rows):
+    """One dict per (seller, date) of ``rows``, with the counters summed over shards."""
+    return rows.values('seller_id', 'date').annotate(**{counter: Sum(counter) for counter in COUNTERS})
+
+
+def rebuild_daily_stats(seller_id=None, since=None, batch_size=1000):
+    """
+    Recompute the ledger-derived counters from successful transactions.
+
+    ``failed_charge_count`` is not in the ledger and is left as recorded.
+    Returns the number of seller-days written.
+    """
+    ledger = Transaction.objects.filter(status='successful', transaction_type__in=['charge_sale', 'credit_increase'])
+    stats = SellerDailyStats.objects.all()
+    if seller_id is not None:
+        ledger = ledger.filter(seller_id=seller_id)
+        stats = stats.filter(seller_id=seller_id)
+    if since is not None:
+        ledger = ledger.filter(created_at__date__gte=since)
+        stats = stats.filter(date__gte=since)
+
+    is_charge = Q(transaction_type='charge_sale')
+    is_credit = Q(transaction_type='credit_increase')
+    computed = {
+        (row['seller_id'], row['day'], row['shard']): row
+        for row in ledger.annotate(
+            day=TruncDate('created_at'), shard=Coalesce('credit_shard', Value(0))
+        ).values('seller_id', 'day', 'shard').annotate(
+            charge_count=Count('id', filter=is_charge),
+            charge_amount=Sum('amount', filter=is_charge),
+            credit_increase_count=Count('id', filter=is_credit),
+            credit_increase_amount=Sum('amount', filter=is_credit),
+        ).order_by()
+    }
+
+    with transaction.atomic():
+        existing = {(row.seller_id, row.date, row.shard): row for row in stats.select_for_update()}
+        to_create = []
+        for key, row in existing.items():
+            _apply(row, computed.pop(key, None))
+        for (seller, day, shard), values in computed.items():
+            row = SellerDailyStats(seller_id=seller, date=day, shard=shard)
+            _apply(row, values)
+            to_create.append(row)
+
+        SellerDailyStats.objects.bulk_update(
+            list(existing.values()), list(LEDGER_COUNTERS) + ['updated_at'], batch_size=batch_size
+        )
+        SellerDailyStats.objects.bulk_create(to_create, batch_size=batch_size)
+
+    return len(existing) + len(to_create)
+
+
+def _apply(row, values):
+    values = values or {}
+    row.charge_count = values.get('charge_count', 0)
+    row.charge_amount = -(values.get('charge_amount') or Decimal('0'))
+    row.credit_increase_count = values.get('credit_increase_count', 0)
+    row.credit_increase_amount = values.get('credit_increase_amount') or Decimal('0')
+    row.updated_at = timezone.now()
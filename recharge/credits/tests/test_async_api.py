@@ -0,0 +1,82 @@
+import uuid
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import get_token_cache
+from accounts.models import Seller
+from charge.models import PhoneNumber
+from credits.models import CreditRequest
+
+User = get_user_model()
+
+
+class AsyncApiTestCase(TransactionTestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='async_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+        token = Token.objects.create(user=user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+
+    async def test_charge_create(self):
+        data = {'transaction_uuid': str(uuid.uuid4()), 'phone_number_id': self.phone.id, 'amount': 30}
+
+        response = await self.async_client.post(
+            '/api/charge/async/charges/', data, content_type='application/json', headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['phone_final_balance'], '30')
+        await self.seller.arefresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('70'))
+
+        response = await self.async_client.post(
+            '/api/charge/async/charges/',
+            {**data, 'transaction_uuid': str(uuid.uuid4()), 'amount': 71},
+            content_type='application/json',
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_credit_request_create_and_transaction_list(self):
+        data = {'reference_id': 'CR-async', 'amount': 500}
+
+        response = await self.async_client.post(
+            '/api/credits/async/credit-requests/', data, content_type='application/json', headers=self.headers
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(await CreditRequest.objects.filter(seller=self.seller).acount(), 1)
+
+        await self.async_client.post(
+            '/api/charge/async/charges/',
+            {'transaction_uuid': str(uuid.uuid4()), 'phone_number_id': self.phone.id, 'amount': 10},
+            content_type='application/json',
+            headers=self.headers
+        )
+        response = await self.async_client.get(
+            '/api/credits/async/transactions/', {'transaction_type': 'charge_sale'}, headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(response.json()['results'][0]['amount'], '-10')
+
+    async def test_requires_token(self):
+        response = await self.async_client.get('/api/credits/async/transactions/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_warm_token_cache_skips_auth_queries(self):
+        get_token_cache().clear()
+        get = async_to_sync(self.async_client.get)
+        get('/api/credits/async/transactions/', headers=self.headers)
+
+        # the count and the page
+        with self.assertNumQueries(2):
+            response = get('/api/credits/async/transactions/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,130 @@
+from decimal import Decimal
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from accounts.shards import enable_credit_shards
+from credits.models import CreditRequest, SellerDailyStats, Transaction
+from credits.reconcile import reconcile_seller
+
+User = get_user_model()
+
+
+class ProcessBatchTestCase(TestCase):
+    url = '/api/credits/credit-requests/process-batch/'
+
+    def setUp(self):
+        admin = User.objects.create_user(username='batch_admin', password='pw', is_admin_user=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+        self.sellers = []
+        for index in range(2):
+            user = User.objects.create_user(username=f'batch_seller_{index}', password='pw', is_seller=True)
+            seller = Seller.objects.create(user=user, credit=Decimal('100'))
+            Transaction.objects.create(
+                seller=seller, amount=Decimal('100'), transaction_type='credit_increase',
+                previous_credit=Decimal('0'), new_credit=Decimal('100'), status='successful'
+            )
+            self.sellers.append(seller)
+
+    def request_credit(self, seller, reference_id, amount, status='pending'):
+        return CreditRequest.objects.create(
+            reference_id=reference_id, seller=seller, amount=Decimal(amount), status=status
+        )
+
+    def test_approves_with_one_chained_ledger_per_seller(self):
+        first, second = self.sellers
+        a = self.request_credit(first, 'B-1', '10')
+        b = self.request_credit(second, 'B-2', '20')
+        c = self.request_credit(first, 'B-3', '30')
+        done = self.request_credit(first, 'B-4', '40', status='rejected')
+
+        response = self.client.post(
+            self.url, {'action': 'approve', 'ids': [c.id, a.id, b.id, done.id, 999999]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['processed'], response.data['failed']), (3, 2))
+        self.assertEqual(
+            [(result['id'], result['status']) for result in response.data['results']],
+            [(c.id, 'approved'), (a.id, 'approved'), (b.id, 'approved'), (done.id, 'failed'), (999999, 'failed')]
+        )
+        self.assertEqual(response.data['results'][3]['detail'], "This request has already been rejected.")
+        self.assertEqual(response.data['results'][4]['detail'], "Credit request not found.")
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.credit, second.credit), (Decimal('140'), Decimal('120')))
+        self.assertEqual(list(
+            Transaction.objects.filter(seller=first, object_id__isnull=False).order_by('id')
+            .values_list('object_id', 'previous_credit', 'new_credit')
+        ), [
+            (a.id, Decimal('100'), Decimal('110')),
+            (c.id, Decimal('110'), Decimal('140')),
+        ])
+        self.assertEqual(CreditRequest.objects.filter(status='approved').count(), 3)
+        self.assertEqual(SellerDailyStats.objects.get(seller=first).credit_increase_count, 2)
+        for seller in self.sellers:
+            self.assertEqual(reconcile_seller(seller.id)['discrepancies'], [])
+
+    def test_sharded_seller_gets_one_shard_update(self):
+        seller = self.sellers[0]
+        enable_credit_shards(seller.id, 4)
+        requests = [self.request_credit(seller, f'S-{index}', '5') for index in range(3)]
+
+        response = self.client.post(
+            self.url, {'action': 'approve', 'ids': [request.id for request in requests]}, format='json'
+        )
+
+        self.assertEqual(response.data['processed'], 3)
+        shards = set(Transaction.objects.filter(object_id__isnull=False).values_list('credit_shard', flat=True))
+        self.assertEqual(len(shards), 1)
+        self.assertEqual(reconcile_seller(seller.id)['discrepancies'], [])
+
+    def test_rejects_by_filter(self):
+        first, second = self.sellers
+        self.request_credit(first, 'F-1', '10')
+        self.request_credit(first, 'F-2', '10')
+        other = self.request_credit(second, 'F-3', '10')
+
+        response = self.client.post(
+            self.url, {'action': 'reject', 'filter': {'seller': first.id}}, format='json'
+        )
+
+        self.assertEqual(response.data['processed'], 2)
+        self.assertEqual(CreditRequest.objects.filter(seller=first, status='rejected').count(), 2)
+        other.refresh_from_db()
+        self.assertEqual(other.status, 'pending')
+        first.refresh_from_db()
+        self.assertEqual(first.credit, Decimal('100'))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_validation_and_permissions(self):
+        self.assertEqual(self.client.post(self.url, {'action': 'approve'}, format='json').status_code, 400)
+        self.assertEqual(
+            self.client.post(self.url, {'action': 'maybe', 'ids': [1]}, format='json').status_code, 400
+        )
+        self.assertEqual(
+            self.client.post(self.url, {'action': 'approve', 'filter': {'created_after': 'soon'}}, format='json')
+            .status_code, 400
+        )
+
+        seller_client = APIClient()
+        seller_client.force_authenticate(user=self.sellers[0].user)
+        self.assertEqual(
+            seller_client.post(self.url, {'action': 'approve', 'ids': [1]}, format='json').status_code, 403
+        )
+
+    def test_empty_or_unknown_filters_are_refused(self):
+        pending = self.request_credit(self.sellers[0], 'U-1', '10')
+
+        for batch_filter in ({}, {'seller_id': self.sellers[1].id}, {'seler': self.sellers[1].id}):
+            response = self.client.post(self.url, {'action': 'approve', 'filter': batch_filter}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('filter', response.data)
+
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'pending')
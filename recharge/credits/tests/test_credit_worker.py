@@ -0,0 +1,98 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from credits.models import CreditRequest, CreditRequestTask, Transaction
+from credits.reconcile import reconcile_seller
+from credits.worker import claim_tasks, enqueue_credit_requests, run_worker
+
+User = get_user_model()
+
+
+class CreditWorkerTestCase(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_user(username='worker_admin', password='pw', is_admin_user=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+        user = User.objects.create_user(username='worker_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        Transaction.objects.create(
+            seller=self.seller, amount=Decimal('100'), transaction_type='credit_increase',
+            previous_credit=Decimal('0'), new_credit=Decimal('100'), status='successful'
+        )
+
+    def request_credit(self, reference_id, amount='10'):
+        return CreditRequest.objects.create(reference_id=reference_id, seller=self.seller, amount=Decimal(amount))
+
+    def enqueue(self, credit_request, action='approve'):
+        return self.client.post(
+            f'/api/credits/credit-requests/{credit_request.id}/enqueue/', {'action': action}, format='json'
+        )
+
+    def test_enqueue_returns_before_the_worker_applies_it(self):
+        credit_request = self.request_credit('Q-1')
+
+        response = self.enqueue(credit_request)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['task']['status'], 'queued')
+        self.assertEqual(response.data['task']['reference_id'], 'Q-1')
+        self.assertEqual(self.enqueue(credit_request).status_code, 202)
+        self.assertEqual(self.enqueue(credit_request, 'reject').status_code, 409)
+        credit_request.refresh_from_db()
+        self.assertEqual(credit_request.status, 'pending')
+
+        out = StringIO()
+        call_command('run_credit_worker', '--once', stdout=out)
+        self.assertIn('1 credit request tasks processed', out.getvalue())
+
+        credit_request.refresh_from_db()
+        self.seller.refresh_from_db()
+        self.assertEqual(credit_request.status, 'approved')
+        self.assertEqual(self.seller.credit, Decimal('110'))
+        self.assertEqual(CreditRequestTask.objects.get().status, 'done')
+        self.assertEqual(self.enqueue(credit_request).status_code, 400)
+
+    def test_redelivery_after_an_expired_lease_is_idempotent(self):
+        credit_request = self.request_credit('Q-2')
+        enqueue_credit_requests([credit_request], 'approve')
+        self.assertEqual(run_worker(once=True), 1)
+
+        # as if the worker's acknowledgement was lost and the lease ran out
+        CreditRequestTask.objects.update(status='processing', lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(run_worker(once=True), 1)
+
+        task = CreditRequestTask.objects.get()
+        self.assertEqual((task.status, task.attempts), ('done', 2))
+        self.assertEqual(Transaction.objects.filter(object_id=credit_request.id).count(), 1)
+        self.assertEqual(reconcile_seller(self.seller.id)['discrepancies'], [])
+
+    def test_claims_skip_leased_tasks(self):
+        tasks = enqueue_credit_requests([self.request_credit(f'Q-L{index}') for index in range(3)], 'reject')
+
+        first = claim_tasks('worker-a', batch_size=2)
+        second = claim_tasks('worker-b', batch_size=2)
+        self.assertEqual([task.id for task in first], [task.id for task in tasks[:2]])
+        self.assertEqual([task.id for task in second], [tasks[2].id])
+        self.assertEqual(claim_tasks('worker-c'), [])
+
+    def test_conflicting_decision_fails_the_task(self):
+        credit_request = self.request_credit('Q-3')
+        enqueue_credit_requests([credit_request], 'approve')
+        CreditRequest.objects.filter(id=credit_request.id).update(status='rejected')
+
+        run_worker(once=True)
+
+        task = CreditRequestTask.objects.get()
+        self.assertEqual(task.status, 'failed')
+        self.assertEqual(task.detail, "This request has already been rejected.")
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.credit, Decimal('100'))
@@ -0,0 +1,93 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from accounts.shards import enable_credit_shards
+from charge.models import PhoneNumber
+from charge.services import charge_phone, InsufficientCredit
+from credits.models import CreditRequest, SellerDailyStats
+
+User = get_user_model()
+
+
+class SellerDailyStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='stats_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=self.user, credit=Decimal('100'))
+        self.admin = User.objects.create_user(username='stats_admin', password='pw', is_admin_user=True)
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+        self.client = APIClient()
+
+    def charge_and_approve(self):
+        charge_phone(self.seller.id, self.phone.id, Decimal('30'), 'stats-1')
+        charge_phone(self.seller.id, self.phone.id, Decimal('20'), 'stats-2')
+        with self.assertRaises(InsufficientCredit):
+            charge_phone(self.seller.id, self.phone.id, Decimal('500'), 'stats-3')
+
+        credit_request = CreditRequest.objects.create(seller=self.seller, amount=Decimal('200'), reference_id='ref-1')
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(
+            f'/api/credits/credit-requests/{credit_request.id}/process/', {'action': 'approve'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_counters_follow_charges_and_approvals(self):
+        self.charge_and_approve()
+
+        stats = SellerDailyStats.objects.get(seller=self.seller)
+        self.assertEqual(stats.charge_count, 2)
+        self.assertEqual(stats.charge_amount, Decimal('50'))
+        self.assertEqual(stats.failed_charge_count, 1)
+        self.assertEqual(stats.credit_increase_count, 1)
+        self.assertEqual(stats.credit_increase_amount, Decimal('200'))
+
+    def test_rebuild_matches_incremental_counters(self):
+        self.charge_and_approve()
+        before = SellerDailyStats.objects.values().get(seller=self.seller)
+
+        SellerDailyStats.objects.update(charge_count=0, charge_amount=0, credit_increase_count=0)
+        call_command('rebuild_daily_stats', seller_id=self.seller.id, stdout=StringIO())
+
+        after = SellerDailyStats.objects.values().get(seller=self.seller)
+        before.pop('updated_at'), after.pop('updated_at')
+        self.assertEqual(after, before)
+
+    def test_summary_is_scoped_to_the_seller(self):
+        self.charge_and_approve()
+        other = Seller.objects.create(user=User.objects.create_user(username='other', password='pw', is_seller=True))
+        SellerDailyStats.objects.create(seller=other, date=SellerDailyStats.objects.get().date, charge_count=7)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/credits/daily-stats/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['charge_count'], 2)
+        self.assertEqual(response.data['failed_charge_count'], 1)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/credits/daily-stats/summary/')
+        self.assertEqual(response.data['charge_count'], 9)
+
+    def test_sharded_seller_counts_per_shard_and_lists_folded(self):
+        enable_credit_shards(self.seller.id, 4)
+        for i in range(8):
+            charge_phone(self.seller.id, self.phone.id, Decimal('5'), f'shard-stats-{i}', credit_shards=4)
+
+        rows = SellerDailyStats.objects.filter(seller=self.seller)
+        self.assertEqual(sum(rows.values_list('charge_count', flat=True)), 8)
+        self.assertEqual(
+            set(rows.values_list('shard', flat=True)),
+            set(self.seller.transactions.values_list('credit_shard', flat=True))
+        )
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/credits/daily-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        day = response.data['results'][0]
+        self.assertEqual((day['seller'], day['charge_count'], day['charge_amount']), (self.seller.id, 8, '40'))
@@ -0,0 +1,57 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from credits.models import Transaction
+
+User = get_user_model()
+
+
+class TransactionExportTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='export_seller', password='pw', is_seller=True)
+        seller = Seller.objects.create(user=user)
+        self.now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(
+                seller=seller, amount=Decimal('10'), previous_credit=Decimal(i * 10), new_credit=Decimal(i * 10 + 10),
+                transaction_type='credit_increase' if i % 2 else 'charge_sale', status='successful',
+                created_at=self.now - timedelta(days=10 - i)
+            )
+            for i in range(10)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_streams_every_row_in_ledger_order(self):
+        response = self.client.get('/api/credits/transactions/export/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual([row['new_credit'] for row in rows], [str(i * 10 + 10) for i in range(10)])
+
+    def test_csv_with_filters_and_date_range(self):
+        response = self.client.get('/api/credits/transactions/export/', {
+            'format': 'csv',
+            'transaction_type': 'credit_increase',
+            'created_after': (self.now - timedelta(days=6)).isoformat(),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(self.read(response))))
+        self.assertEqual([row['new_credit'] for row in rows], ['60', '80', '100'])
+        self.assertIn('seller_id', rows[0])
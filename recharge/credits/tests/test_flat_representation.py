@@ -0,0 +1,39 @@
+import uuid
+from decimal import Decimal
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from charge.models import PhoneNumber
+from charge.services import charge_phone
+
+User = get_user_model()
+
+
+class FlatRepresentationTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='flat_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        phone = PhoneNumber.objects.create(number='09120000001')
+        for _ in range(3):
+            charge_phone(self.seller.id, phone.id, Decimal('5'), str(uuid.uuid4()))
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def test_expanded_flat_output_matches_serializer(self):
+        for url in ['/api/credits/transactions/', '/api/charge/charges/']:
+            regular = self.client.get(url).json()
+            flat = self.client.get(url, {'representation': 'flat', 'expand': 'seller,phone_number'}).json()
+            self.assertEqual(flat['results'], regular['results'])
+
+    def test_flat_output_collapses_relations_to_ids(self):
+        response = self.client.get('/api/charge/charges/', {'representation': 'flat'})
+
+        row = response.data['results'][0]
+        self.assertEqual(row['seller_id'], self.seller.id)
+        self.assertNotIn('seller', row)
+        self.assertIn('phone_number_id', row)
+        self.assertEqual(row['amount'], '5')
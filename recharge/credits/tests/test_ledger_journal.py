@@ -0,0 +1,120 @@
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from charge.models import PhoneNumber
+from charge.services import charge_phone
+from credits.ledger import flush_journal, get_journal, journal_backlog
+from credits.models import CreditRequest, LedgerJournalOffset, Transaction
+from credits.reconcile import reconcile_seller
+
+User = get_user_model()
+
+
+class WriteBehindLedgerTestCase(TestCase):
+
+    def setUp(self):
+        self.journal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.journal_dir.cleanup)
+        settings = override_settings(LEDGER={
+            'WRITE_BEHIND': True, 'JOURNAL_DIR': self.journal_dir.name, 'FSYNC': False, 'AUTO_FLUSH': False,
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        user = User.objects.create_user(username='journal_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        Transaction.objects.create(
+            seller=self.seller, amount=Decimal('100'), transaction_type='credit_increase',
+            previous_credit=Decimal('0'), new_credit=Decimal('100'), status='successful'
+        )
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+
+    def charge(self, amount, uuid):
+        with self.captureOnCommitCallbacks(execute=True):
+            return charge_phone(self.seller.id, self.phone.id, Decimal(amount), uuid)
+
+    def test_sales_are_journaled_then_flushed_once(self):
+        self.charge('10', 'wb-1')
+        self.charge('5', 'wb-2')
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertGreater(journal_backlog(), 0)
+
+        self.assertEqual(flush_journal(), 2)
+        self.assertEqual(flush_journal(), 0)
+        self.assertEqual(journal_backlog(), 0)
+
+        ledger = list(
+            Transaction.objects.filter(transaction_type='charge_sale').order_by('id')
+            .values_list('amount', 'previous_credit', 'new_credit')
+        )
+        self.assertEqual(ledger, [
+            (Decimal('-10'), Decimal('100'), Decimal('90')),
+            (Decimal('-5'), Decimal('90'), Decimal('85')),
+        ])
+        self.assertEqual(reconcile_seller(self.seller.id)['discrepancies'], [])
+
+    def test_recovery_uses_the_witness_when_the_commit_line_is_missing(self):
+        # committed, but the process died before appending the commit line
+        charge_phone(self.seller.id, self.phone.id, Decimal('10'), 'wb-3')
+
+        self.assertEqual(flush_journal(), 1)
+        self.assertTrue(Transaction.objects.filter(object_id=self.phone.charges.get().id).exists())
+
+    def test_rolled_back_entry_does_not_hold_the_flush(self):
+        try:
+            with transaction.atomic():
+                charge_phone(self.seller.id, self.phone.id, Decimal('10'), 'wb-4')
+                raise RuntimeError('rolled back after the sale')
+        except RuntimeError:
+            pass
+        self.charge('20', 'wb-5')
+
+        # the writer (this process) is alive and the entry is young, but its transaction has ended
+        self.assertEqual(flush_journal(), 1)
+        self.assertEqual(journal_backlog(), 0)
+        self.assertEqual(list(
+            Transaction.objects.filter(transaction_type='charge_sale').values_list('previous_credit', 'new_credit')
+        ), [
+            (Decimal('100'), Decimal('80')),
+        ])
+        self.assertEqual(reconcile_seller(self.seller.id)['discrepancies'], [])
+
+    def test_torn_lines_are_skipped(self):
+        self.charge('10', 'wb-6')
+        segment = get_journal().segments()[0]
+        with open(segment, 'ab') as journal:
+            journal.write(b'{"type":"entry","id":"torn')
+        self.charge('10', 'wb-7')
+
+        with self.assertLogs('credits.ledger', 'WARNING'):
+            self.assertEqual(flush_journal(), 2)
+        self.assertEqual(LedgerJournalOffset.objects.get(segment=segment.name).offset, segment.stat().st_size)
+
+    def test_approval_is_journaled(self):
+        admin = User.objects.create_user(username='journal_admin', password='pw', is_admin_user=True)
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        credit_request = CreditRequest.objects.create(reference_id='WB-1', seller=self.seller, amount=Decimal('50'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(
+                f'/api/credits/credit-requests/{credit_request.id}/process/', {'action': 'approve'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['transaction']['id'])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        out = StringIO()
+        call_command('flush_ledger_journal', stdout=out)
+        self.assertIn('1 ledger rows flushed', out.getvalue())
+        ledger = Transaction.objects.latest('id')
+        self.assertEqual((ledger.previous_credit, ledger.new_credit), (Decimal('100'), Decimal('150')))
+        self.assertEqual(ledger.related_to, credit_request)
@@ -0,0 +1,90 @@
+import uuid
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from charge.models import PhoneNumber
+from recharge.metrics import Histogram, get_registry
+
+User = get_user_model()
+
+
+def parse_server_timing(header):
+    timings = {}
+    for entry in header.split(','):
+        name, *params = [part.strip() for part in entry.split(';')]
+        timings[name] = dict(param.split('=', 1) for param in params)
+    return timings
+
+
+class RequestMetricsTestCase(TestCase):
+
+    def setUp(self):
+        get_registry().clear()
+        user = User.objects.create_user(username='metrics_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+        admin = User.objects.create_user(username='metrics_admin', password='pw', is_admin_user=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(user=admin)
+
+    def charge(self):
+        return self.client.post('/api/charge/charges/', {
+            'transaction_uuid': str(uuid.uuid4()),
+            'phone_number_id': self.phone.id,
+            'amount': '10',
+        }, format='json')
+
+    def test_server_timing_reports_each_phase(self):
+        response = self.charge()
+        self.assertEqual(response.status_code, 201)
+
+        timings = parse_server_timing(response['Server-Timing'])
+        self.assertEqual(set(timings), {'total', 'view', 'db', 'lock', 'serializer'})
+        durations = {name: float(params['dur']) for name, params in timings.items()}
+        self.assertGreater(durations['lock'], 0)
+        self.assertGreater(durations['serializer'], 0)
+        self.assertLessEqual(durations['lock'], durations['db'])
+        self.assertLessEqual(durations['view'], durations['total'])
+        self.assertRegex(timings['db']['desc'], r'"[1-9]\d* queries"')
+
+    def test_metrics_endpoint_is_admin_only_prometheus_text(self):
+        self.charge()
+        self.charge()
+
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        response = self.admin_client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE recharge_request_phase_seconds histogram', body)
+        self.assertIn(
+            'recharge_request_phase_seconds_count{view="charge-list",method="POST",phase="lock"} 2', body
+        )
+        self.assertIn(
+            'recharge_request_phase_seconds_bucket{view="charge-list",method="POST",phase="total",le="+Inf"} 2', body
+        )
+        self.assertIn('recharge_responses_total{view="charge-list",method="POST",status="201"} 2', body)
+        self.assertIn('recharge_request_queries_count{view="charge-list",method="POST"} 2', body)
+
+    def test_histogram_buckets_are_cumulative_and_inclusive(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(0.1, 2), (1.0, 3), ('+Inf', 4)])
+        self.assertEqual(histogram.count, 4)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': False})
+    def test_disabled(self):
+        client = APIClient()
+        client.force_authenticate(user=self.seller.user)
+        response = client.get('/api/credits/transactions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
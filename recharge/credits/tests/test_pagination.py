@@ -0,0 +1,57 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from credits.models import Transaction
+
+User = get_user_model()
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='paging_seller', password='pw', is_seller=True)
+        seller = Seller.objects.create(user=user)
+        now = timezone.now()
+        # 45 rows, several of which share a created_at to exercise the id tiebreak
+        Transaction.objects.bulk_create([
+            Transaction(
+                seller=seller, amount=Decimal('1'), transaction_type='credit_increase',
+                previous_credit=Decimal(i), new_credit=Decimal(i + 1), status='successful',
+                created_at=now - timedelta(seconds=i // 3)
+            )
+            for i in range(45)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def test_cursor_pages_cover_every_row_once_without_count(self):
+        seen = []
+        url = '/api/credits/transactions/?pagination=cursor'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in query['sql'].upper() for query in queries))
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        expected = list(Transaction.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_number_mode_is_default(self):
+        response = self.client.get('/api/credits/transactions/')
+        self.assertEqual(response.data['count'], 45)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/credits/transactions/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
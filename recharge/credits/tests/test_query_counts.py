@@ -0,0 +1,82 @@
+import uuid
+from decimal import Decimal
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.authentication import get_token_cache
+from accounts.models import Seller
+from charge.models import PhoneNumber
+from charge.services import charge_phone
+from credits.models import CreditRequest
+
+User = get_user_model()
+
+
+class ListQueryCountTestCase(TestCase):
+    """
+    Pins the number of queries per list page so nested serializers cannot
+    silently fall back to per-row lookups.
+    """
+
+    def setUp(self):
+        self.phones = [PhoneNumber.objects.create(number=f'0912000{i:04d}') for i in range(5)]
+        for n in range(2):
+            user = User.objects.create_user(username=f'count_seller{n}', password='pw', is_seller=True)
+            seller = Seller.objects.create(user=user, credit=Decimal('1000'))
+            for i in range(25):
+                CreditRequest.objects.create(seller=seller, amount=Decimal('10'), reference_id=f'CR-{uuid.uuid4()}')
+                charge_phone(seller.id, self.phones[i % 5].id, Decimal('1'), str(uuid.uuid4()))
+
+        User.objects.create_user(username='count_admin', password='pw', is_admin_user=True)
+
+    def client_for(self, username):
+        # a fresh user instance, so no relation is cached from an earlier request
+        client = APIClient()
+        client.force_authenticate(user=User.objects.get(username=username))
+        return client
+
+    def assertListQueries(self, username, url, expected):
+        client = self.client_for(username)
+        with self.assertNumQueries(expected):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'])
+
+    # seller: principal resolution (once for permissions and get_queryset), COUNT(*), page
+    def test_seller_list_endpoints(self):
+        self.assertListQueries('count_seller0', '/api/charge/charges/', 3)
+        self.assertListQueries('count_seller0', '/api/charge/charges/?page=2', 3)
+        self.assertListQueries('count_seller0', '/api/credits/transactions/', 3)
+        self.assertListQueries('count_seller0', '/api/credits/transactions/?page=2', 3)
+        self.assertListQueries('count_seller0', '/api/credits/credit-requests/', 3)
+
+    def test_seller_cursor_pages_skip_count(self):
+        self.assertListQueries('count_seller0', '/api/charge/charges/?pagination=cursor', 2)
+        self.assertListQueries('count_seller0', '/api/credits/transactions/?pagination=cursor', 2)
+
+    # admin: the principal still resolves whether the admin is also a seller
+    def test_admin_list_endpoints(self):
+        self.assertListQueries('count_admin', '/api/charge/charges/', 3)
+        self.assertListQueries('count_admin', '/api/credits/transactions/', 3)
+        self.assertListQueries('count_admin', '/api/credits/transactions/?page=2', 3)
+        self.assertListQueries('count_admin', '/api/credits/credit-requests/', 3)
+        self.assertListQueries('count_admin', '/api/charge/phone-numbers/', 2)
+
+    # with a warm token cache the principal is free: only COUNT(*) and the page remain
+    def test_token_authenticated_lists_skip_auth_queries(self):
+        get_token_cache().clear()
+        for username in ['count_seller0', 'count_admin']:
+            token = Token.objects.create(user=User.objects.get(username=username))
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            client.get('/api/credits/transactions/')
+
+            with self.assertNumQueries(2):
+                response = client.get('/api/credits/transactions/')
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(2):
+                response = client.get('/api/credits/credit-requests/')
+            self.assertEqual(response.status_code, 200)
@@ -0,0 +1,90 @@
+import json
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from accounts.models import Seller
+from accounts.shards import enable_credit_shards
+from charge.models import PhoneNumber
+from charge.services import charge_phone
+from credits.models import LedgerCheckpoint, Transaction
+from credits.reconcile import reconcile_ledger, reconcile_seller
+
+User = get_user_model()
+
+
+class LedgerReconciliationTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='ledger_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user)
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+        self.deposit(Decimal('100'))
+
+    def deposit(self, amount):
+        self.seller.refresh_from_db()
+        Transaction.objects.create(
+            seller=self.seller, amount=amount, transaction_type='credit_increase',
+            previous_credit=self.seller.credit, new_credit=self.seller.credit + amount, status='successful'
+        )
+        Seller.objects.filter(id=self.seller.id).update(credit=self.seller.credit + amount)
+
+    def test_clean_ledger_advances_checkpoint(self):
+        charge_phone(self.seller.id, self.phone.id, Decimal('30'), 'r-1')
+        charge_phone(self.seller.id, self.phone.id, Decimal('20'), 'r-2')
+
+        result = reconcile_seller(self.seller.id)
+        self.assertEqual(result['discrepancies'], [])
+        self.assertEqual(result['scanned'], 3)
+        checkpoint = LedgerCheckpoint.objects.get(seller=self.seller)
+        self.assertEqual(checkpoint.ledger_total, Decimal('50'))
+        self.assertEqual(checkpoint.new_credit, Decimal('50'))
+
+        charge_phone(self.seller.id, self.phone.id, Decimal('5'), 'r-3')
+        result = reconcile_seller(self.seller.id)
+        self.assertEqual(result['scanned'], 1)
+        self.assertEqual(result['discrepancies'], [])
+
+    def test_broken_chain_and_balance_are_reported(self):
+        charge_phone(self.seller.id, self.phone.id, Decimal('30'), 'r-1')
+        reconcile_seller(self.seller.id)
+
+        broken = charge_phone(self.seller.id, self.phone.id, Decimal('10'), 'r-2')
+        ledger = Transaction.objects.get(object_id=broken.id, transaction_type='charge_sale')
+        Transaction.objects.filter(id=ledger.id).update(previous_credit=Decimal('75'), new_credit=Decimal('65'))
+        Seller.objects.filter(id=self.seller.id).update(credit=Decimal('1000'))
+
+        result = reconcile_seller(self.seller.id)
+        kinds = {issue['kind']: issue for issue in result['discrepancies']}
+        self.assertEqual(kinds['chain_break']['transaction_id'], ledger.id)
+        self.assertEqual(kinds['chain_break']['expected'], Decimal('70'))
+        self.assertEqual(kinds['balance_mismatch']['expected'], Decimal('60'))
+        self.assertEqual(kinds['balance_mismatch']['actual'], Decimal('1000'))
+        # a dirty run leaves the checkpoint where the last clean run put it
+        self.assertEqual(LedgerCheckpoint.objects.get(seller=self.seller).ledger_total, Decimal('70'))
+
+    def test_sharded_seller_checks_each_shard_chain(self):
+        enable_credit_shards(self.seller.id, 4)
+        for i in range(6):
+            charge_phone(self.seller.id, self.phone.id, Decimal('10'), f's-{i}', credit_shards=4)
+
+        report = reconcile_ledger(full=True)
+        self.assertTrue(report['clean'], report['discrepancies'])
+        self.assertEqual(report['transactions_scanned'], 7)
+        self.assertEqual(LedgerCheckpoint.objects.get(seller=self.seller).ledger_total, Decimal('40'))
+
+    def test_command_writes_json_report(self):
+        out = StringIO()
+        call_command('reconcile_ledger', workers=1, stdout=out, stderr=StringIO())
+        self.assertTrue(json.loads(out.getvalue())['clean'])
+
+        Seller.objects.filter(id=self.seller.id).update(credit=Decimal('1'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('reconcile_ledger', workers=1, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['discrepancies'][0]['kind'], 'tip_mismatch')
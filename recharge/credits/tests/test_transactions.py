@@ -0,0 +1,201 @@
+import threading
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from accounts.models import Seller
+from charge.models import ChargeSale, PhoneNumber
+from charge.services import charge_phone
+from credits.approvals import process_credit_requests
+from credits.models import CreditRequest
+from recharge.metrics import get_registry
+from recharge.transactions import (
+    LockOrderViolation, TransactionContention, TransactionTimeouts, retry_reason, run_transaction
+)
+
+User = get_user_model()
+
+FAST_RETRIES = {'MAX_ATTEMPTS': 3, 'BACKOFF_BASE': 0, 'BUDGET': 1.0}
+
+
+class DriverError(Exception):
+
+    def __init__(self, *args, sqlstate=None):
+        super().__init__(*args)
+        self.sqlstate = sqlstate
+
+
+def driver_error(*args, sqlstate=None):
+    error = OperationalError(*args)
+    error.__cause__ = DriverError(*args, sqlstate=sqlstate)
+    return error
+
+
+@override_settings(TRANSACTIONS=FAST_RETRIES)
+class RunTransactionTestCase(SimpleTestCase):
+
+    def setUp(self):
+        get_registry().clear()
+
+    def test_retries_contention_then_succeeds(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(run_transaction(flaky, atomic=False), 'done')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(get_registry().retries, {('flaky', 'database_locked'): 2})
+        self.assertIn(
+            'recharge_transaction_retries_total{transaction="flaky",reason="database_locked"} 2',
+            get_registry().render()
+        )
+
+    def test_gives_up_after_the_attempt_budget(self):
+        def deadlocked():
+            raise driver_error('deadlock detected', sqlstate='40P01')
+
+        with self.assertRaises(TransactionContention) as raised:
+            run_transaction(deadlocked, atomic=False)
+        self.assertEqual((raised.exception.attempts, raised.exception.reason), (3, 'deadlock'))
+        self.assertEqual(get_registry().exhausted, {('deadlocked', 'deadlock'): 1})
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        def duplicate():
+            calls.append(1)
+            raise IntegrityError('UNIQUE constraint failed')
+
+        with self.assertRaises(IntegrityError):
+            run_transaction(duplicate, atomic=False)
+        self.assertEqual(len(calls), 1)
+
+    def test_retry_reasons(self):
+        self.assertEqual(retry_reason(driver_error('could not serialize', sqlstate='40001')), 'serialization')
+        self.assertEqual(retry_reason(driver_error('lock timeout', sqlstate='55P03')), 'lock_timeout')
+        self.assertEqual(retry_reason(driver_error(1213, 'Deadlock found')), 'deadlock')
+        self.assertEqual(retry_reason(driver_error(1205, 'Lock wait timeout exceeded')), 'lock_timeout')
+        self.assertIsNone(retry_reason(driver_error('division by zero', sqlstate='22012')))
+        self.assertIsNone(retry_reason(ValueError('database is locked')))
+
+
+class TransactionRunnerViewsTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='runner_seller', password='pw', is_seller=True)
+        self.seller = Seller.objects.create(user=user, credit=Decimal('100'))
+        self.phone = PhoneNumber.objects.create(number='09120000001')
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    @override_settings(TRANSACTIONS={'CHECK_LOCK_ORDER': True})
+    def test_lock_order_is_enforced(self):
+        credit_request = CreditRequest.objects.create(reference_id='LO-1', seller=self.seller, amount=Decimal('5'))
+
+        def out_of_order():
+            Seller.objects.filter(id=self.seller.id).update(credit=Decimal('105'))
+            CreditRequest.objects.filter(id=credit_request.id).update(status='approved')
+
+        def in_order():
+            CreditRequest.objects.filter(id=credit_request.id).update(status='approved')
+            Seller.objects.filter(id=self.seller.id).update(credit=Decimal('105'))
+            CreditRequest.objects.filter(id=credit_request.id).update(status='approved')
+
+        with self.assertRaises(LockOrderViolation):
+            run_transaction(out_of_order)
+        run_transaction(in_order)
+
+    def test_contended_charge_answers_503(self):
+        with mock.patch('charge.views.charge_phone', side_effect=OperationalError('database is locked')):
+            response = self.client.post('/api/charge/charges/', {
+                'transaction_uuid': 'contended-1', 'phone_number_id': self.phone.id, 'amount': '10',
+            }, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @override_settings(TRANSACTIONS={'STATEMENT_TIMEOUT': 5.0, 'LOCK_TIMEOUT': 0.5})
+    def test_timeouts_start_each_transaction(self):
+        executed = []
+        context = {'cursor': mock.Mock(**{'cursor.execute.side_effect': executed.append})}
+        timeouts = TransactionTimeouts(5.0, 0.5)
+
+        for _ in range(2):
+            with transaction.atomic():
+                for _ in range(3):
+                    timeouts(lambda *args: None, 'SELECT 1', None, False, context)
+
+        self.assertEqual(executed, ['SET LOCAL statement_timeout = 5000', 'SET LOCAL lock_timeout = 500'] * 2)
+        self.assertEqual(TransactionTimeouts(None, 2).statements, ['SET LOCAL lock_timeout = 2000'])
+
+        # SQLite has no such settings: charges run without them
+        response = self.client.post('/api/charge/charges/', {
+            'transaction_uuid': 'timeouts-1', 'phone_number_id': self.phone.id, 'amount': '10',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class SQLiteConnectionTestCase(TestCase):
+
+    def test_new_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class SQLiteConcurrentWritersTestCase(TransactionTestCase):
+
+    def test_concurrent_writers_wait_instead_of_failing(self):
+        user = User.objects.create_user(username='writers_seller', password='pw', is_seller=True)
+        seller = Seller.objects.create(user=user, credit=Decimal('1000'))
+        phones = [PhoneNumber.objects.create(number=f'0912000010{index}') for index in range(4)]
+        credit_requests = [
+            CreditRequest.objects.create(reference_id=f'writers-{index}', seller=seller, amount=Decimal('5'))
+            for index in range(40)
+        ]
+        errors = []
+
+        # no run_transaction: a "database is locked" here fails the write
+        def sell(worker):
+            try:
+                for index in range(10):
+                    charge_phone(seller.id, phones[index % 4].id, Decimal('1'), f'writer-{worker}-{index}')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def approve(worker):
+            # reads before it writes, the case where a deferred transaction cannot wait for the lock
+            try:
+                for credit_request in credit_requests[worker::4]:
+                    with transaction.atomic():
+                        process_credit_requests([credit_request.id], 'approve')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=sell, args=(worker,)) for worker in range(8)]
+        threads += [threading.Thread(target=approve, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(ChargeSale.objects.count(), 80)
+        self.assertEqual(CreditRequest.objects.filter(status='approved').count(), 40)
+        seller.refresh_from_db()
+        self.assertEqual(seller.credit, Decimal('1120'))
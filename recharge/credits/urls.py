@@ -1,12 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CreditRequestViewSet, TransactionViewSet
+from .views import CreditRequestViewSet, TransactionViewSet, SellerDailyStatsViewSet
+from . import async_views
 
 
 router = DefaultRouter()
 router.register(r'credit-requests', CreditRequestViewSet)
 router.register(r'transactions', TransactionViewSet, basename='transaction')
+router.register(r'daily-stats', SellerDailyStatsViewSet, basename='daily-stats')
 
 urlpatterns = [
+    path('async/credit-requests/', async_views.credit_request_create, name='async-credit-request-create'),
+    path('async/transactions/', async_views.transaction_list, name='async-transaction-list'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,44 +1,80 @@
-from rest_framework import viewsets, status, permissions, filters
+from rest_framework import viewsets, mixins, status, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.contrib.contenttypes.models import ContentType
-from .models import CreditRequest, Transaction
-from .serializers import CreditRequestSerializer, AdminCreditRequestSerializer, TransactionSerializer
+from django.db.models import Sum
+from .models import CreditRequest, Transaction, SellerDailyStats
+from .approvals import process_credit_requests
+from .filters import CreditRequestFilter, TransactionFilter, SellerDailyStatsFilter
+from .ledger import write_ledger, APPROVAL_WITNESS_FIELDS
+from .stats import fold_daily_stats, record_daily_stats
+from .worker import enqueue_credit_requests
+from .serializers import (
+    CreditRequestSerializer, AdminCreditRequestSerializer, TransactionSerializer, SellerDailyStatsSerializer,
+    ProcessBatchSerializer, CreditRequestTaskSerializer
+)
 from accounts.permissions import IsSeller, IsAdminUser
 from accounts.models import Seller
+from accounts.principal import get_principal
+from accounts.shards import credit_credit_shard
+from recharge import idempotency
+from recharge.export import stream_export, NDJSONRenderer, CSVRenderer
+from recharge.flat import FlatListMixin
+from recharge.pagination import HistoryPagination
+from recharge.querysets import ShapedQuerysetMixin
+from recharge.transactions import run_transaction, TransactionContention, contention_response
 from django_filters.rest_framework import DjangoFilterBackend
-import uuid
-class CreditRequestViewSet(viewsets.ModelViewSet):
+
+
+class CreditRequestViewSet(FlatListMixin, ShapedQuerysetMixin, viewsets.ModelViewSet):
 
     serializer_class = CreditRequestSerializer
     queryset = CreditRequest.objects.all()
+    batch_max_items = 500
 
     def get_serializer_class(self):
-        if self.request.user.is_admin_user:
+        if get_principal(self.request).is_admin_user:
             return AdminCreditRequestSerializer
         return CreditRequestSerializer
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve', 'create']:
             permission_classes = [IsSeller | IsAdminUser]
-        elif self.action in ['update', 'partial_update', 'destroy', 'process']:
+        elif self.action in ['update', 'partial_update', 'destroy', 'process', 'process_batch', 'enqueue']:
             permission_classes = [IsAdminUser]
         else:
             permission_classes = [permissions.IsAuthenticated]
         return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_admin_user:
+        principal = get_principal(self.request)
+        if principal.is_admin_user:
             return CreditRequest.objects.all().order_by('-created_at')
-        elif hasattr(user, 'seller_profile'):
-            return CreditRequest.objects.filter(seller=user.seller_profile).order_by('-created_at')
+        elif principal.is_seller:
+            return CreditRequest.objects.filter(seller_id=principal.seller_id).order_by('-created_at')
         return CreditRequest.objects.none()
 
+    def create(self, request, *args, **kwargs):
+        reference_id = request.data.get('reference_id') if isinstance(request.data, dict) else None
+        replayed = idempotency.replay('credit_request', request.user.id, reference_id, request.data)
+        if replayed is not None:
+            return replayed
+
+        try:
+            with transaction.atomic():
+                response = super().create(request, *args, **kwargs)
+        except IntegrityError:
+            return Response(
+                {"detail": "Credit request with this reference ID already exists."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return idempotency.remember('credit_request', request.user.id, reference_id, request.data, response)
+
     def perform_create(self, serializer):
-        serializer.save(seller=self.request.user.seller_profile)
+        serializer.save(seller_id=get_principal(self.request).seller_id)
 
     @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
     def process(self, request, pk=None):
@@ -58,96 +94,193 @@ class CreditRequestViewSet(viewsets.ModelViewSet):
             )
 
         try:
-            with transaction.atomic():
-                # comment for sqlite
-                # connection.cursor().execute("SET LOCAL statement_timeout = '5s'")
-
-
-                credit_request = CreditRequest.objects.select_for_update().get(pk=credit_request.pk)
+            return run_transaction(self.apply_decision, credit_request.pk, action_type, name='credit_request_process')
+        except CreditRequest.DoesNotExist:
+            return Response(
+                {"detail": "Credit request not found."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Seller.DoesNotExist:
+            return Response(
+                {"detail": "Seller not found."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except TransactionContention:
+            return contention_response()
 
+    def apply_decision(self, pk, action_type):
+        credit_request = CreditRequest.objects.select_for_update().get(pk=pk)
 
-                if credit_request.status != 'pending':
-                    return Response(
-                        {"detail": f"This request has already been {credit_request.status} while processing."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+        if credit_request.status != 'pending':
+            return Response(
+                {"detail": f"This request has already been {credit_request.status} while processing."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                seller = Seller.objects.select_for_update().get(id=credit_request.seller.id)
+        seller = Seller.objects.select_for_update().get(id=credit_request.seller_id)
 
-                if action_type == 'approve':
+        if action_type == 'approve':
+            # before the seller's credit: LOCK_ORDER has credit requests ahead of sellers and shards
+            credit_request.status = 'approved'
+            credit_request.processed_at = timezone.now()
+            credit_request.save(update_fields=['status', 'processed_at'])
 
+            if seller.credit_shards:
+                previous_credit, new_credit, credit_shard = credit_credit_shard(
+                    seller.id, credit_request.amount, seller.credit_shards
+                )
+            else:
+                previous_credit = seller.credit
+                new_credit = previous_credit + credit_request.amount
+                credit_shard = None
 
+            transaction_obj = Transaction(
+                seller=seller,
+                amount=credit_request.amount,
+                transaction_type='credit_increase',
+                previous_credit=previous_credit,
+                new_credit=new_credit,
+                credit_shard=credit_shard,
+                description=f"Credit increase from request {credit_request.reference_id}",
+                status='successful',
+                completed_at=timezone.now(),
+                content_type=ContentType.objects.get_for_model(CreditRequest),
+                object_id=credit_request.id
+            )
+            write_ledger([transaction_obj], credit_request, APPROVAL_WITNESS_FIELDS)
 
-                    previous_credit = seller.credit
-                    new_credit = previous_credit + credit_request.amount
+            if not seller.credit_shards:
+                seller.credit = new_credit
+                seller.save(update_fields=['credit'])
 
+            record_daily_stats(
+                seller.id, shard=credit_shard, credit_increase_count=1, credit_increase_amount=credit_request.amount
+            )
 
-                    credit_request.status = 'approved'
-                    credit_request.processed_at = timezone.now()
-                    credit_request.save(update_fields=['status', 'processed_at'])
+            return Response({
+                "detail": "Credit request approved successfully",
+                "transaction": TransactionSerializer(transaction_obj).data
+            })
 
+        credit_request.status = 'rejected'
+        credit_request.processed_at = timezone.now()
+        credit_request.save(update_fields=['status', 'processed_at'])
 
-                    transaction_obj = Transaction.objects.create(
+        return Response({
+            "detail": "Credit request rejected"
+        })
 
-                        seller=seller,
-                        amount=credit_request.amount,
-                        transaction_type='credit_increase',
-                        previous_credit=previous_credit,
-                        new_credit=new_credit,
-                        description=f"Credit increase from request {credit_request.reference_id}",
-                        status='successful',
-                        completed_at=timezone.now(),
-                        content_type=ContentType.objects.get_for_model(CreditRequest),
-                        object_id=credit_request.id
-                    )
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
+    def enqueue(self, request, pk=None):
+        credit_request = self.get_object()
+        action_type = request.data.get('action', '').lower()
 
+        if action_type not in ['approve', 'reject']:
+            return Response(
+                {"detail": "Action must be either 'approve' or 'reject'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                    seller.credit = new_credit
-                    seller.save(update_fields=['credit'])
+        if credit_request.status != 'pending':
+            return Response(
+                {"detail": f"This request has already been {credit_request.status}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                    return Response({
-                        "detail": "Credit request approved successfully",
-                        "transaction": TransactionSerializer(transaction_obj).data
-                    })
-                else:
+        task, = enqueue_credit_requests([credit_request], action_type)
+        if task.action != action_type:
+            return Response(
+                {"detail": f"This request is already queued to {task.action}."},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({
+            "detail": "Credit request queued",
+            "task": CreditRequestTaskSerializer(task).data
+        }, status=status.HTTP_202_ACCEPTED)
 
-                    credit_request.status = 'rejected'
-                    credit_request.processed_at = timezone.now()
-                    credit_request.save(update_fields=['status', 'processed_at'])
+    @action(detail=False, methods=['post'], url_path='process-batch', permission_classes=[IsAdminUser])
+    def process_batch(self, request):
+        serializer = ProcessBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('ids')
 
-                    return Response({
-                        "detail": "Credit request rejected"
-                    })
-        except CreditRequest.DoesNotExist:
-            return Response(
-                {"detail": "Credit request not found."},
-                status=status.HTTP_404_NOT_FOUND
+        if ids is None:
+            filterset = CreditRequestFilter(
+                serializer.validated_data['filter'], queryset=CreditRequest.objects.filter(status='pending')
             )
-        except Seller.DoesNotExist:
+            if not filterset.is_valid():
+                return Response({"filter": filterset.errors}, status=status.HTTP_400_BAD_REQUEST)
+            ids = list(filterset.qs.order_by('id').values_list('id', flat=True)[:self.batch_max_items])
+
+        if len(ids) > self.batch_max_items:
             return Response(
-                {"detail": "Seller not found."},
-                status=status.HTTP_404_NOT_FOUND
+                {"detail": f"A batch may contain at most {self.batch_max_items} credit requests."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        except Exception as e:
-            return Response(
-                {"detail": f"Error processing credit request: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        try:
+            results = run_transaction(
+                process_credit_requests, ids, serializer.validated_data['action'], name='credit_request_process_batch'
             )
+        except TransactionContention:
+            return contention_response()
+        processed = sum(1 for result in results if result['status'] != 'failed')
+        return Response({
+            "processed": processed,
+            "failed": len(results) - processed,
+            "results": results
+        })
 
 
-class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
+class TransactionViewSet(FlatListMixin, ShapedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [IsSeller | IsAdminUser]
+    pagination_class = HistoryPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['transaction_type', 'status']
+    filterset_class = TransactionFilter
     search_fields = ['description']
     ordering_fields = ['created_at', 'amount', 'status']
     ordering = ['-created_at']
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_admin_user:
+        principal = get_principal(self.request)
+        if principal.is_admin_user:
             return Transaction.objects.all()
-        elif hasattr(user, 'seller_profile'):
-            return Transaction.objects.filter(seller=user.seller_profile)
-        return Transaction.objects.none()
\ No newline at end of file
+        elif principal.is_seller:
+            return Transaction.objects.filter(seller_id=principal.seller_id)
+        return Transaction.objects.none()
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('created_at', 'id')
+        export_format = 'csv' if request.accepted_renderer.format == 'csv' else 'ndjson'
+        return stream_export(queryset, self.get_serializer_class(), export_format, 'transactions')
+
+
+class SellerDailyStatsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    serializer_class = SellerDailyStatsSerializer
+    permission_classes = [IsSeller | IsAdminUser]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SellerDailyStatsFilter
+
+    def get_rows(self):
+        principal = get_principal(self.request)
+        if principal.is_admin_user:
+            return SellerDailyStats.objects.all()
+        elif principal.is_seller:
+            return SellerDailyStats.objects.filter(seller_id=principal.seller_id)
+        return SellerDailyStats.objects.none()
+
+    def get_queryset(self):
+        return fold_daily_stats(self.get_rows()).order_by('-date', 'seller_id')
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        totals = self.filter_queryset(self.get_rows()).aggregate(
+            charge_count=Sum('charge_count'),
+            charge_amount=Sum('charge_amount'),
+            credit_increase_count=Sum('credit_increase_count'),
+            credit_increase_amount=Sum('credit_increase_amount'),
+            failed_charge_count=Sum('failed_charge_count'),
+        )
+        return Response({field: value or 0 for field, value in totals.items()})
@@ -0,0 +1,170 @@
+"""
+Queued processing of credit requests.
+
+``enqueue_credit_requests`` records the admin's decision as a
+CreditRequestTask and returns at once; ``run_credit_worker`` workers claim
+queued tasks in batches and apply them with ``process_credit_requests``.
+
+A claim sets a lease. Postgres (and MySQL 8) workers pick their batch with
+``SELECT ... FOR UPDATE SKIP LOCKED`` so they never wait on each other;
+without SKIP LOCKED (SQLite) the candidates are read without locks and a
+conditional UPDATE hands each task to exactly one of the workers racing for
+it. A worker that dies leaves its tasks ``processing`` until the lease runs
+out, after which they are claimed again: delivery is at least once.
+
+Redelivery is harmless. The credit request and its task are updated in the
+same transaction, and a request that is no longer pending is never applied
+twice; when it already has the status the task asks for (a redelivered task,
+or the same decision made through ``process``), the task is simply done.
+"""
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from recharge.transactions import run_transaction, TransactionContention
+from .approvals import process_credit_requests
+from .models import CreditRequest, CreditRequestTask
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 100,
+    'LEASE': 60,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+}
+
+PROCESSED_STATUS = {'approve': 'approved', 'reject': 'rejected'}
+
+
+def credit_worker_setting(name):
+    return {**DEFAULTS, **getattr(settings, 'CREDIT_WORKER', {})}[name]
+
+
+def enqueue_credit_requests(credit_requests, action):
+    """Queue ``action`` for each credit request; requests that already have a task keep it."""
+    CreditRequestTask.objects.bulk_create(
+        [CreditRequestTask(credit_request=credit_request, action=action) for credit_request in credit_requests],
+        ignore_conflicts=True
+    )
+    return list(
+        CreditRequestTask.objects.filter(credit_request__in=credit_requests).order_by('credit_request_id')
+    )
+
+
+def _claimable(now):
+    return Q(status='queued') | Q(status='processing', lease_expires_at__lt=now)
+
+
+def claim_tasks(worker, batch_size=None, lease=None):
+    """Claim up to ``batch_size`` tasks for ``worker``, oldest first."""
+    batch_size = batch_size or credit_worker_setting('BATCH_SIZE')
+    lease = lease or credit_worker_setting('LEASE')
+    now = timezone.now()
+    claim = f'{worker}/{uuid.uuid4().hex[:12]}'
+    candidates = CreditRequestTask.objects.filter(_claimable(now)).order_by('id').values_list('id', flat=True)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True)[:batch_size])
+            claimed = _claim(ids, claim, now, lease)
+    else:
+        # no row locks to skip: a read, then a conditional write that one of the racing workers wins
+        claimed = _claim(list(candidates[:batch_size]), claim, now, lease)
+
+    if not claimed:
+        return []
+    return list(CreditRequestTask.objects.filter(claim=claim).order_by('id'))
+
+
+def _claim(ids, claim, now, lease):
+    if not ids:
+        return 0
+    # the condition re-checks each row, so only one of several racing workers gets it
+    return CreditRequestTask.objects.filter(_claimable(now), id__in=ids).update(
+        status='processing', claim=claim, lease_expires_at=now + timedelta(seconds=lease),
+        attempts=F('attempts') + 1
+    )
+
+
+def _finish(tasks, status, now, detail=''):
+    CreditRequestTask.objects.filter(id__in=[task.id for task in tasks]).update(
+        status=status, detail=detail, processed_at=now, lease_expires_at=None
+    )
+
+
+def _apply(action, tasks):
+    results = process_credit_requests([task.credit_request_id for task in tasks], action)
+    now = timezone.now()
+    target = PROCESSED_STATUS[action]
+
+    failed = [result['id'] for result in results if result['status'] == 'failed']
+    current = dict(CreditRequest.objects.filter(id__in=failed).values_list('id', 'status')) if failed else {}
+
+    done = []
+    for task, result in zip(tasks, results):
+        if result['status'] == 'failed' and current.get(task.credit_request_id) != target:
+            _finish([task], 'failed', now, result['detail'])
+        else:
+            done.append(task)
+    _finish(done, 'done', now)
+    return len(tasks)
+
+
+def process_tasks(tasks):
+    """Apply claimed tasks, one transaction per action. Returns how many were finished."""
+    max_attempts = credit_worker_setting('MAX_ATTEMPTS')
+    by_action = {}
+    for task in tasks:
+        by_action.setdefault(task.action, []).append(task)
+
+    finished = 0
+    for action, group in sorted(by_action.items()):
+        try:
+            finished += run_transaction(_apply, action, group, name='credit_worker')
+        except Exception as e:
+            logger.exception("Credit worker could not %s %d requests", action, len(group))
+            retry = [task for task in group if task.attempts < max_attempts]
+            CreditRequestTask.objects.filter(id__in=[task.id for task in retry]).update(
+                status='queued', claim='', lease_expires_at=None, detail=str(e)
+            )
+            given_up = [task for task in group if task.attempts >= max_attempts]
+            _finish(given_up, 'failed', timezone.now(), str(e))
+            finished += len(given_up)
+    return finished
+
+
+def run_worker(worker=None, batch_size=None, lease=None, poll_interval=None, once=False):
+    """
+    Claim and process tasks until the queue is empty (``once``) or forever,
+    polling every ``poll_interval`` seconds while it is. Returns the number
+    of tasks finished.
+    """
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    poll_interval = poll_interval or credit_worker_setting('POLL_INTERVAL')
+    finished = 0
+    while True:
+        try:
+            tasks = run_transaction(claim_tasks, worker, batch_size, lease, name='credit_worker_claim', atomic=False)
+        except TransactionContention:
+            time.sleep(poll_interval)
+            continue
+        if tasks:
+            finished += process_tasks(tasks)
+        elif once:
+            return finished
+        else:
+            time.sleep(poll_interval)
+
+
+def run_worker_process(kwargs):
+    """``run_worker`` for ``map_in_processes``, named after the process it runs in."""
+    return run_worker(**kwargs)
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import connection
+
+
+DEFAULTS = {
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'BUSY_TIMEOUT': 5000,
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'CACHE_SIZE': -64 * 1024,
+}
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'JOURNAL_MODE'),
+    ('synchronous', 'SYNCHRONOUS'),
+    ('busy_timeout', 'BUSY_TIMEOUT'),
+    ('mmap_size', 'MMAP_SIZE'),
+    ('cache_size', 'CACHE_SIZE'),
+)
+
+
+def sqlite_setting(name):
+    return {**DEFAULTS, **getattr(settings, 'SQLITE', {})}[name]
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver (see recharge/apps.py) applying the SQLITE pragmas; None leaves one alone."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, name in SQLITE_PRAGMAS:
+            value = sqlite_setting(name)
+            if value is not None:
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+def supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def update_returning(table, assignments, params, key, columns, condition=None, condition_params=()):
+    """
+    Run a single UPDATE against the row identified by ``key`` (a column -> value
+    dict) and hand back the post-update values of ``columns``, or None when no
+    row matched ``key`` and ``condition``.
+    """
+    qn = connection.ops.quote_name
+    key_sql = ' AND '.join(f"{qn(column)} = %s" for column in key)
+    key_params = list(key.values())
+    where = key_sql + (f" AND {condition}" if condition else '')
+    sql = f"UPDATE {qn(table)} SET {assignments} WHERE {where}"
+    params = [*params, *key_params, *condition_params]
+    select_list = ', '.join(qn(c) for c in columns)
+
+    with connection.cursor() as cursor:
+        if supports_update_returning():
+            cursor.execute(f"{sql} RETURNING {select_list}", params)
+            return cursor.fetchone()
+
+        cursor.execute(sql, params)
+        if cursor.rowcount != 1:
+            return None
+        # the row stays write-locked by the UPDATE above until commit
+        cursor.execute(f"SELECT {select_list} FROM {qn(table)} WHERE {key_sql}", key_params)
+        return cursor.fetchone()
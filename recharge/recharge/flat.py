@@ -0,0 +1,103 @@
+"""
+Flat, low-allocation list representation.
+
+Renders rows fetched with ``.values()`` straight into dicts that match the
+ModelSerializer output field for field, without instantiating model objects
+or serializer fields per row. Nested serializers collapse to ``<name>_id``
+unless listed in ``expand``.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from recharge.metrics import span
+
+
+def _decimal(value, tz):
+    return '{:f}'.format(value)
+
+
+def _datetime(value, tz):
+    if tz is not None and value.tzinfo is not None:
+        value = value.astimezone(tz)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _converter(field):
+    if isinstance(field, serializers.DecimalField):
+        return _decimal if getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) else None
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime
+    return None
+
+
+def _plan(serializer, prefix, expand, columns, expand_all=False):
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        column = prefix + field.source
+        if isinstance(field, serializers.BaseSerializer):
+            if expand_all or name in expand:
+                plan.append((name, None, None, _plan(field, column + '__', expand, columns, expand_all=True)))
+            else:
+                columns.append(column + '_id')
+                plan.append((f"{name}_id", column + '_id', None, None))
+            continue
+        columns.append(column)
+        plan.append((name, column, _converter(field), None))
+    return plan
+
+
+@lru_cache(maxsize=None)
+def flat_plan(serializer_class, expand=frozenset()):
+    columns = []
+    plan = _plan(serializer_class(), '', expand, columns)
+    return tuple(dict.fromkeys(columns)), plan
+
+
+def _render(plan, row, tz):
+    data = {}
+    for key, column, convert, nested in plan:
+        if nested is not None:
+            data[key] = _render(nested, row, tz)
+            continue
+        value = row[column]
+        data[key] = convert(value, tz) if convert is not None and value is not None else value
+    return data
+
+
+def render_rows(plan, rows):
+    # resolve the active timezone once per list rather than once per value
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    with span('serializer'):
+        return [_render(plan, row, tz) for row in rows]
+
+
+class FlatListMixin:
+    """
+    ``?representation=flat`` on a list endpoint renders from ``.values()``
+    instead of model instances; ``?expand=seller`` keeps a nested object.
+    """
+    flat_query_param = 'representation'
+    expand_query_param = 'expand'
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.flat_query_param) != 'flat':
+            return super().list(request, *args, **kwargs)
+
+        expand = frozenset(filter(None, request.query_params.get(self.expand_query_param, '').split(',')))
+        columns, plan = flat_plan(self.get_serializer_class(), expand)
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_rows(plan, page))
+        return Response(render_rows(plan, queryset))
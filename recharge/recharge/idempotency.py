@@ -0,0 +1,138 @@
+"""
+Idempotent replay of final API responses.
+
+Responses are keyed by (scope, user id, client key), e.g. a charge's
+``transaction_uuid`` or a credit request's ``reference_id``. Lookups hit an
+in-process LRU first and then, if ``IDEMPOTENCY['CACHE_ALIAS']`` names one of
+``CACHES``, that shared Django cache (locmem, file based, ...). A hash of the
+request body is stored with the response, and a key reused with a different
+body is answered with 409 instead of a replay. The database unique
+constraints remain the source of truth; this only saves the work of
+re-running a request that already succeeded.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+DEFAULTS = {
+    'LRU_SIZE': 10000,
+    'CACHE_ALIAS': None,
+    'TIMEOUT': 24 * 60 * 60,
+}
+
+CONFLICT_DETAIL = "This idempotency key was already used with a different request."
+
+
+class LRUCache:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class IdempotencyStore:
+
+    def __init__(self, lru_size, cache_alias=None, timeout=None):
+        self.local = LRUCache(lru_size)
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    @staticmethod
+    def make_key(scope, user_id, key):
+        digest = hashlib.sha256(str(key).encode()).hexdigest()
+        return f"idempotency:{scope}:{user_id}:{digest}"
+
+    def get(self, scope, user_id, key):
+        cache_key = self.make_key(scope, user_id, key)
+        entry = self.local.get(cache_key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(cache_key)
+            if entry is not None:
+                self.local.set(cache_key, entry)
+        return entry
+
+    def set(self, scope, user_id, key, fingerprint, status_code, data):
+        cache_key = self.make_key(scope, user_id, key)
+        entry = (fingerprint, status_code, data)
+        self.local.set(cache_key, entry)
+        if self.shared is not None:
+            self.shared.set(cache_key, entry, self.timeout)
+
+    def clear(self):
+        """Forget the in-process entries; the shared cache may hold other data and expires ours itself."""
+        self.local.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY', {})}
+                _store = IdempotencyStore(config['LRU_SIZE'], config['CACHE_ALIAS'], config['TIMEOUT'])
+    return _store
+
+
+def fingerprint(data):
+    """Hash of a request body, independent of key order."""
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def replay(scope, user_id, key, data):
+    """
+    Return the stored Response for ``key``, a 409 Response if it was stored
+    for a different request body ``data``, or None if there is none.
+    """
+    if not key:
+        return None
+    entry = get_store().get(scope, user_id, key)
+    if entry is None:
+        return None
+    stored_fingerprint, status_code, body = entry
+    if stored_fingerprint != fingerprint(data):
+        return Response({"detail": CONFLICT_DETAIL}, status=status.HTTP_409_CONFLICT)
+    return Response(body, status=status_code)
+
+
+def remember(scope, user_id, key, data, response):
+    get_store().set(scope, user_id, key, fingerprint(data), response.status_code, dict(response.data))
+    return response
@@ -0,0 +1,348 @@
+"""
+Per-request timing and query instrumentation.
+
+RequestMetricsMiddleware opens a RequestMetrics for every request; a database
+execute wrapper installed on every connection adds each statement to it, and
+``span('serializer')`` (used by TimedSerializerMixin and the flat list path)
+adds serializer time. Phases, in seconds:
+
+    total       the request inside the middleware
+    view        from URL resolution to the rendered response (auth, permissions, handler, rendering)
+    db          all statements; ``queries`` counts them
+    lock        statements that take row locks (UPDATE, DELETE, SELECT ... FOR UPDATE), an upper
+                bound on the time spent waiting for them
+    serializer  validation and representation
+
+They are sent back as a ``Server-Timing`` header and observed into
+in-process histograms per view and method, which ``metrics_view`` exposes in
+the Prometheus text format to admin users. Every worker process has its own
+histograms, so scrape each process (or run one) when that matters. The
+registry also counts transaction retries on lock contention, see
+recharge/transactions.py.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+
+from accounts.permissions import IsAdminUser
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'BUCKETS': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'QUERY_BUCKETS': (1, 2, 3, 5, 10, 20, 50, 100),
+}
+
+PHASES = ('total', 'view', 'db', 'lock', 'serializer')
+
+
+def metrics_setting(name):
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}[name]
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db', 'lock', 'serializer', 'view', 'total', 'view_started', '_open')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = self.lock = self.serializer = self.view = self.total = 0.0
+        self.view_started = None
+        self._open = set()
+
+    def server_timing(self):
+        return ', '.join([
+            f'total;dur={self.total * 1000:.3f}',
+            f'view;dur={self.view * 1000:.3f}',
+            f'db;dur={self.db * 1000:.3f};desc="{self.queries} queries"',
+            f'lock;dur={self.lock * 1000:.3f}',
+            f'serializer;dur={self.serializer * 1000:.3f}',
+        ])
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def current_metrics():
+    """The RequestMetrics of the request being served, or None outside of one."""
+    return _current.get()
+
+
+class span:
+    """Adds the time spent in the block to a phase of the current request; nested spans count once."""
+    __slots__ = ('name', 'metrics', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.metrics = None
+
+    def __enter__(self):
+        metrics = _current.get()
+        if metrics is not None and self.name not in metrics._open:
+            metrics._open.add(self.name)
+            self.metrics = metrics
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics = self.metrics
+        if metrics is not None:
+            setattr(metrics, self.name, getattr(metrics, self.name) + time.perf_counter() - self.started)
+            metrics._open.discard(self.name)
+            self.metrics = None
+
+
+class TimedSerializerMixin:
+    """Counts validation and representation of a serializer (and of lists of it) as serializer time."""
+
+    def run_validation(self, *args, **kwargs):
+        with span('serializer'):
+            return super().run_validation(*args, **kwargs)
+
+    def to_representation(self, instance):
+        with span('serializer'):
+            return super().to_representation(instance)
+
+
+def _takes_row_locks(sql):
+    statement = sql.lstrip()[:6].upper()
+    return statement in ('UPDATE', 'DELETE') or 'FOR UPDATE' in sql
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db += elapsed
+        if _takes_row_locks(sql):
+            metrics.lock += elapsed
+
+
+def instrument_connection(connection):
+    # outermost, since connection.execute_wrapper() pops the last wrapper on exit
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, execute_wrapper)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    instrument_connection(connection)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='recharge.metrics')
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        # Prometheus buckets are inclusive upper bounds
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+
+    def __init__(self, buckets, query_buckets):
+        self.buckets = buckets
+        self.query_buckets = query_buckets
+        self.phases = {}
+        self.queries = {}
+        self.responses = {}
+        self.retries = {}
+        self.exhausted = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, method, status_code, metrics):
+        with self._lock:
+            for phase in PHASES:
+                key = (view, method, phase)
+                histogram = self.phases.get(key)
+                if histogram is None:
+                    histogram = self.phases[key] = Histogram(self.buckets)
+                histogram.observe(getattr(metrics, phase))
+
+            histogram = self.queries.get((view, method))
+            if histogram is None:
+                histogram = self.queries[(view, method)] = Histogram(self.query_buckets)
+            histogram.observe(metrics.queries)
+
+            key = (view, method, str(status_code))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def count_transaction(self, name, reason, exhausted=False):
+        """Count a retry of a transaction (see recharge/transactions.py), or giving up on it."""
+        counters = self.exhausted if exhausted else self.retries
+        with self._lock:
+            counters[(name, reason)] = counters.get((name, reason), 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.phases.clear()
+            self.queries.clear()
+            self.responses.clear()
+            self.retries.clear()
+            self.exhausted.clear()
+
+    def render(self):
+        """The Prometheus text exposition (format 0.0.4) of everything observed so far."""
+        with self._lock:
+            lines = [
+                '# HELP recharge_request_phase_seconds Time spent per request in each phase.',
+                '# TYPE recharge_request_phase_seconds histogram',
+            ]
+            for (view, method, phase), histogram in sorted(self.phases.items()):
+                lines.extend(_histogram_lines(
+                    'recharge_request_phase_seconds', {'view': view, 'method': method, 'phase': phase}, histogram
+                ))
+            lines += [
+                '# HELP recharge_request_queries Database statements per request.',
+                '# TYPE recharge_request_queries histogram',
+            ]
+            for (view, method), histogram in sorted(self.queries.items()):
+                lines.extend(_histogram_lines('recharge_request_queries', {'view': view, 'method': method}, histogram))
+            lines += [
+                '# HELP recharge_responses_total Responses by view, method and status code.',
+                '# TYPE recharge_responses_total counter',
+            ]
+            for (view, method, status_code), count in sorted(self.responses.items()):
+                labels = _labels({'view': view, 'method': method, 'status': status_code})
+                lines.append(f'recharge_responses_total{{{labels}}} {count}')
+            for metric, description, counters in (
+                ('recharge_transaction_retries_total', 'Transactions retried after lock contention.', self.retries),
+                ('recharge_transaction_retries_exhausted_total',
+                 'Transactions given up on after their retry budget.', self.exhausted),
+            ):
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+                for (name, reason), count in sorted(counters.items()):
+                    lines.append(f'{metric}{{{_labels({"transaction": name, "reason": reason})}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _histogram_lines(name, labels, histogram):
+    for bound, count in histogram.cumulative():
+        yield f'{name}_bucket{{{_labels({**labels, "le": bound})}}} {count}'
+    yield f'{name}_sum{{{_labels(labels)}}} {histogram.sum:g}'
+    yield f'{name}_count{{{_labels(labels)}}} {histogram.count}'
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(metrics_setting('BUCKETS'), metrics_setting('QUERY_BUCKETS'))
+    return _registry
+
+
+def _reset_registry(setting, **kwargs):
+    global _registry
+    if setting == 'REQUEST_METRICS':
+        _registry = None
+
+
+setting_changed.connect(_reset_registry, dispatch_uid='recharge.metrics')
+
+
+class RequestMetricsMiddleware:
+    """Put it first in MIDDLEWARE so that ``total`` covers the rest of the stack."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = metrics_setting('SERVER_TIMING')
+        # connections opened before the middleware was loaded missed connection_created
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(connection)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+
+    def finish(self, request, response, metrics, started):
+        finished = time.perf_counter()
+        metrics.total = finished - started
+        if metrics.view_started is not None:
+            metrics.view = finished - metrics.view_started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        get_registry().observe(view, request.method, response.status_code, metrics)
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = metrics.server_timing()
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    return HttpResponse(get_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
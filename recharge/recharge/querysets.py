@@ -0,0 +1,70 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def _collect(serializer, model, prefix, related, only):
+    """
+    Walk the readable fields of ``serializer`` and record the select_related
+    paths and only() columns needed to render it. Returns False when a field
+    is not a plain model field, in which case only() must not be applied.
+    """
+    shapeable = True
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            shapeable = False
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            shapeable = False
+            continue
+
+        path = prefix + model_field.name
+        if model_field.is_relation:
+            if not model_field.concrete or model_field.many_to_many:
+                shapeable = False
+                continue
+            only.append(path)
+            if isinstance(field, serializers.BaseSerializer) and not isinstance(field, serializers.ListSerializer):
+                related.append(path)
+                shapeable &= _collect(field, model_field.related_model, path + '__', related, only)
+        else:
+            only.append(path)
+    return shapeable
+
+
+@lru_cache(maxsize=None)
+def queryset_shape(serializer_class):
+    """Return ``(select_related paths, only() fields or None)`` for a ModelSerializer class."""
+    serializer = serializer_class()
+    if not isinstance(serializer, serializers.ModelSerializer):
+        return (), None
+
+    related, only = [], []
+    shapeable = _collect(serializer, serializer.Meta.model, '', related, only)
+    return tuple(related), (tuple(only) if shapeable else None)
+
+
+def shape_queryset(queryset, serializer_class):
+    related, only = queryset_shape(serializer_class)
+    if related:
+        queryset = queryset.select_related(*related)
+    if only is not None:
+        queryset = queryset.only(*only)
+    return queryset
+
+
+class ShapedQuerysetMixin:
+    """
+    Fetch exactly what the viewset's serializer renders: nested serializers
+    become select_related joins and the column list is narrowed with only().
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return shape_queryset(queryset, self.get_serializer_class())
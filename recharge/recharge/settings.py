@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -31,6 +34,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'recharge.apps.RechargeConfig',
     'accounts.apps.AccountsConfig',
 
     'django.contrib.admin',
@@ -49,6 +53,7 @@ INSTALLED_APPS = [
 ]
 AUTH_USER_MODEL = 'accounts.User'
 MIDDLEWARE = [
+    'recharge.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,7 +65,7 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -69,6 +74,80 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# Token -> user -> seller cache used by CachedTokenAuthentication
+# (see accounts/authentication.py). TTL is in seconds.
+TOKEN_AUTH_CACHE = {
+    'SIZE': 10000,
+    'TTL': 60,
+}
+
+# Phone number -> id index used when charging by ``number`` (see
+# charge/numbers.py). AUTO_PROVISION creates unknown numbers together with
+# their first sale instead of answering 404.
+PHONE_NUMBERS = {
+    'INDEX_SIZE': 100000,
+    'AUTO_PROVISION': False,
+}
+
+# Replay of final charge / credit request responses (see recharge/idempotency.py).
+# Set CACHE_ALIAS to an entry of CACHES, e.g. a FileBasedCache, to share
+# replays between worker processes.
+IDEMPOTENCY = {
+    'LRU_SIZE': 10000,
+    'CACHE_ALIAS': None,
+    'TIMEOUT': 24 * 60 * 60,
+}
+
+# Ledger (``transactions``) writes, see credits/ledger.py. With WRITE_BEHIND
+# the rows are journaled under JOURNAL_DIR (relative to BASE_DIR) inside the
+# sale's transaction and bulk-inserted by a background flusher; run
+# ``manage.py flush_ledger_journal`` on startup to recover after a crash.
+LEDGER = {
+    'WRITE_BEHIND': False,
+    'JOURNAL_DIR': 'ledger-journal',
+    'FSYNC': True,
+    'AUTO_FLUSH': True,
+    'FLUSH_INTERVAL': 1.0,
+    'FLUSH_BATCH_SIZE': 1000,
+    'ABANDON_AFTER': 300,
+}
+
+# Queued credit request processing (see credits/worker.py): admins enqueue
+# decisions, ``manage.py run_credit_worker`` applies them. LEASE is how many
+# seconds a claimed batch stays with a worker before others may retry it.
+CREDIT_WORKER = {
+    'BATCH_SIZE': 100,
+    'LEASE': 60,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+}
+
+# Retrying the charge and credit transactions on lock contention (see
+# recharge/transactions.py): up to MAX_ATTEMPTS runs within BUDGET seconds,
+# backing off a random 0..min(BACKOFF_CAP, BACKOFF_BASE * 2^n) seconds.
+# CHECK_LOCK_ORDER raises on row locks taken out of LOCK_ORDER. On PostgreSQL
+# each of those transactions gets SET LOCAL statement_timeout / lock_timeout
+# (seconds, None to leave the server's); lock timeouts are retried.
+TRANSACTIONS = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 0.01,
+    'BACKOFF_CAP': 0.25,
+    'BUDGET': 2.0,
+    'CHECK_LOCK_ORDER': DEBUG,
+    'STATEMENT_TIMEOUT': 5.0,
+    'LOCK_TIMEOUT': 1.0,
+}
+
+# Per-request query / timing instrumentation (see recharge/metrics.py),
+# sent as Server-Timing headers and served at /api/metrics/ to admin users.
+# BUCKETS are the histogram bounds in seconds.
+REQUEST_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'BUCKETS': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'QUERY_BUCKETS': (1, 2, 3, 5, 10, 20, 50, 100),
+}
+
 ROOT_URLCONF = 'recharge.urls'
 
 TEMPLATES = [
@@ -92,12 +171,66 @@ WSGI_APPLICATION = 'recharge.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# RECHARGE_DATABASE selects the profile: 'sqlite' (the default, for development
+# and tests) or 'postgres' for production, configured by the POSTGRES_*
+# variables (``compose.yaml`` runs a matching server locally) and needing
+# ``pip install "psycopg[binary,pool]"``. With POSTGRES_POOL (the default)
+# every process keeps a psycopg connection pool; Django does not combine the
+# pool with persistent connections, so without it connections are kept open
+# for CONN_MAX_AGE seconds instead.
+
+DATABASE_PROFILE = os.environ.get('RECHARGE_DATABASE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    POSTGRES_POOL = os.environ.get('POSTGRES_POOL', '1') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'recharge'),
+            'USER': os.environ.get('POSTGRES_USER', 'recharge'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'recharge'),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if POSTGRES_POOL else int(os.environ.get('CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': not POSTGRES_POOL,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', '20')),
+                    'timeout': float(os.environ.get('POSTGRES_POOL_TIMEOUT', '10')),
+                },
+            } if POSTGRES_POOL else {},
+        }
     }
-}
+elif DATABASE_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # take the write lock when a transaction starts, where the busy
+                # timeout applies, instead of failing when a reader upgrades
+                'transaction_mode': 'IMMEDIATE',
+            },
+            # a file, not the in-memory default: threads sharing an in-memory
+            # database lock whole tables and fail instead of waiting
+            'TEST': {
+                'NAME': BASE_DIR / 'test-db.sqlite3',
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"RECHARGE_DATABASE must be 'sqlite' or 'postgres', not {DATABASE_PROFILE!r}")
+
+
+# SQLITE overrides the pragmas set on every new SQLite connection (DEFAULTS
+# in recharge/db.py); None leaves one at SQLite's default. By default WAL lets
+# readers run alongside the writer and synchronous=NORMAL syncs at checkpoints
+# rather than on every commit, which survives process crashes but may lose the
+# last commits on power loss. BUSY_TIMEOUT is in milliseconds, MMAP_SIZE in
+# bytes and a negative CACHE_SIZE in KiB per connection.
+# For example SQLITE = {'SYNCHRONOUS': 'FULL'} syncs on every commit again.
 
 
 # Password validation
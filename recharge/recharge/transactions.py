@@ -0,0 +1,218 @@
+"""
+Retryable charge and credit transactions, row locks taken in LOCK_ORDER.
+"""
+import random
+import re
+import time
+from contextlib import ExitStack, nullcontext
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connection, transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import get_registry
+
+DEFAULTS = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 0.01,
+    'BACKOFF_CAP': 0.25,
+    'BUDGET': 2.0,
+    'CHECK_LOCK_ORDER': False,
+    'STATEMENT_TIMEOUT': None,
+    'LOCK_TIMEOUT': None,
+}
+
+# tables in the order their rows are locked; rows of one table in ascending id order
+LOCK_ORDER = (
+    'credits.CreditRequest',
+    'charge.PhoneNumber',
+    'accounts.Seller',
+    'accounts.SellerCreditShard',
+    'credits.SellerDailyStats',
+    'credits.CreditRequestTask',
+)
+
+SQLSTATE_REASONS = {
+    '40P01': 'deadlock',
+    '40001': 'serialization',
+    '55P03': 'lock_timeout',
+}
+
+MYSQL_REASONS = {
+    1213: 'deadlock',
+    1205: 'lock_timeout',
+}
+
+SQLITE_LOCKED_MESSAGES = ('database is locked', 'database table is locked')
+
+CONTENTION_DETAIL = "The request could not be completed due to concurrent updates, please retry."
+RETRY_AFTER = '1'
+
+
+def transactions_setting(name):
+    return {**DEFAULTS, **getattr(settings, 'TRANSACTIONS', {})}[name]
+
+
+class TransactionContention(OperationalError):
+    """A transaction kept failing on lock contention until its retry budget ran out."""
+
+    def __init__(self, name, attempts, reason):
+        super().__init__(f"{name} failed on {reason} after {attempts} attempts")
+        self.name = name
+        self.attempts = attempts
+        self.reason = reason
+
+
+class LockOrderViolation(RuntimeError):
+    pass
+
+
+def retry_reason(error):
+    """Why ``error`` is worth retrying ('deadlock', 'lock_timeout', ...), or None when it is not."""
+    if not isinstance(error, DatabaseError):
+        return None
+    if isinstance(error, TransactionContention):
+        return error.reason
+    cause = error.__cause__ or error
+    sqlstate = getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+    if sqlstate:
+        return SQLSTATE_REASONS.get(sqlstate)
+    args = getattr(cause, 'args', ())
+    if args and args[0] in MYSQL_REASONS:
+        return MYSQL_REASONS[args[0]]
+    message = str(error).lower()
+    if any(locked in message for locked in SQLITE_LOCKED_MESSAGES):
+        return 'database_locked'
+    return None
+
+
+_UPDATE = re.compile(r'^\s*UPDATE\s+[`"]?(\w+)', re.IGNORECASE)
+_FROM = re.compile(r'\bFROM\s+[`"]?(\w+)', re.IGNORECASE)
+_ranks = None
+
+
+def _lock_ranks():
+    global _ranks
+    if _ranks is None:
+        _ranks = {apps.get_model(label)._meta.db_table: rank for rank, label in enumerate(LOCK_ORDER)}
+    return _ranks
+
+
+def _locked_table(sql):
+    match = _UPDATE.match(sql)
+    if match is None and 'FOR UPDATE' in sql.upper():
+        match = _FROM.search(sql)
+    return match.group(1) if match is not None else None
+
+
+class LockOrderChecker:
+    """Execute wrapper checking the transactions opened after it was created against LOCK_ORDER."""
+
+    def __init__(self):
+        self.depth = len(connection.atomic_blocks)
+        self.transaction = None
+
+    def __call__(self, execute, sql, params, many, context):
+        table = _locked_table(sql)
+        rank = _lock_ranks().get(table)
+        if rank is not None and len(connection.atomic_blocks) > self.depth:
+            block = connection.atomic_blocks[self.depth]
+            if block is not self.transaction:
+                self.transaction = block
+                self.held = set()
+                self.last = (-1, None)
+            if rank < self.last[0] and table not in self.held:
+                raise LockOrderViolation(
+                    f"{table} locked after {self.last[1]}; LOCK_ORDER takes {table} first"
+                )
+            self.held.add(table)
+            if rank > self.last[0]:
+                self.last = (rank, table)
+        return execute(sql, params, many, context)
+
+
+class TransactionTimeouts:
+    """Execute wrapper starting each transaction opened after it was created with SET LOCAL timeouts."""
+
+    def __init__(self, statement_timeout, lock_timeout):
+        self.depth = len(connection.atomic_blocks)
+        self.transaction = None
+        self.statements = [
+            f"SET LOCAL {name} = {int(seconds * 1000)}"
+            for name, seconds in (('statement_timeout', statement_timeout), ('lock_timeout', lock_timeout))
+            if seconds is not None
+        ]
+
+    def __call__(self, execute, sql, params, many, context):
+        if len(connection.atomic_blocks) > self.depth:
+            block = connection.atomic_blocks[self.depth]
+            if block is not self.transaction:
+                self.transaction = block
+                # the driver's cursor, so the SETs skip the execute wrappers
+                for statement in self.statements:
+                    context['cursor'].cursor.execute(statement)
+        return execute(sql, params, many, context)
+
+
+def _wrappers():
+    wrappers = []
+    if transactions_setting('CHECK_LOCK_ORDER'):
+        wrappers.append(LockOrderChecker())
+    if connection.vendor == 'postgresql':
+        timeouts = TransactionTimeouts(
+            transactions_setting('STATEMENT_TIMEOUT'), transactions_setting('LOCK_TIMEOUT')
+        )
+        if timeouts.statements:
+            wrappers.append(timeouts)
+    return wrappers
+
+
+def _backoff(attempt):
+    ceiling = min(transactions_setting('BACKOFF_CAP'), transactions_setting('BACKOFF_BASE') * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def run_transaction(fn, *args, name=None, atomic=True, **kwargs):
+    """
+    Call ``fn(*args, **kwargs)`` in a transaction and retry it on lock
+    contention. Pass ``atomic=False`` for functions that open their own
+    transactions. Inside an outer atomic block the whole transaction is
+    already lost on contention, so the error is raised (as
+    TransactionContention) for the outermost run to retry.
+    """
+    name = name or fn.__name__
+    retryable = not connection.in_atomic_block
+    max_attempts = transactions_setting('MAX_ATTEMPTS')
+    deadline = time.monotonic() + transactions_setting('BUDGET')
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with ExitStack() as stack:
+                for wrapper in _wrappers():
+                    stack.enter_context(connection.execute_wrapper(wrapper))
+                with transaction.atomic() if atomic else nullcontext():
+                    return fn(*args, **kwargs)
+        except DatabaseError as e:
+            reason = retry_reason(e)
+            if reason is None:
+                raise
+            if not retryable:
+                raise TransactionContention(name, attempt, reason) from e
+            delay = _backoff(attempt)
+            if attempt >= max_attempts or time.monotonic() + delay > deadline:
+                get_registry().count_transaction(name, reason, exhausted=True)
+                raise TransactionContention(name, attempt, reason) from e
+            get_registry().count_transaction(name, reason)
+        time.sleep(delay)
+
+
+def contention_response():
+    return Response(
+        {"detail": CONTENTION_DETAIL},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': RETRY_AFTER}
+    )
@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken import views
 
+from recharge.metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,4 +27,5 @@ urlpatterns = [
     path('api/token-auth/', views.obtain_auth_token),
     path('api/credits/', include('credits.urls')),
     path('api/charge/', include('charge.urls')),
+    path('api/metrics/', metrics_view, name='metrics'),
 ]
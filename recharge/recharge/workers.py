@@ -0,0 +1,35 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+
+
+def default_workers():
+    return min(8, os.cpu_count() or 1)
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def map_in_processes(fn, tasks, workers):
+    """
+    Yield ``fn(task)`` for every task, in order, using ``workers`` processes.
+
+    ``fn`` must be a module-level function. Each worker opens its own
+    database connections; with one worker everything runs in-process.
+    """
+    if workers <= 1:
+        yield from map(fn, tasks)
+        return
+
+    # forked workers must not share the parent's connections, or its connection pools
+    connections.close_all()
+    for connection in connections.all(initialized_only=True):
+        if connection.alias in getattr(connection, '_connection_pools', ()):
+            connection.close_pool()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield from pool.map(fn, tasks)